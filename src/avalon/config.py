@@ -1,7 +1,13 @@
+import os
+
 import yaml
 from lakefs_sdk import Configuration
 
 
+HASH_CACHE_FILE = "avalon-hash-cache.sqlite"
+DOWNLOAD_JOURNAL_FILE = "avalon-download-journal.sqlite"
+
+
 class Config:
     def __init__(self, lakefs_conf_path: str, temp_dir: str = None):
         self.lakefs_conf_path = lakefs_conf_path
@@ -19,4 +25,12 @@ class Config:
         configuration.host = config_raw["server"]["endpoint_url"]
         return configuration
 
+    def get_hash_cache_path(self) -> str:
+        if not self.temp_dir:
+            raise Exception("Error: hash cache requires a temp dir")
+        return os.path.join(self.temp_dir, HASH_CACHE_FILE)
 
+    def get_journal_path(self) -> str:
+        if not self.temp_dir:
+            raise Exception("Error: download journal requires a temp dir")
+        return os.path.join(self.temp_dir, DOWNLOAD_JOURNAL_FILE)
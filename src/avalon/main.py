@@ -1,9 +1,19 @@
 import argparse
+import asyncio
 import os
+import sys
 
-from avalon.mainoperations import get_files, put_files
+from avalon.mainoperations import get_files, put_files, get_files_async, put_files_async, put_files_batch, \
+    load_put_manifest, put_files_import, put_files_commit, put_stream, put_files_bundled
+from avalon.operations.AsyncLakeFsWrapper import AsyncLakeFsWrapper, MAX_IN_FLIGHT
 from avalon.operations.LakeFsWrapper import LakeFsWrapper
 from avalon.config import Config
+from avalon.operations import metrics
+from avalon.operations.bundles import BUNDLE_SIZE
+from avalon.operations.files import PathFilter, read_path_list, parse_shard
+from avalon.operations.hashcache import HashCache
+from avalon.operations.journal import DownloadJournal
+from avalon.operations.objectcache import ObjectCache, OBJECT_CACHE_MAX_BYTES
 
 
 def parse_env():
@@ -13,42 +23,183 @@ def parse_env():
     }
 
 
+async def _run_async(operation, configuration, max_in_flight: int, **kwargs):
+    async with AsyncLakeFsWrapper(configuration, max_in_flight=max_in_flight) as client:
+        await operation(lake_fs_client=client, **kwargs)
+
+
 def main(args):
+    if not (args.metrics or args.metrics_json or args.metrics_prom):
+        _run_command(args)
+        return
+    registry = metrics.enable()
+    try:
+        _run_command(args)
+    finally:
+        metrics.disable()
+        if args.metrics:
+            print(registry.summary(), file=sys.stderr)
+        if args.metrics_json:
+            registry.write_json(args.metrics_json)
+        if args.metrics_prom:
+            registry.write_prometheus(args.metrics_prom, labels={"command": args.sub_command})
+
+
+def _run_command(args):
     command = args.sub_command
     env_args = parse_env()
     config = Config(
         lakefs_conf_path=env_args["config_path"],
         temp_dir=args.temp_dir)
-    client = LakeFsWrapper(configuration=config.get_config())
+    configuration = config.get_config()
+    if command == "get":
+        # each download worker holds its own connection
+        configuration.connection_pool_maxsize = max(configuration.connection_pool_maxsize,
+                                                    args.concurrency * args.range_parallelism)
+    client = LakeFsWrapper(configuration=configuration)
+    hash_cache = HashCache(config.get_hash_cache_path()) if args.hash_cache else None
 
-    if command == "put":
-        put_files(
+    if command == "put" and args.manifest:
+        if args.use_async:
+            raise Exception("Error: --manifest is not supported with --async")
+        manifest = load_put_manifest(args.manifest)
+        manifest.branch = manifest.branch or env_args['lakefs_branch']
+        put_files_batch(manifest, lake_fs_client=client, concurrency=args.concurrency, isolate=args.isolate)
+    elif command == "put" and args.commit_only:
+        commit = put_files_commit(repo=args.repository,
+                                  branch=env_args['lakefs_branch'],
+                                  task_name=args.task_name,
+                                  pipeline_id=args.pipeline_name,
+                                  task_docker_image=args.task_image,
+                                  task_args=args.task_args,
+                                  lake_fs_client=client,
+                                  commit_id=args.commit_id)
+        print(commit or "nothing to commit")
+    elif command == "put" and args.stdin:
+        if args.use_async:
+            raise Exception("Error: --stdin is not supported with --async")
+        put_stream(sys.stdin.buffer,
+                   remote_path=args.remote_path,
+                   repo=args.repository,
+                   branch=env_args['lakefs_branch'],
+                   task_name=args.task_name,
+                   pipeline_id=args.pipeline_name,
+                   task_docker_image=args.task_image,
+                   task_args=args.task_args,
+                   lake_fs_client=client,
+                   s3storage=args.s3,
+                   commit_id=args.commit_id,
+                   source_branch_name=args.source_branch,
+                   commit=not args.no_commit)
+    elif command == "put" and args.bundle_threshold is not None:
+        if args.use_async or args.skip_unchanged or args.shard or args.no_commit:
+            raise Exception("Error: --bundle-threshold is not supported with --async, --skip-unchanged, "
+                            "--shard or --no-commit")
+        put_files_bundled(local_path=args.local_path,
+                          remote_path=args.remote_path,
+                          repo=args.repository,
+                          branch=env_args['lakefs_branch'],
+                          task_name=args.task_name,
+                          pipeline_id=args.pipeline_name,
+                          task_docker_image=args.task_image,
+                          task_args=args.task_args,
+                          lake_fs_client=client,
+                          s3storage=args.s3,
+                          commit_id=args.commit_id,
+                          source_branch_name=args.source_branch,
+                          bundle_threshold=args.bundle_threshold * 1024,
+                          bundle_size=args.bundle_size * 1024 * 1024,
+                          concurrency=args.concurrency,
+                          delete_removed=args.delete_removed,
+                          ignore=args.ignore)
+    elif command == "put" and args.import_from:
+        put_files_import(import_from=args.import_from,
+                         remote_path=args.remote_path,
+                         repo=args.repository,
+                         branch=env_args['lakefs_branch'],
+                         task_name=args.task_name,
+                         pipeline_id=args.pipeline_name,
+                         task_docker_image=args.task_image,
+                         task_args=args.task_args,
+                         lake_fs_client=client,
+                         s3storage=args.s3,
+                         commit_id=args.commit_id,
+                         source_branch_name=args.source_branch)
+    elif command == "put":
+        put_args = dict(
             local_path=args.local_path,
             remote_path=args.remote_path,
+            repo=args.repository,
             branch=env_args['lakefs_branch'],
-            lake_fs_client=client,
             task_name=args.task_name,
             pipeline_id=args.pipeline_name,
             task_docker_image=args.task_image,
             task_args=args.task_args,
-            commit_id=args.commit_id
+            s3storage=args.s3,
+            commit_id=args.commit_id,
+            source_branch_name=args.source_branch,
+            concurrency=args.concurrency,
+            skip_unchanged=args.skip_unchanged,
+            delete_removed=args.delete_removed,
+            hash_cache=hash_cache,
+            shard=parse_shard(args.shard) if args.shard else None,
+            commit=not args.no_commit,
+            ignore=args.ignore
         )
+        if args.use_async:
+            asyncio.run(_run_async(put_files_async, configuration, args.max_in_flight, **put_args))
+        else:
+            put_files(lake_fs_client=client, **put_args)
     else:
-        get_files(
+        get_args = dict(
             local_path=args.local_path,
             remote_path=args.remote_path,
             branch=args.branch,
-            lake_fs_client=client,
             changes_only=args.changed_files_only,
             repo=args.repository,
-
+            concurrency=args.concurrency,
+            chunk_size=args.chunk_size * 1024 * 1024,
+            range_parallelism=args.range_parallelism,
+            hash_cache=hash_cache,
+            page_size=args.page_size,
+            delete_removed=args.delete_removed
         )
+        if args.resume:
+            if args.use_async:
+                raise Exception("Error: --resume is not supported with --async")
+            get_args["journal"] = DownloadJournal(config.get_journal_path())
+        if args.object_cache:
+            get_args["object_cache"] = ObjectCache(args.object_cache,
+                                                   max_bytes=int(args.object_cache_size * 1024 ** 3),
+                                                   link=args.object_cache_link)
+        if args.include or args.exclude or args.paths_from or args.shard:
+            get_args["path_filter"] = PathFilter(include=args.include, exclude=args.exclude,
+                                                 paths=read_path_list(args.paths_from) if args.paths_from else None,
+                                                 shard=parse_shard(args.shard) if args.shard else None)
+        if args.unbundle:
+            if args.use_async:
+                raise Exception("Error: --unbundle is not supported with --async")
+            get_args["unbundle"] = True
+        if args.use_async:
+            asyncio.run(_run_async(get_files_async, configuration, args.max_in_flight, **get_args))
+        else:
+            get_files(lake_fs_client=client, **get_args)
 
 
 def cli():
     parser = argparse.ArgumentParser()
     parser.add_argument("-t", "--temp-dir", help="Temporary Dir", default=None)
     parser.add_argument("-s", "--s3",action="store_true")
+    parser.add_argument("--hash-cache", help="Cache file checksums and downloads in the temp dir",
+                        action="store_true")
+    parser.add_argument("--async", help="Use the asyncio client", action="store_true", dest="use_async")
+    parser.add_argument("--max-in-flight", help="Max number of requests in flight with --async", type=int,
+                        default=MAX_IN_FLIGHT)
+    parser.add_argument("--metrics", help="Print counters and timers per phase and API call when done",
+                        action="store_true")
+    parser.add_argument("--metrics-json", help="Write metrics as JSON to this file", default=None)
+    parser.add_argument("--metrics-prom", help="Write metrics in Prometheus text format to this file, "
+                                               "e.g. for the node exporter textfile collector", default=None)
     sub_parsers = parser.add_subparsers(help="Sub commands", dest="sub_command")
 
     parser_get_file = sub_parsers.add_parser("get", help="Gets file from Lakefs repo", )
@@ -57,6 +208,33 @@ def cli():
     parser_get_file.add_argument("-c", "--changed-files-only", help="To get changed files only", default=False)
     parser_get_file.add_argument("-r", "--repository", help="repository to get data from")
     parser_get_file.add_argument("-b", "--branch", help="repository branch")
+    parser_get_file.add_argument("-j", "--concurrency", help="Number of files downloaded in parallel", type=int,
+                                 default=1)
+    parser_get_file.add_argument("--chunk-size", help="Size of a ranged request in MiB", type=int, default=32)
+    parser_get_file.add_argument("--range-parallelism", help="Number of ranges of a file downloaded in parallel",
+                                 type=int, default=1)
+    parser_get_file.add_argument("--page-size", help="Number of objects listed per request (max 1000)", type=int,
+                                 default=1000)
+    parser_get_file.add_argument("--delete-removed", help="With changed files only, delete local files removed "
+                                                          "from the repository", action="store_true")
+    parser_get_file.add_argument("--resume", help="Journal progress in the temp dir and resume an interrupted get",
+                                 action="store_true")
+    parser_get_file.add_argument("--object-cache", help="Node local cache dir of downloaded objects, "
+                                                        "shared between processes", default=None)
+    parser_get_file.add_argument("--object-cache-size", help="Max size of the object cache in GiB", type=float,
+                                 default=OBJECT_CACHE_MAX_BYTES // 1024 ** 3)
+    parser_get_file.add_argument("--object-cache-link", help="Hardlink files from the object cache, "
+                                                             "files are read only", action="store_true")
+    parser_get_file.add_argument("--include", help="Get only paths matching this glob, e.g. '*.parquet', "
+                                                   "may be repeated", action="append", default=None)
+    parser_get_file.add_argument("--exclude", help="Skip paths matching this glob, may be repeated",
+                                 action="append", default=None)
+    parser_get_file.add_argument("--paths-from", help="File of exact remote paths to get, one per line",
+                                 default=None)
+    parser_get_file.add_argument("--unbundle", help="Write files bundled by put --bundle-threshold "
+                                                    "instead of the bundles", action="store_true")
+    parser_get_file.add_argument("--shard", help="i/n, get only the i-th of n shards (from 0) of the files, "
+                                                 "so n workers can split one get", default=None)
 
     parser_put_file = sub_parsers.add_parser("put", help="Puts file to Lakefs repo")
     parser_put_file.add_argument("-l", "--local-path", help="Local dir to push")
@@ -64,8 +242,38 @@ def cli():
     parser_put_file.add_argument("-p", "--pipeline-name", help="Pipeline name", default="default=pipeline")
     parser_put_file.add_argument("-t", "--task-name", help="Task name", default="default-task")
     parser_put_file.add_argument("-i", "--task-image", help="Docker image used to run task", default="helxplatform/roger")
-    parser_put_file.add_argument("-cid", "--commit-id", help="Commit id of input data", default=None)
+    parser_put_file.add_argument("-cid", "--commit-id", help="Commit id of input data", default="")
     parser_put_file.add_argument("-a", "--task-args", help="Args used to run image", default=[])
+    parser_put_file.add_argument("--repository", help="repository to put data to")
+    parser_put_file.add_argument("--source-branch", help="Branch to create the branch from", default="main")
+    parser_put_file.add_argument("-j", "--concurrency", help="Number of files uploaded in parallel", type=int,
+                                 default=1)
+    parser_put_file.add_argument("--skip-unchanged", help="Upload only files whose checksum differs from remote",
+                                 action="store_true")
+    parser_put_file.add_argument("--delete-removed", help="Delete remote files that no longer exist locally",
+                                 action="store_true")
+    parser_put_file.add_argument("--manifest", help="YAML or JSON manifest of files to put for several tasks, "
+                                                    "replaces the single task options", default=None)
+    parser_put_file.add_argument("--import-from", help="Import objects under this storage URI (s3://... or "
+                                                        "local://...) by reference instead of uploading local "
+                                                        "files", default=None)
+    parser_put_file.add_argument("--isolate", help="With --manifest, commit every task on a staging branch "
+                                                   "and merge them at the end", action="store_true")
+    parser_put_file.add_argument("--shard", help="i/n, put only the i-th of n shards (from 0) of the files, "
+                                                 "so n workers can split one put", default=None)
+    parser_put_file.add_argument("--ignore", help="Skip local files and directories matching this glob, "
+                                                  "e.g. '*.tmp', may be repeated", action="append", default=None)
+    parser_put_file.add_argument("--bundle-threshold", help="Pack files up to this size in KiB into tar bundles "
+                                                            "with an index, for datasets of many small files",
+                                 type=int, default=None)
+    parser_put_file.add_argument("--bundle-size", help="Max size of a bundle in MiB", type=int,
+                                 default=BUNDLE_SIZE // 1024 ** 2)
+    parser_put_file.add_argument("--stdin", help="Upload stdin to the object at --remote-path, "
+                                                 "e.g. the output of a pipe", action="store_true")
+    parser_put_file.add_argument("--no-commit", help="Upload without committing, e.g. in sharded workers",
+                                 action="store_true")
+    parser_put_file.add_argument("--commit-only", help="Commit files uploaded by --no-commit workers "
+                                                       "with the task metadata", action="store_true")
     
     args = parser.parse_args()
     main(args)
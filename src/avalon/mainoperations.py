@@ -1,13 +1,30 @@
+import asyncio
 import datetime
 import logging
 import os
+import re
+import tempfile
 import urllib3
+import uuid
+import yaml
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
 from lakefs_sdk.exceptions import NotFoundException, ApiException
 from retrying import retry
 
-from avalon.models.pipeline import CommitMetaData, Commit, Repository
-from avalon.operations.LakeFsWrapper import LakeFsWrapper
-from avalon.operations.files import get_filepaths, get_dest_filepaths
+from avalon.models.pipeline import CommitMetaData, Commit, Repository, GetResult, PutManifest
+from avalon.operations.AsyncLakeFsWrapper import AsyncLakeFsWrapper, MAX_IN_FLIGHT
+from avalon.operations.LakeFsWrapper import LakeFsWrapper, DOWNLOAD_CHUNK_SIZE
+from avalon.operations.files import get_filepaths, get_dest_filepaths, compute_checksum, PathFilter, \
+    in_shard, scan_files
+from avalon.operations import metrics
+from avalon.operations.bundles import BUNDLE_DIR, BUNDLE_SIZE, is_bundle_path, is_index_path, write_bundles, \
+    unbundle as unbundle_files
+from avalon.operations.commitindex import CommitIndex
+from avalon.operations.hashcache import HashCache
+from avalon.operations.journal import DownloadJournal
+from avalon.operations.objectcache import ObjectCache
+from avalon.operations.transfer import location_of
 
 logger = logging.Logger('avalon')
 
@@ -32,36 +49,235 @@ def get_files(local_path: str,
               lake_fs_client: LakeFsWrapper,
               changes_only: bool,
               changes_from: str = None,
-              changes_to: str = None):
-    all_repos = [r.Id for r in lake_fs_client.list_repo()]
-
+              changes_to: str = None,
+              concurrency: int = 1,
+              chunk_size: int = DOWNLOAD_CHUNK_SIZE,
+              range_parallelism: int = 1,
+              hash_cache: HashCache = None,
+              page_size: int = 1000,
+              delete_removed: bool = False,
+              journal: DownloadJournal = None,
+              object_cache: ObjectCache = None,
+              path_filter: PathFilter = None,
+              unbundle: bool = False) -> GetResult:
+    """
+    :param path_filter: downloads only the selected paths, an exact path list replaces the listing
+    :param unbundle: writes the files bundled by put_files_bundled instead of downloading the bundles
+    """
     if not os.path.exists(local_path):
         raise Exception("Error: local path does not exist")
-    if not repo in all_repos:
+    if not lake_fs_client.repository_exists(repo):
         raise Exception("Error: repository does not exist")
 
+    # pin the branch so commits made during the get do not mix into the downloaded files
+    with metrics.timer("phase.resolve"):
+        ref = lake_fs_client.get_commit_id(repository_name=repo, ref=branch)
+    logger.info(f"Downloading {repo}/{branch} at commit {ref}")
 
     filelist = []
+    removed_files = []
 
     if changes_only:
         try:
             # if commit_id is empty nonexistant then we will get all files, not just changed ones
-            filelist = lake_fs_client.get_changes(repository=repo, branch=branch, remote_path=remote_path,
-                                                  from_commit_id=changes_from, to_commit_id=changes_to)
+            diffs = lake_fs_client.iter_changes(repository=repo, branch=ref, remote_path=remote_path,
+                                                from_commit_id=changes_from, to_commit_id=changes_to,
+                                                page_size=page_size)
+            filelist = _split_removed(diffs, removed_files)
         except NotFoundException:
-            filelist = lake_fs_client.get_filelist(repository=repo, branch=branch, remote_path=remote_path)
+            filelist = lake_fs_client.iter_remote_objects(repository=repo, branch=ref, remote_path=remote_path,
+                                                          page_size=page_size)
+    elif path_filter is not None and path_filter.paths is not None and not unbundle:
+        # exact paths need no listing, a missing path fails its download
+        filelist = _paths_under(path_filter.paths, remote_path)
     else:
-        filelist = lake_fs_client.get_filelist(repository=repo, branch=branch, remote_path=remote_path)
+        # files are listed lazily, downloads start while later pages are fetched.
+        # listed sizes and checksums are passed on, so downloads do not stat every file
+        filelist = lake_fs_client.iter_remote_objects(repository=repo, branch=ref, remote_path=remote_path,
+                                                      page_size=page_size)
+    index_paths = []
+    if unbundle:
+        filelist = _split_bundles(filelist, index_paths)
+    if path_filter is not None:
+        filelist = _select_paths(filelist, path_filter)
 
     try:
         logger.info("Trying to download files from LakeFS")
-        lake_fs_client.download_files(remote_files=filelist, local_path=local_path, repository=repo, branch_or_commit_id=branch)
+        # listing is lazy, list and download overlap in this phase
+        with metrics.timer("phase.download"):
+            lake_fs_client.download_files(remote_files=filelist, local_path=local_path, repository=repo,
+                                          branch_or_commit_id=ref, concurrency=concurrency,
+                                          chunk_size=chunk_size, range_parallelism=range_parallelism,
+                                          hash_cache=hash_cache, journal=journal, object_cache=object_cache)
         logger.info("Downloading files from LakeFS completed")
     except Exception as ex:
         logger.info("Failed to download files from LakeFS ")
         logger.exception(ex)
         raise
 
+    if index_paths:
+        with metrics.timer("phase.unbundle"), tempfile.TemporaryDirectory(prefix="avalon-bundles-") as bundle_dir:
+            def download_bundle(bundle):
+                bundle_path = os.path.join(bundle_dir, os.path.basename(bundle))
+                lake_fs_client.download_file(bundle_path, ref, bundle, repo, chunk_size=chunk_size,
+                                             parallelism=range_parallelism)
+                return bundle_path
+
+            count = unbundle_files(lake_fs_client, repo, ref, index_paths, local_path,
+                                   select=path_filter.matches if path_filter is not None else None,
+                                   download_bundle=download_bundle, concurrency=concurrency)
+        logger.info(f"Unbundled {count} files")
+
+    if delete_removed:
+        if path_filter is not None:
+            removed_files = list(path_filter.filter(removed_files))
+        with metrics.timer("phase.delete_local"):
+            _delete_local_files(local_path, removed_files)
+
+    return GetResult(repository=repo, branch=branch, commit_id=ref)
+
+
+async def get_files_async(local_path: str,
+                          remote_path: str,
+                          repo: str,
+                          branch: str,
+                          lake_fs_client: AsyncLakeFsWrapper,
+                          changes_only: bool,
+                          changes_from: str = None,
+                          changes_to: str = None,
+                          concurrency: int = MAX_IN_FLIGHT,
+                          chunk_size: int = DOWNLOAD_CHUNK_SIZE,
+                          range_parallelism: int = 1,
+                          hash_cache: HashCache = None,
+                          page_size: int = 1000,
+                          delete_removed: bool = False,
+                          object_cache: ObjectCache = None,
+                          path_filter: PathFilter = None) -> GetResult:
+    """
+    get_files on top of AsyncLakeFsWrapper, listing and downloads overlap on one event loop
+    """
+    if not os.path.exists(local_path):
+        raise Exception("Error: local path does not exist")
+    if not await lake_fs_client.repository_exists(repo):
+        raise Exception("Error: repository does not exist")
+
+    with metrics.timer("phase.resolve"):
+        ref = await lake_fs_client.get_commit_id(repository_name=repo, ref=branch)
+    logger.info(f"Downloading {repo}/{branch} at commit {ref}")
+
+    removed_files = []
+
+    if changes_only:
+        try:
+            diffs = await lake_fs_client.iter_changes(repository=repo, branch=ref, remote_path=remote_path,
+                                                      from_commit_id=changes_from, to_commit_id=changes_to,
+                                                      page_size=page_size)
+            filelist = _split_removed_async(diffs, removed_files)
+        except NotFoundException:
+            filelist = lake_fs_client.iter_remote_objects(repository=repo, branch=ref, remote_path=remote_path,
+                                                          page_size=page_size)
+    elif path_filter is not None and path_filter.paths is not None:
+        filelist = _paths_under(path_filter.paths, remote_path)
+    else:
+        filelist = lake_fs_client.iter_remote_objects(repository=repo, branch=ref, remote_path=remote_path,
+                                                      page_size=page_size)
+    if path_filter is not None:
+        filelist = _select_paths_async(filelist, path_filter)
+
+    try:
+        logger.info("Trying to download files from LakeFS")
+        with metrics.timer("phase.download"):
+            await lake_fs_client.download_files(remote_files=filelist, local_path=local_path, repository=repo,
+                                                branch_or_commit_id=ref, concurrency=concurrency,
+                                                chunk_size=chunk_size, range_parallelism=range_parallelism,
+                                                hash_cache=hash_cache, object_cache=object_cache)
+        logger.info("Downloading files from LakeFS completed")
+    except Exception as ex:
+        logger.info("Failed to download files from LakeFS ")
+        logger.exception(ex)
+        raise
+
+    if delete_removed:
+        if path_filter is not None:
+            removed_files = list(path_filter.filter(removed_files))
+        with metrics.timer("phase.delete_local"):
+            _delete_local_files(local_path, removed_files)
+
+    return GetResult(repository=repo, branch=branch, commit_id=ref)
+
+
+def _split_removed(diffs, removed_files: list):
+    """
+    Yields paths of added and changed files, collecting paths of removed files into removed_files
+    """
+    for d in diffs:
+        if d.type == 'removed':
+            removed_files.append(d.path)
+        elif d.type in ('added', 'changed'):
+            yield d.path
+
+
+async def _split_removed_async(diffs, removed_files: list):
+    async for d in diffs:
+        if d.type == 'removed':
+            removed_files.append(d.path)
+        elif d.type in ('added', 'changed'):
+            yield d.path
+
+
+def _split_bundles(remote_files, index_paths: list):
+    """
+    Yields remote files that are not bundles, collecting paths of bundle indexes into index_paths
+    """
+    for remote_file in remote_files:
+        path = location_of(remote_file)
+        if is_index_path(path):
+            index_paths.append(path)
+        elif not is_bundle_path(path):
+            yield remote_file
+
+
+def _paths_under(paths, remote_path: str) -> List[str]:
+    """
+    Returns the sorted paths that start with remote_path ('*' for all paths), as the listing would select them
+    """
+    selected = sorted(p for p in paths if remote_path == '*' or p.startswith(remote_path))
+    if len(selected) < len(paths):
+        logger.warning(f"Skipping {len(paths) - len(selected)} listed paths outside of {remote_path}")
+        metrics.count("files.excluded", len(paths) - len(selected))
+    return selected
+
+
+def _select_paths(paths, path_filter: PathFilter):
+    """
+    Yields the paths or RemoteObjects selected by path_filter, counting the others as files.excluded
+    """
+    for path in paths:
+        if path_filter.matches(location_of(path)):
+            yield path
+        else:
+            metrics.count("files.excluded")
+
+
+async def _select_paths_async(paths, path_filter: PathFilter):
+    if not hasattr(paths, "__aiter__"):
+        for path in _select_paths(paths, path_filter):
+            yield path
+        return
+    async for path in paths:
+        if path_filter.matches(location_of(path)):
+            yield path
+        else:
+            metrics.count("files.excluded")
+
+
+def _delete_local_files(local_path: str, remote_paths) -> None:
+    for path in remote_paths:
+        local_file = os.path.join(local_path, path)
+        if os.path.isfile(local_file):
+            logger.info(f"Deleting file removed from LakeFS: {local_file}")
+            os.remove(local_file)
+
 
 
 def put_files(local_path: str,
@@ -75,12 +291,419 @@ def put_files(local_path: str,
               lake_fs_client: LakeFsWrapper,
               s3storage: bool,
               commit_id: str,
-              source_branch_name: None):
+              source_branch_name: None,
+              concurrency: int = 1,
+              skip_unchanged: bool = False,
+              delete_removed: bool = False,
+              hash_cache: HashCache = None,
+              shard: Tuple[int, int] = None,
+              commit: bool = True,
+              ignore: List[str] = None):
+    """
+    :param ignore: fnmatch patterns of local files and directories not to put
+    :param shard: (i, n), put only the files of the i-th of n shards, partitioned by destination path
+    :param commit: False for the upload-only workers of a sharded put, put_files_commit commits their files
+    """
+    with metrics.timer("phase.prepare"):
+        _create_repositry_branch_IfNotExists(branch, lake_fs_client, repo, s3storage, source_branch_name)
+
+    # files are uploaded while the tree is scanned, unless they are compared to the remote files first
+    local_files = scan_files(local_path, remote_path, ignore=ignore)
+    if shard is not None:
+        local_files = _select_shard(local_files, shard)
+    removed_paths = []
+
+    if skip_unchanged or delete_removed:
+        with metrics.timer("phase.scan"):
+            local_files = list(local_files)
+        with metrics.timer("phase.compare"):
+            remote_stats = lake_fs_client.get_object_stats(branch=branch, repository=repo, remote_path=remote_path)
+            if delete_removed:
+                local_dest_paths = {f.dest_path for f in local_files}
+                removed_paths = sorted(p for p in remote_stats
+                                       if p not in local_dest_paths and (shard is None or in_shard(p, shard)))
+            if skip_unchanged:
+                local_files = _select_changed_files(local_files, remote_stats, concurrency, hash_cache)
+
+        if not local_files and not removed_paths:
+            logger.info("All files are unchanged, nothing to commit")
+            return
+
+    with metrics.timer("phase.upload"):
+        results = lake_fs_client.upload_local_files(branch, repo, local_files, concurrency=concurrency)
+    _check_upload_results(results)
+    cmt = _make_commit(repo, branch, task_name, pipeline_id, task_docker_image, task_args, commit_id,
+                       [r.local_path for r in results], removed_paths)
+
+    if removed_paths:
+        logger.info(f"Deleting {len(removed_paths)} files removed locally from LakeFS")
+        with metrics.timer("phase.delete_remote"):
+            lake_fs_client.delete_files(branch=branch, repository=repo, remote_paths=removed_paths)
+
+    if not commit:
+        logger.info("Files are uploaded, the commit is left to the coordinator")
+        return
+
+    # if uploaded files are the same, it will cause an exception.
+    # we can ignore such situation
+    try:
+        with metrics.timer("phase.commit"):
+            lake_fs_client.commit_files(cmt)
+    except ApiException as ex:
+        if str.find(ex.body, 'commit: no changes') == -1:
+            raise ex
+
+
+def put_files_import(import_from: str,
+                     remote_path: str,
+                     repo: str,
+                     branch: str,
+                     task_name: str,
+                     pipeline_id: str,
+                     task_docker_image: str,
+                     task_args,
+                     lake_fs_client: LakeFsWrapper,
+                     s3storage: bool,
+                     commit_id: str,
+                     source_branch_name: None) -> str:
+    """
+    put_files for outputs that already are in object storage LakeFS can read, e.g. the storage namespace.
+    Objects under import_from are imported into remote_path by reference and committed, only metadata moves.
+    :return: id of the import commit
+    """
     _create_repositry_branch_IfNotExists(branch, lake_fs_client, repo, s3storage, source_branch_name)
 
-    files = get_filepaths(local_path)
-    dest_paths = get_dest_filepaths(files, local_path, remote_path)
+    cmt = _make_commit(repo, branch, task_name, pipeline_id, task_docker_image, task_args, commit_id, [], [])
+    logger.info(f"Importing {import_from} into {repo}/{branch}/{remote_path}")
+    return lake_fs_client.import_files(cmt, source_uri=import_from, remote_path=remote_path)
+
+
+def put_files_bundled(local_path: str,
+                      remote_path: str,
+                      repo: str,
+                      branch: str,
+                      task_name: str,
+                      pipeline_id: str,
+                      task_docker_image: str,
+                      task_args,
+                      lake_fs_client: LakeFsWrapper,
+                      s3storage: bool,
+                      commit_id: str,
+                      source_branch_name: None,
+                      bundle_threshold: int,
+                      bundle_size: int = BUNDLE_SIZE,
+                      concurrency: int = 1,
+                      delete_removed: bool = False,
+                      ignore: List[str] = None):
+    """
+    put_files for datasets of many small files. Files up to bundle_threshold bytes are packed into tar bundles
+    of up to bundle_size bytes under remote_path/.avalon-bundles, with an index of where every file is.
+    get_files with unbundle=True writes them back as single files.
+    The bundles of a previous put to remote_path are replaced.
+    """
+    with metrics.timer("phase.prepare"):
+        _create_repositry_branch_IfNotExists(branch, lake_fs_client, repo, s3storage, source_branch_name)
+
+    with metrics.timer("phase.scan"):
+        local_files = list(scan_files(local_path, remote_path, ignore=ignore))
+
+    with tempfile.TemporaryDirectory(prefix="avalon-bundles-") as work_dir:
+        with metrics.timer("phase.bundle"):
+            uploads = [f for f in local_files if f.size > bundle_threshold]
+            uploads += write_bundles([f for f in local_files if f.size <= bundle_threshold], remote_path, work_dir,
+                                     bundle_size)
+        upload_dest_paths = {f.dest_path for f in uploads}
+
+        with metrics.timer("phase.compare"):
+            if delete_removed:
+                remote_paths = lake_fs_client.iter_filelist(branch, repo, os.path.join(remote_path, ""))
+            else:
+                # bundles of the previous put that are not overwritten
+                remote_paths = lake_fs_client.iter_filelist(branch, repo, os.path.join(remote_path, BUNDLE_DIR, ""))
+            removed_paths = sorted(p for p in remote_paths if p not in upload_dest_paths)
+
+        with metrics.timer("phase.upload"):
+            results = lake_fs_client.upload_local_files(branch, repo, uploads, concurrency=concurrency)
+        _check_upload_results(results)
+
+    if removed_paths:
+        logger.info(f"Deleting {len(removed_paths)} files from LakeFS")
+        with metrics.timer("phase.delete_remote"):
+            lake_fs_client.delete_files(branch=branch, repository=repo, remote_paths=removed_paths)
+
+    cmt = _make_commit(repo, branch, task_name, pipeline_id, task_docker_image, task_args, commit_id,
+                       [f.local_path for f in local_files], removed_paths)
+    with metrics.timer("phase.commit"):
+        return _commit_if_changed(lake_fs_client, cmt)
+
+
+def put_stream(stream,
+               remote_path: str,
+               repo: str,
+               branch: str,
+               task_name: str,
+               pipeline_id: str,
+               task_docker_image: str,
+               task_args,
+               lake_fs_client: LakeFsWrapper,
+               s3storage: bool,
+               commit_id: str,
+               source_branch_name: None,
+               commit: bool = True) -> Optional[str]:
+    """
+    put_files for a task that writes its output as a stream, e.g. to a pipe, so it is not spilled to disk first.
+    :param stream: binary file object or iterable of bytes
+    :param remote_path: path of the object in LakeFS
+    :param commit: False to upload only, e.g. in a worker of a sharded put
+    :return: id of the commit, or None if nothing was committed
+    """
+    with metrics.timer("phase.prepare"):
+        _create_repositry_branch_IfNotExists(branch, lake_fs_client, repo, s3storage, source_branch_name)
+
+    cmt = _make_commit(repo, branch, task_name, pipeline_id, task_docker_image, task_args, commit_id,
+                       [remote_path], [])
+    with metrics.timer("phase.upload"):
+        result = lake_fs_client.upload_stream(cmt.branch, cmt.repo, stream, remote_path)
+    _check_upload_results([result])
+
+    if not commit:
+        return None
+    with metrics.timer("phase.commit"):
+        return _commit_if_changed(lake_fs_client, cmt)
+
+
+def put_files_commit(repo: str,
+                     branch: str,
+                     task_name: str,
+                     pipeline_id: str,
+                     task_docker_image: str,
+                     task_args,
+                     lake_fs_client: LakeFsWrapper,
+                     commit_id: str) -> Optional[str]:
+    """
+    Coordinator of a sharded put: commits the files uploaded by put_files workers with commit=False
+    in one commit with the task metadata. Run it after every worker succeeded.
+    :return: id of the commit, or None if the workers changed nothing
+    """
+    cmt = _make_commit(repo, branch, task_name, pipeline_id, task_docker_image, task_args, commit_id, [], [])
+    with metrics.timer("phase.commit"):
+        return _commit_if_changed(lake_fs_client, cmt)
+
+
+def _select_shard(local_files, shard: Tuple[int, int]):
+    """
+    Yields the local files whose destination path belongs to shard
+    """
+    return (f for f in local_files if in_shard(f.dest_path, shard))
+
+
+async def put_files_async(local_path: str,
+                          remote_path: str,
+                          repo: str,
+                          branch: str,
+                          task_name: str,
+                          pipeline_id: str,
+                          task_docker_image: str,
+                          task_args,
+                          lake_fs_client: AsyncLakeFsWrapper,
+                          s3storage: bool,
+                          commit_id: str,
+                          source_branch_name: None,
+                          concurrency: int = MAX_IN_FLIGHT,
+                          skip_unchanged: bool = False,
+                          delete_removed: bool = False,
+                          hash_cache: HashCache = None,
+                          shard: Tuple[int, int] = None,
+                          commit: bool = True,
+                          ignore: List[str] = None):
+    """
+    put_files on top of AsyncLakeFsWrapper
+    """
+    with metrics.timer("phase.prepare"):
+        await _create_repositry_branch_IfNotExists_async(branch, lake_fs_client, repo, s3storage,
+                                                         source_branch_name)
+
+    with metrics.timer("phase.scan"):
+        local_files = list(scan_files(local_path, remote_path, ignore=ignore))
+    if shard is not None:
+        local_files = list(_select_shard(local_files, shard))
+    removed_paths = []
+
+    if skip_unchanged or delete_removed:
+        with metrics.timer("phase.compare"):
+            remote_stats = await lake_fs_client.get_object_stats(branch=branch, repository=repo,
+                                                                 remote_path=remote_path)
+            if delete_removed:
+                local_dest_paths = {f.dest_path for f in local_files}
+                removed_paths = sorted(p for p in remote_stats
+                                       if p not in local_dest_paths and (shard is None or in_shard(p, shard)))
+            if skip_unchanged:
+                local_files = await asyncio.to_thread(_select_changed_files, local_files, remote_stats,
+                                                      concurrency, hash_cache)
+
+    files = [f.local_path for f in local_files]
+    dest_paths = [f.dest_path for f in local_files]
+    cmt = _make_commit(repo, branch, task_name, pipeline_id, task_docker_image, task_args, commit_id, files,
+                       removed_paths)
+
+    if (skip_unchanged or delete_removed) and not files and not removed_paths:
+        logger.info("All files are unchanged, nothing to commit")
+        return
+
+    with metrics.timer("phase.upload"):
+        results = await lake_fs_client.upload_files(cmt.branch, cmt.repo, files, dest_paths, concurrency=concurrency)
+    _check_upload_results(results)
+
+    if removed_paths:
+        logger.info(f"Deleting {len(removed_paths)} files removed locally from LakeFS")
+        with metrics.timer("phase.delete_remote"):
+            await lake_fs_client.delete_files(branch=branch, repository=repo, remote_paths=removed_paths)
+
+    if not commit:
+        logger.info("Files are uploaded, the commit is left to the coordinator")
+        return
+
+    try:
+        with metrics.timer("phase.commit"):
+            await lake_fs_client.commit_files(cmt)
+    except ApiException as ex:
+        if str.find(ex.body, 'commit: no changes') == -1:
+            raise ex
+
+
+def load_put_manifest(path: str) -> PutManifest:
+    """
+    Reads a put manifest from a YAML or JSON file
+    """
+    with open(path) as stream:
+        return PutManifest.parse_obj(yaml.safe_load(stream))
+
+
+def put_files_batch(manifest: PutManifest,
+                    lake_fs_client: LakeFsWrapper,
+                    concurrency: int = 1,
+                    isolate: bool = False) -> Dict[str, str]:
+    """
+    Puts the files of every manifest entry, repository and branches are checked once for the whole batch.
+    By default entries of a branch with the same task metadata are uploaded together and committed in one commit,
+    so every commit carries the metadata of the tasks whose files it holds.
+    With isolate, every entry is uploaded and committed with its own task metadata on a staging branch,
+    staging branches are merged into their branch only after all entries were committed.
+    :return: branch -> id of the last commit made to it
+    """
+    entries_by_branch = {}
+    for entry in manifest.entries:
+        branch = entry.branch or manifest.branch
+        if not branch:
+            raise Exception(f"Error: no branch for manifest entry of task {entry.task_name}")
+        entries_by_branch.setdefault(branch, []).append(entry)
+    for branch in entries_by_branch:
+        _create_repositry_branch_IfNotExists(branch, lake_fs_client, manifest.repo, manifest.s3storage,
+                                             manifest.source_branch)
+
+    if isolate:
+        return _put_entries_isolated(manifest.repo, entries_by_branch, lake_fs_client, concurrency)
+
+    commit_ids = {}
+    for branch, entries in entries_by_branch.items():
+        groups = {}
+        for entry in entries:
+            key = (entry.task_name, entry.pipeline_id, entry.task_image, tuple(entry.task_args), entry.input_commit_id)
+            groups.setdefault(key, []).append(entry)
+        for group in groups.values():
+            entry = group[0]
+            files, dest_paths = _manifest_files(group)
+            results = lake_fs_client.upload_files(branch, manifest.repo, files, dest_paths, concurrency=concurrency)
+            _check_upload_results(results)
+            cmt = _make_commit(manifest.repo, branch, entry.task_name, entry.pipeline_id, entry.task_image,
+                               entry.task_args, entry.input_commit_id, files, [])
+            commit_id = _commit_if_changed(lake_fs_client, cmt)
+            if commit_id is not None:
+                commit_ids[branch] = commit_id
+    return commit_ids
+
+
+def _put_entries_isolated(repo: str, entries_by_branch: Dict[str, list], lake_fs_client: LakeFsWrapper,
+                          concurrency: int) -> Dict[str, str]:
+    staged = [(branch, entry) for branch, entries in entries_by_branch.items() for entry in entries]
+    workers = max(1, min(concurrency, len(staged)))
+    staging_branches = {}
+
+    def stage(i):
+        branch, entry = staged[i]
+        staging_branch = f"{branch}-{re.sub(r'[^-_a-zA-Z0-9]', '-', entry.task_name)}-{uuid.uuid4().hex[:8]}"
+        lake_fs_client.create_branch(staging_branch, repo, source_branch=branch)
+        staging_branches[i] = staging_branch
+        files, dest_paths = _manifest_files([entry])
+        results = lake_fs_client.upload_files(staging_branch, repo, files, dest_paths,
+                                              concurrency=max(1, concurrency // workers))
+        _check_upload_results(results)
+        cmt = _make_commit(repo, staging_branch, entry.task_name, entry.pipeline_id, entry.task_image,
+                           entry.task_args, entry.input_commit_id, files, [])
+        return _commit_if_changed(lake_fs_client, cmt)
 
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(stage, i) for i in range(len(staged))]
+        failed = [staged[i][1].task_name for i, f in enumerate(futures) if f.exception() is not None]
+        for i, f in enumerate(futures):
+            if f.exception() is not None:
+                logger.error(f"Failed to put files of task {staged[i][1].task_name}: {f.exception()}")
+        if failed:
+            raise Exception(f"Failed to put {len(failed)} of {len(staged)} manifest entries, "
+                            f"nothing was merged: {failed}")
+    except BaseException:
+        for staging_branch in staging_branches.values():
+            lake_fs_client.delete_branch(staging_branch, repo)
+        raise
+
+    # a staging branch is deleted only once it is merged, so committed work of a failed merge is kept
+    commit_ids = {}
+    merged = []
+    for i, f in enumerate(futures):
+        branch, entry = staged[i]
+        if f.result() is not None:
+            logger.info(f"Merging {staging_branches[i]} into {branch}")
+            try:
+                commit_ids[branch] = lake_fs_client.merge_branch(staging_branches[i], branch, repo,
+                                                                 message=f"merge task: {entry.task_name}, "
+                                                                         f"pipeline: {entry.pipeline_id}")
+            except Exception as ex:
+                kept = [staging_branches[j] for j in range(i, len(staged)) if futures[j].result() is not None]
+                logger.error(f"Failed to merge {staging_branches[i]} into {branch}: {ex}")
+                raise Exception(f"Failed to merge task {entry.task_name}, merged tasks: {merged}, "
+                                f"staging branches not merged are kept: {kept}") from ex
+            merged.append(entry.task_name)
+        try:
+            lake_fs_client.delete_branch(staging_branches[i], repo)
+        except Exception as ex:
+            logger.warning(f"Failed to delete staging branch {staging_branches[i]}: {ex}")
+    return commit_ids
+
+
+def _manifest_files(entries):
+    files, dest_paths = [], []
+    for entry in entries:
+        entry_files = get_filepaths(entry.local_path)
+        files += entry_files
+        dest_paths += get_dest_filepaths(entry_files, entry.local_path, entry.remote_path)
+    return files, dest_paths
+
+
+def _commit_if_changed(lake_fs_client: LakeFsWrapper, cmt: Commit):
+    """
+    Commits and returns the commit id, or None if nothing changed
+    """
+    try:
+        return lake_fs_client.commit_files(cmt).id
+    except ApiException as ex:
+        if str.find(ex.body, 'commit: no changes') == -1:
+            raise ex
+    return None
+
+
+def _make_commit(repo, branch, task_name, pipeline_id, task_docker_image, task_args, commit_id, files,
+                 removed_paths) -> Commit:
     cmt_meta = CommitMetaData(
         pipeline_id=pipeline_id,
         task_name=task_name,
@@ -88,49 +711,83 @@ def put_files(local_path: str,
         input_commit_id=commit_id,
         args=task_args
     )
-    cmt = Commit(
+    return Commit(
         message=f"commit pushed by task: {task_name}, pipeline: {pipeline_id}",
         repo=repo,
         branch=branch,
         metadata=cmt_meta,
         files_added=files,
+        files_removed=removed_paths,
         committer="avalon",
         commit_date=datetime.datetime.now()
     )
 
-    lake_fs_client.upload_files(cmt.branch, cmt.repo, files, dest_paths)
 
-    # if uploaded files are the same, it will cause an exception.
-    # we can ignore such situation
-    try:
-        lake_fs_client.commit_files(cmt)
-    except ApiException as ex:
-        if str.find(ex.body, 'commit: no changes') == -1:
-            raise ex
+def _check_upload_results(results) -> None:
+    """
+    Logs upload results and raises if any file failed to upload
+    """
+    failed = [r for r in results if not r.success]
+    logger.info(f"Uploaded {len(results) - len(failed)} of {len(results)} files to LakeFS")
+    if failed:
+        for r in failed:
+            logger.error(f"Failed to upload {r.local_path} to {r.dest_path} after {r.attempts} attempts: {r.error}")
+        raise Exception(f"Failed to upload {len(failed)} of {len(results)} files to LakeFS")
+
+
+def _select_changed_files(local_files, remote_stats, concurrency: int = 1, hash_cache: HashCache = None):
+    """
+    Returns the local files whose size or md5 differ from the remote object.
+    Remote checksums that are not plain md5 (multipart ETags) always count as changed.
+    """
+    checksum = hash_cache.checksum if hash_cache is not None else compute_checksum
+
+    def is_changed(local_file):
+        stats = remote_stats.get(local_file.dest_path)
+        if stats is None or stats.size_bytes != local_file.size:
+            return True
+        return checksum(local_file.local_path) != stats.checksum.strip('"')
 
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        changed = list(executor.map(is_changed, local_files))
+    logger.info(f"{changed.count(False)} of {len(local_files)} files are unchanged and will not be uploaded")
+    return [f for f, c in zip(local_files, changed) if c]
 
-def get_last_input_commit_id(branch, lake_fs_client, remote_path, repo):
 
-    commits = lake_fs_client.list_commits(repository_name=repo, branch_name=branch, path=remote_path.split("/"))
+def get_last_input_commit_id(branch, lake_fs_client, remote_path, repo, page_size: int = 1000):
+
+    commits = lake_fs_client.iter_commits(repository_name=repo, branch_name=branch, path=remote_path.split("/"),
+                                          page_size=page_size)
     commit_id = ""
 
-    i = 0
-    while commit_id == "" and i < len(commits.results):
-        commit_id = commits.results[i].metadata[INPUT_COMMIT_ID]
-        i += 1
+    for c in commits:
+        commit_id = (c.metadata or {}).get(INPUT_COMMIT_ID, "")
+        if commit_id != "":
+            break
 
     if len(commit_id) != 64:
         logger.error("metafile content is not valid")
     return commit_id
 
 
-def get_commit_id_by_input_commit_id(branch, lake_fs_client, remote_path, repo, input_commit_id):
+def get_commit_id_by_input_commit_id(branch, lake_fs_client, remote_path, repo, input_commit_id,
+                                     page_size: int = 1000, commit_index: CommitIndex = None):
 
-    commits = lake_fs_client.list_commits(repository_name=repo, branch_name=branch, path=remote_path.split("/"))
+    if commit_index is not None:
+        commit_index.refresh(lake_fs_client, repository=repo, branch=branch, remote_path=remote_path,
+                             page_size=page_size)
+        commit_ids = commit_index.find(repo, branch, remote_path, input_commit_id=input_commit_id)
+        commit_id = commit_ids[0] if commit_ids else ""
+        if len(commit_id) != 64:
+            logger.error("metafile content is not valid")
+        return commit_id
+
+    commits = lake_fs_client.iter_commits(repository_name=repo, branch_name=branch, path=remote_path.split("/"),
+                                          page_size=page_size)
     commit_id = ""
 
-    for c in commits.results:
-        cur_input_commit_id = c.metadata[INPUT_COMMIT_ID]
+    for c in commits:
+        cur_input_commit_id = (c.metadata or {}).get(INPUT_COMMIT_ID)
         if input_commit_id == cur_input_commit_id:
             commit_id = c.id
             break
@@ -141,13 +798,38 @@ def get_commit_id_by_input_commit_id(branch, lake_fs_client, remote_path, repo,
 
 
 def _create_repositry_branch_IfNotExists(branch, lake_fs_client, repo, s3storage, source_branch_name=None):
-    all_repos = [r.Id for r in lake_fs_client.list_repo()]
-
-    if not repo in all_repos:
+    if not lake_fs_client.repository_exists(repo):
         r = Repository(repo, f"local://{repo}/")
         if s3storage:
             r = Repository(repo, f"s3://{repo}/")
-        lake_fs_client.create_repository(r)
+        try:
+            lake_fs_client.create_repository(r)
+        except ApiException as ex:
+            # created meanwhile by another worker of a sharded put
+            if ex.status != 409:
+                raise
     if branch != "main":
-        lake_fs_client.create_branch(branch, repo, source_branch=source_branch_name)
+        try:
+            lake_fs_client.create_branch(branch, repo, source_branch=source_branch_name)
+        except ApiException as ex:
+            if ex.status != 409:
+                raise
+
 
+async def _create_repositry_branch_IfNotExists_async(branch, lake_fs_client, repo, s3storage,
+                                                     source_branch_name=None):
+    if not await lake_fs_client.repository_exists(repo):
+        r = Repository(repo, f"local://{repo}/")
+        if s3storage:
+            r = Repository(repo, f"s3://{repo}/")
+        try:
+            await lake_fs_client.create_repository(r)
+        except ApiException as ex:
+            if ex.status != 409:
+                raise
+    if branch != "main":
+        try:
+            await lake_fs_client.create_branch(branch, repo, source_branch=source_branch_name)
+        except ApiException as ex:
+            if ex.status != 409:
+                raise
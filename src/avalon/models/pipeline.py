@@ -1,7 +1,7 @@
 from dataclasses import dataclass
 from datetime import datetime
 from pydantic import BaseModel, Field, conlist
-from typing import List, Union
+from typing import List, Optional, Union
 
 
 class CommitMetaData(BaseModel):
@@ -30,6 +30,26 @@ class Commit(BaseModel):
     id: str = Field(default="")
 
 
+class PutManifestEntry(BaseModel):
+    local_path: str
+    remote_path: str
+    task_name: str
+    pipeline_id: str
+    task_image: str
+    task_args: List[str] = []
+    input_commit_id: str = ""
+    # defaults to the branch of the manifest
+    branch: Optional[str] = None
+
+
+class PutManifest(BaseModel):
+    repo: str
+    branch: Optional[str] = None
+    source_branch: str = "main"
+    s3storage: bool = False
+    entries: List[PutManifestEntry]
+
+
 class Task(BaseModel):
     task_name: str
     task_image: str
@@ -42,3 +62,42 @@ class Task(BaseModel):
 class Repository:
     Id: str
     StorageNamespace: str
+
+
+@dataclass
+class UploadResult:
+    local_path: str
+    dest_path: str
+    status_code: Optional[int] = None
+    error: Optional[str] = None
+    attempts: int = 0
+
+    @property
+    def success(self) -> bool:
+        return self.error is None
+
+
+@dataclass
+class GetResult:
+    repository: str
+    branch: str
+    # commit the branch pointed to when the get started, every file was read from it
+    commit_id: str
+
+
+@dataclass(frozen=True)
+class LocalFile:
+    # file found by scan_files, mtime in seconds since the epoch
+    local_path: str
+    dest_path: str
+    size: int
+    mtime: float
+
+
+@dataclass(frozen=True)
+class RemoteObject:
+    # object as listed by LakeFS, carries what a download needs so it does not stat the object again
+    path: str
+    size: int
+    checksum: str
+    mtime: Optional[int] = None
@@ -0,0 +1,481 @@
+import asyncio
+import logging
+import os
+import urllib.parse
+from typing import AsyncIterator, Dict, List
+
+import httpx
+from lakefs_sdk import Configuration, Diff, ObjectStats
+from lakefs_sdk import Commit as LakeFsCommit
+from lakefs_sdk.exceptions import ApiException, NotFoundException, ServiceException
+
+from avalon.models.pipeline import Commit, Repository, UploadResult, RemoteObject
+from avalon.operations.LakeFsWrapper import DOWNLOAD_CHUNK_SIZE, RANGE_RETRY_MAX, RANGE_RETRY_DELAY, \
+    UPLOAD_RETRY_MAX, UPLOAD_RETRY_DELAY, METADATA_CACHE_TTL
+from avalon.operations import metrics
+from avalon.operations.hashcache import HashCache
+from avalon.operations.objectcache import ObjectCache
+from avalon.operations.transfer import IncompleteRangeError, TtlCache, partial_path, remote_object_from_stats, \
+    location_of
+
+MAX_IN_FLIGHT = int(os.environ.get("LAKEFS_MAX_IN_FLIGHT", 100))
+UPLOAD_BLOCK_SIZE = 1024 * 1024
+
+
+def _is_transient(exception):
+    """Returns True if a failed request should be tried again"""
+    return isinstance(exception, (httpx.TransportError, ServiceException, IncompleteRangeError))
+
+
+async def _with_retries(request, max_attempts: int, delay_ms: int):
+    """
+    Awaits request() until it succeeds, a non transient error is raised or max_attempts is reached.
+    Waits with exponential backoff between attempts.
+    """
+    attempt = 1
+    while True:
+        try:
+            return await request()
+        except Exception as ex:
+            if attempt >= max_attempts or not _is_transient(ex):
+                raise
+            metrics.count("retries.request")
+            await asyncio.sleep(delay_ms * 2 ** attempt / 1000)
+            attempt += 1
+
+
+async def _pwrite(fd: int, data: bytes, offset: int) -> None:
+    """
+    Writes data at offset of fd in a thread. A cancelled caller still waits for the write to finish,
+    so fd is not written after the caller closed it.
+    """
+    write = asyncio.ensure_future(asyncio.to_thread(os.pwrite, fd, data, offset))
+    try:
+        await asyncio.shield(write)
+    except asyncio.CancelledError:
+        await write
+        raise
+
+
+def _quote(segment: str) -> str:
+    return urllib.parse.quote(segment, safe="")
+
+
+class AsyncLakeFsWrapper:
+    """
+    asyncio counterpart of LakeFsWrapper talking to the LakeFS REST API with httpx.
+    A semaphore bounds the number of requests in flight across all operations of one instance,
+    so listings, stats, range fetches, uploads and commits of one process can overlap.
+    Use as `async with AsyncLakeFsWrapper(configuration) as client:` or call aclose().
+    """
+    def __init__(self, configuration: Configuration, max_in_flight: int = MAX_IN_FLIGHT):
+        self._config = configuration
+        self._semaphore = asyncio.Semaphore(max_in_flight)
+        self._client = httpx.AsyncClient(base_url=configuration.host,
+                                         auth=(configuration.username, configuration.password),
+                                         limits=httpx.Limits(max_connections=max_in_flight,
+                                                             max_keepalive_connections=max_in_flight),
+                                         timeout=httpx.Timeout(60.0, connect=10.0))
+        self._existing = TtlCache(METADATA_CACHE_TTL)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.aclose()
+
+    async def aclose(self) -> None:
+        await self._client.aclose()
+
+    async def _request(self, operation: str, method: str, url: str, **kwargs) -> httpx.Response:
+        """
+        :param operation: name of the API operation the latency is recorded as, as in LakeFsWrapper
+        """
+        async with self._semaphore:
+            with metrics.timer(f"api.{operation}"):
+                resp = await self._client.request(method, url, **kwargs)
+        if resp.status_code >= 400:
+            if resp.status_code == 404:
+                ex = NotFoundException(status=resp.status_code, reason=resp.reason_phrase)
+            elif resp.status_code >= 500:
+                ex = ServiceException(status=resp.status_code, reason=resp.reason_phrase)
+            else:
+                ex = ApiException(status=resp.status_code, reason=resp.reason_phrase)
+            ex.body = resp.text
+            raise ex
+        return resp
+
+    async def _paginate(self, operation: str, url: str, params: dict, page_size: int = 1000) -> AsyncIterator[dict]:
+        has_results = True
+        next_page = None
+        while has_results:
+            page_params = dict(params, amount=page_size)
+            if next_page:
+                page_params["after"] = next_page
+            page = (await self._request(operation, "GET", url, params=page_params)).json()
+            for result in page["results"]:
+                yield result
+            has_results = page["pagination"]["has_more"]
+            next_page = page["pagination"]["next_offset"]
+
+    async def list_repo(self) -> List[Repository]:
+        """
+        Lists available repos
+        :return: List[Repository].
+        """
+        return [Repository(r["id"], r["storage_namespace"])
+                async for r in self._paginate("list_repositories", "/repositories", {})]
+
+    async def create_repository(self, repo: Repository) -> None:
+        """
+        Creates repository
+        :param repo: repository name
+        """
+        await self._request("create_repository", "POST", "/repositories",
+                            json={"name": repo.Id, "storage_namespace": repo.StorageNamespace})
+        self._existing.add((repo.Id,))
+
+    async def repository_exists(self, repository_name: str) -> bool:
+        """
+        Returns True if the repository exists, a positive answer is cached for LAKEFS_METADATA_CACHE_TTL seconds
+        """
+        if (repository_name,) in self._existing:
+            return True
+        try:
+            await self._request("get_repository", "GET", f"/repositories/{_quote(repository_name)}")
+        except NotFoundException:
+            return False
+        self._existing.add((repository_name,))
+        return True
+
+    async def branch_exists(self, repository_name: str, branch_name: str) -> bool:
+        """
+        Returns True if the branch exists, a positive answer is cached for LAKEFS_METADATA_CACHE_TTL seconds
+        """
+        if (repository_name, branch_name) in self._existing:
+            return True
+        try:
+            await self._request("get_branch", "GET",
+                                f"/repositories/{_quote(repository_name)}/branches/{_quote(branch_name)}")
+        except NotFoundException:
+            return False
+        self._existing.add((repository_name, branch_name))
+        return True
+
+    async def create_branch(self, branch_name: str, repository_name: str, source_branch: str = "main"):
+        """
+        Creates new branch if it does not exist
+        """
+        if await self.branch_exists(repository_name, branch_name):
+            return {"id": branch_name}
+        resp = await self._request("create_branch", "POST", f"/repositories/{_quote(repository_name)}/branches",
+                                   json={"name": branch_name, "source": source_branch})
+        self._existing.add((repository_name, branch_name))
+        return {"commit_id": resp.text, "id": branch_name}
+
+    async def get_filelist(self, branch: str, repository: str, remote_path: str, page_size: int = 1000) -> List[str]:
+        """
+        Returns lists of files
+        :param branch: branch name
+        :param repository: repository name
+        :param remote_path: path as in Lakefs
+        :param page_size: number of objects requested per page
+        :return:
+        """
+        return [path async for path in self.iter_filelist(branch, repository, remote_path, page_size=page_size)]
+
+    async def iter_filelist(self, branch: str, repository: str, remote_path: str,
+                            page_size: int = 1000) -> AsyncIterator[str]:
+        """
+        Yields paths of files starting with remote_path ('*' for all files), fetching pages as they are consumed
+        """
+        prefix = None if remote_path == '*' else remote_path
+        async for obj in self._iter_objects(branch, repository, prefix, page_size):
+            yield obj.path
+
+    async def iter_remote_objects(self, branch: str, repository: str, remote_path: str,
+                                  page_size: int = 1000) -> AsyncIterator[RemoteObject]:
+        """
+        Like iter_filelist, but yields path, size and checksum of every file as listed
+        """
+        prefix = None if remote_path == '*' else remote_path
+        async for obj in self._iter_objects(branch, repository, prefix, page_size):
+            yield remote_object_from_stats(obj)
+
+    async def get_object_stats(self, branch: str, repository: str, remote_path: str) -> Dict[str, ObjectStats]:
+        """
+        Returns stats (checksum, size, mtime) of every object under remote_path
+        """
+        return {obj.path: obj async for obj in self._iter_objects(branch, repository, os.path.join(remote_path, ""))}
+
+    async def _iter_objects(self, branch: str, repository: str, prefix: str,
+                            page_size: int = 1000) -> AsyncIterator[ObjectStats]:
+        params = {"prefix": prefix} if prefix else {}
+        async for obj in self._paginate("list_objects",
+                                        f"/repositories/{_quote(repository)}/refs/{_quote(branch)}/objects/ls",
+                                        params, page_size):
+            yield ObjectStats.from_dict(obj)
+
+    async def delete_files(self, branch: str, repository: str, remote_paths: List[str]) -> None:
+        """
+        Deletes objects from a branch, 1000 paths per request
+        """
+        for i in range(0, len(remote_paths), 1000):
+            resp = await self._request("delete_objects", "POST",
+                                       f"/repositories/{_quote(repository)}/branches/{_quote(branch)}/objects/delete",
+                                       json={"paths": remote_paths[i:i + 1000]})
+            errors = resp.json().get("errors")
+            if errors:
+                raise Exception(f"Failed to delete files from lakefs: {errors}")
+
+    async def iter_commits(self, repository_name: str, branch_name: str, path: [str],
+                           page_size: int = 1000) -> AsyncIterator[LakeFsCommit]:
+        """
+        Yields commits in a branch, newest first, fetching pages as they are consumed
+        """
+        async for c in self._paginate("log_commits",
+                                      f"/repositories/{_quote(repository_name)}/refs/{_quote(branch_name)}/commits",
+                                      {"prefixes": path}, page_size):
+            yield LakeFsCommit.from_dict(c)
+
+    async def get_commit_id(self, repository_name: str, ref: str) -> str:
+        """
+        Resolves a branch, tag or commit id to the id of the commit it points to
+        """
+        resp = await self._request("get_commit", "GET",
+                                   f"/repositories/{_quote(repository_name)}/commits/{_quote(ref)}")
+        return resp.json()["id"]
+
+    async def commit_files(self, commit: Commit) -> LakeFsCommit:
+        """
+        Commits files to a branch
+        """
+        resp = await self._request("commit", "POST",
+                                   f"/repositories/{_quote(commit.repo)}/branches/{_quote(commit.branch)}/commits",
+                                   json={"message": commit.message, "metadata": commit.metadata.dict(exclude={"args"})})
+        return LakeFsCommit.from_dict(resp.json())
+
+    async def get_changes(self, branch: str, repository: str, remote_path: str, from_commit_id: str,
+                          to_commit_id: str = None, page_size: int = 1000) -> List[str]:
+        """
+        Returns list of remote paths that were changed since specified commit
+        """
+        diffs = await self.iter_changes(branch, repository, remote_path, from_commit_id, to_commit_id,
+                                        page_size=page_size)
+        return [d.path async for d in diffs if d.type in ('added', 'changed')]
+
+    async def iter_changes(self, branch: str, repository: str, remote_path: str, from_commit_id: str,
+                           to_commit_id: str = None, page_size: int = 1000) -> AsyncIterator[Diff]:
+        """
+        Returns an async iterator over all diff entries under remote_path since specified commit.
+        Raises NotFoundException right away if branch has no commits under remote_path after from_commit_id.
+        """
+        if to_commit_id is None:
+            latest = None
+            async for c in self.iter_commits(repository, branch, remote_path.split("/"), page_size=1):
+                latest = c
+                break
+            if latest is None or latest.id == from_commit_id:
+                raise NotFoundException()
+            to_commit_id = latest.id
+
+        return self._iter_diff(repository, from_commit_id, to_commit_id, remote_path, page_size)
+
+    async def _iter_diff(self, repository: str, left_ref: str, right_ref: str, prefix: str,
+                         page_size: int = 1000) -> AsyncIterator[Diff]:
+        async for d in self._paginate("diff_refs", f"/repositories/{_quote(repository)}/refs/{_quote(left_ref)}"
+                                                   f"/diff/{_quote(right_ref)}", {"prefix": prefix}, page_size):
+            yield Diff.from_dict(d)
+
+    async def download_files(self, remote_files, local_path: str, repository: str, branch_or_commit_id: str,
+                             concurrency: int = MAX_IN_FLIGHT, chunk_size: int = DOWNLOAD_CHUNK_SIZE,
+                             range_parallelism: int = 1, hash_cache: HashCache = None,
+                             object_cache: ObjectCache = None) -> None:
+        """
+        Downloads files from LakeFs
+        :param remote_files: iterable or async iterable of remote paths or listed RemoteObjects in LakeFs
+        :param local_path: local path, destination for files
+        :param repository: repository name
+        :param branch_or_commit_id: branch name or commit_id
+        :param concurrency: number of files downloaded at once
+        :param chunk_size: size in bytes of a single ranged request
+        :param range_parallelism: number of ranges of one file downloaded at once
+        :param hash_cache: if set, files already downloaded with the same checksum are skipped
+        :param object_cache: if set, cached objects are materialized instead of downloaded
+        """
+        queue = asyncio.Queue(maxsize=2 * concurrency)
+        failed = []
+        total = 0
+
+        async def worker():
+            while (remote_file := await queue.get()) is not None:
+                location = location_of(remote_file)
+                dest_path = os.path.join(local_path, location)
+                try:
+                    os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+                    await self.download_file(dest_path, branch_or_commit_id, location, repository,
+                                             chunk_size=chunk_size, parallelism=range_parallelism,
+                                             hash_cache=hash_cache, object_cache=object_cache,
+                                             remote_object=remote_file if isinstance(remote_file, RemoteObject)
+                                             else None)
+                except Exception as ex:
+                    logging.error("Failed to download file: {0}, {1}".format(location, ex))
+                    failed.append(location)
+
+        workers = [asyncio.create_task(worker()) for _ in range(max(1, concurrency))]
+        try:
+            if hasattr(remote_files, "__aiter__"):
+                async for remote_file in remote_files:
+                    total += 1
+                    await queue.put(remote_file)
+            else:
+                for remote_file in remote_files:
+                    total += 1
+                    await queue.put(remote_file)
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+        except BaseException:
+            for w in workers:
+                w.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            raise
+        if failed:
+            raise Exception(f"Failed to download {len(failed)} of {total} files from lakefs: {failed}")
+
+    async def download_file(self, dest_path, branch_or_commit_id, location, repository,
+                            chunk_size: int = DOWNLOAD_CHUNK_SIZE, parallelism: int = 1,
+                            hash_cache: HashCache = None, object_cache: ObjectCache = None,
+                            remote_object: RemoteObject = None):
+        """
+        Downloads a single file in ranges of chunk_size bytes, up to parallelism ranges at once,
+        into a temporary file which is renamed to dest_path when the download completed.
+        :param remote_object: size and checksum as listed, the object is stat'ed if not given
+        """
+        logging.info("Downloading file: {0}, {1}, {2}".format(branch_or_commit_id, location, repository))
+        base_url = f"/repositories/{_quote(repository)}/refs/{_quote(branch_or_commit_id)}/objects"
+        if remote_object is None:
+            remote_object = remote_object_from_stats(ObjectStats.from_dict((await self._request(
+                "stat_object", "GET", f"{base_url}/stat", params={"path": location})).json()))
+        file_size = remote_object.size
+        checksum = remote_object.checksum
+        # the caches are SQLite and file system calls, they run in threads to not block the event loop
+        if hash_cache is not None and await asyncio.to_thread(hash_cache.is_downloaded, dest_path, repository,
+                                                              location, checksum):
+            logging.info("File is already downloaded: {0}".format(dest_path))
+            metrics.count("files.skipped")
+            return
+        if object_cache is not None and await asyncio.to_thread(object_cache.get, checksum, file_size, dest_path):
+            logging.info("File is materialized from object cache: {0}".format(dest_path))
+            metrics.count("files.object_cache_hits")
+            if hash_cache is not None:
+                await asyncio.to_thread(hash_cache.record_download, dest_path, repository, branch_or_commit_id,
+                                        location, checksum)
+            return
+        ranges = [(start, min(start + chunk_size, file_size) - 1) for start in range(0, file_size, chunk_size)]
+        semaphore = asyncio.Semaphore(max(1, parallelism))
+
+        temp_path = partial_path(dest_path)
+        try:
+            with open(temp_path, 'wb') as f:
+                f.truncate(file_size)
+                fd = f.fileno()
+
+                async def fetch(from_bytes, to_bytes):
+                    async def get_range():
+                        resp = await self._request("get_object", "GET", base_url, params={"path": location},
+                                                   headers={"Range": f"bytes={from_bytes}-{to_bytes}"})
+                        if len(resp.content) != to_bytes - from_bytes + 1:
+                            raise IncompleteRangeError(f"Expected {to_bytes - from_bytes + 1} bytes, "
+                                                        f"got {len(resp.content)}")
+                        return resp.content
+
+                    async with semaphore:
+                        data = await _with_retries(get_range, RANGE_RETRY_MAX, RANGE_RETRY_DELAY)
+                    metrics.count("bytes.downloaded", len(data))
+                    with metrics.timer("disk.write"):
+                        await _pwrite(fd, data, from_bytes)
+
+                fetches = [asyncio.ensure_future(fetch(*r)) for r in ranges]
+                try:
+                    await asyncio.gather(*fetches)
+                except BaseException:
+                    # the file is closed when this block is left, no fetch may write to its fd after that
+                    for task in fetches:
+                        task.cancel()
+                    await asyncio.gather(*fetches, return_exceptions=True)
+                    raise
+            os.replace(temp_path, dest_path)
+            if object_cache is not None:
+                try:
+                    await asyncio.to_thread(object_cache.put, checksum, file_size, dest_path)
+                except Exception as ex:
+                    # the file is downloaded, only later gets miss the cache
+                    logging.warning("Failed to add file to object cache: {0}, {1}".format(dest_path, ex))
+            if hash_cache is not None:
+                await asyncio.to_thread(hash_cache.record_download, dest_path, repository, branch_or_commit_id,
+                                        location, checksum)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+        metrics.count("files.downloaded")
+        logging.info("Downloading completed: {0}".format(file_size))
+
+    async def upload_files(self, branch: str, repository: str, files: List[str], dest_paths: List[str],
+                           concurrency: int = MAX_IN_FLIGHT) -> List[UploadResult]:
+        """
+        Uploads files, up to concurrency files at once
+        :return: upload result of every file
+        """
+        semaphore = asyncio.Semaphore(max(1, concurrency))
+        url = f"/repositories/{_quote(repository)}/branches/{_quote(branch)}/objects"
+
+        async def upload(file, dest_path):
+            result = UploadResult(local_path=file, dest_path=dest_path)
+
+            async def post():
+                result.attempts += 1
+                return await self._request("upload_object", "POST", url, params={"path": dest_path},
+                                           content=_read_blocks(file),
+                                           headers={"Content-Length": str(os.path.getsize(file)),
+                                                    "Content-Type": "application/octet-stream"})
+
+            async with semaphore:
+                try:
+                    resp = await _with_retries(post, UPLOAD_RETRY_MAX, UPLOAD_RETRY_DELAY)
+                    result.status_code = resp.status_code
+                    logging.info(f'Upload file result: {resp.text}')
+                    metrics.count("files.uploaded")
+                    metrics.count("bytes.uploaded", os.path.getsize(file))
+                except ApiException as ex:
+                    result.status_code = ex.status
+                    result.error = f"Failed to upload file to lakefs: {ex.body}"
+                except Exception as ex:
+                    result.error = str(ex)
+            return result
+
+        return list(await asyncio.gather(*(upload(f, d) for f, d in zip(files, dest_paths))))
+
+    async def create_tag(self, repository_name: str, commit_id: str, tag_name: str):
+        """
+        Creates a new tag
+        """
+        logging.info("Creating new tag: {0}".format(tag_name))
+        await self._request("create_tag", "POST", f"/repositories/{_quote(repository_name)}/tags",
+                            json={"id": tag_name, "ref": commit_id})
+        logging.info("Creating of new tag completed")
+
+    async def get_tags(self, repository_name: str) -> dict[str, str]:
+        """
+        Returns list of tags for a given repository.
+        """
+        return {t["id"]: t["commit_id"]
+                async for t in self._paginate("list_tags", f"/repositories/{_quote(repository_name)}/tags", {})}
+
+
+async def _read_blocks(path: str) -> AsyncIterator[bytes]:
+    with open(path, 'rb') as f:
+        while block := await asyncio.to_thread(f.read, UPLOAD_BLOCK_SIZE):
+            yield block
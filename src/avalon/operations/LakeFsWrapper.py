@@ -2,24 +2,97 @@ import json
 import logging
 import os
 import urllib.parse
+import threading
+import time
 import requests
+import urllib3
 
 from lakefs_sdk.client import LakeFSClient
-from lakefs_sdk import Configuration, CommitCreation, BranchCreation, exceptions, TagCreation
+from lakefs_sdk import Configuration, CommitCreation, BranchCreation, TagCreation, ObjectStats, PathList, \
+    CommitList, Diff, Pagination, Merge, ImportCreation, ImportLocation
+from lakefs_sdk import Commit as LakeFsCommit
 
-from typing import List
+from typing import BinaryIO, Dict, Iterable, Iterator, List, Tuple, Union
 
-from lakefs_sdk.exceptions import NotFoundException
+from lakefs_sdk.exceptions import NotFoundException, ServiceException
 from lakefs_sdk.models.repository_creation import RepositoryCreation
-
-from avalon.models.pipeline import Commit, Repository
-from avalon.operations.files import create_dirs
+from retrying import retry
+
+from avalon.models.pipeline import Commit, Repository, UploadResult, RemoteObject, LocalFile
+from avalon.operations.files import compute_checksum
+from avalon.operations.hashcache import HashCache
+from avalon.operations import metrics
+from avalon.operations.journal import DownloadJournal
+from avalon.operations.objectcache import ObjectCache
+from avalon.operations.transfer import IncompleteRangeError, TtlCache, run_concurrently, is_md5, partial_path, \
+    remote_object_from_stats, location_of
+from avalon.operations.remotefile import RemoteFile, REMOTE_FILE_BLOCK_SIZE, REMOTE_FILE_READ_AHEAD, \
+    REMOTE_FILE_CACHE_BLOCKS
+
+DOWNLOAD_CHUNK_SIZE = 32 * 1024 * 1024
+RANGE_RETRY_MAX = int(os.environ.get("LAKEFS_RANGE_RETRY_MAX", 5))
+RANGE_RETRY_DELAY = int(os.environ.get("LAKEFS_RANGE_RETRY_DELAY", 1000))
+UPLOAD_RETRY_MAX = int(os.environ.get("LAKEFS_UPLOAD_RETRY_MAX", 5))
+UPLOAD_RETRY_DELAY = int(os.environ.get("LAKEFS_UPLOAD_RETRY_DELAY", 1000))
+# seconds repository and branch existence is remembered
+METADATA_CACHE_TTL = float(os.environ.get("LAKEFS_METADATA_CACHE_TTL", 60))
+# seconds before expiration a login cookie is renewed
+LOGIN_RENEW_MARGIN = 60
+# seconds a login cookie is used when the server does not send its expiration, a rejected cookie is renewed earlier
+LOGIN_TTL = float(os.environ.get("LAKEFS_LOGIN_TTL", 15 * 60))
+IMPORT_POLL_INTERVAL = float(os.environ.get("LAKEFS_IMPORT_POLL_INTERVAL", 1))
+# bytes read from a stream per chunk of a chunked upload, bounds the memory of a streaming put
+UPLOAD_STREAM_BLOCK_SIZE = int(os.environ.get("LAKEFS_UPLOAD_STREAM_BLOCK_SIZE", 8 * 1024 * 1024))
+
+
+class _ServerError(Exception):
+    pass
+
+
+class _VerificationError(Exception):
+    pass
+
+
+class _Unauthorized(Exception):
+    pass
+
+
+def _retry_if_transient(exception):
+    """Returns True if a failed range request should be tried again"""
+    transient = isinstance(exception, (urllib3.exceptions.HTTPError, ServiceException, IncompleteRangeError))
+    if transient:
+        metrics.count("retries.get_object")
+    return transient
+
+
+def _retry_upload_if_transient(exception):
+    """Returns True if a failed upload should be tried again"""
+    transient = isinstance(exception, (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                                       _ServerError, _Unauthorized))
+    if transient:
+        metrics.count("retries.upload_object")
+    return transient
+
+
+def _verify_download(path: str, size: int, checksum: str) -> None:
+    """
+    Raises if a downloaded file does not match size and, for single part uploads, the md5 checksum
+    """
+    if os.path.getsize(path) != size:
+        raise _VerificationError(f"Downloaded {os.path.getsize(path)} bytes, expected {size}: {path}")
+    checksum = checksum.strip('"')
+    if is_md5(checksum) and compute_checksum(path) != checksum:
+        raise _VerificationError(f"Checksum of downloaded file does not match {checksum}: {path}")
 
 
 class LakeFsWrapper:
     def __init__(self, configuration: Configuration):
         os.environ.get('')
         self._config = configuration
+        self._login_cookie = None
+        self._login_expires = 0
+        self._login_lock = threading.Lock()
+        self._existing = TtlCache(METADATA_CACHE_TTL)
         self._client = LakeFSClient(configuration=configuration)
 
     def list_repo(self) -> list[Repository]:
@@ -41,6 +114,35 @@ class LakeFsWrapper:
         """
         self._client.repositories_api.create_repository(
             repository_creation=RepositoryCreation(name=repo.Id, storage_namespace=repo.StorageNamespace))
+        self._existing.add((repo.Id,))
+
+    def repository_exists(self, repository_name: str) -> bool:
+        """
+        Returns True if the repository exists, a positive answer is cached for LAKEFS_METADATA_CACHE_TTL seconds
+        """
+        if (repository_name,) in self._existing:
+            return True
+        try:
+            with metrics.timer("api.get_repository"):
+                self._client.repositories_api.get_repository(repository=repository_name)
+        except NotFoundException:
+            return False
+        self._existing.add((repository_name,))
+        return True
+
+    def branch_exists(self, repository_name: str, branch_name: str) -> bool:
+        """
+        Returns True if the branch exists, a positive answer is cached for LAKEFS_METADATA_CACHE_TTL seconds
+        """
+        if (repository_name, branch_name) in self._existing:
+            return True
+        try:
+            with metrics.timer("api.get_branch"):
+                self._client.branches_api.get_branch(repository=repository_name, branch=branch_name)
+        except NotFoundException:
+            return False
+        self._existing.add((repository_name, branch_name))
+        return True
 
     def delete_repository(self, repo: Repository) -> None:
         """
@@ -48,6 +150,7 @@ class LakeFsWrapper:
         :param repo: repository name
         """
         self._client.repositories_api.delete_repository(repository=repo.Id, storage_namespace=repo.StorageNamespace)
+        self._existing.discard((repo.Id,))
 
     def list_branches(self, repository_name: str):
         """
@@ -58,16 +161,50 @@ class LakeFsWrapper:
         branches = self._client.branches_api.list_branches(repository=repository_name)
         return branches
 
-    def list_commits(self, repository_name: str, branch_name: str, path: [str]):
+    def list_commits(self, repository_name: str, branch_name: str, path: [str], page_size: int = 1000) -> CommitList:
         """
-        List commits in a branch
+        List all commits in a branch
         :param repository_name:
         :param branch_name:
         :param path: path
+        :param page_size: number of commits requested per page
         :return:
         """
-        commits = self._client.refs_api.log_commits(repository=repository_name, ref=branch_name, prefixes=path)
-        return commits
+        commits = list(self.iter_commits(repository_name, branch_name, path, page_size=page_size))
+        return CommitList(pagination=Pagination(has_more=False, next_offset="", results=len(commits),
+                                                max_per_page=page_size),
+                          results=commits)
+
+    def iter_commits(self, repository_name: str, branch_name: str, path: [str],
+                     page_size: int = 1000, first_page_size: int = None) -> Iterator[LakeFsCommit]:
+        """
+        Yields commits in a branch, newest first, fetching pages as they are consumed.
+        Stop iterating to stop fetching.
+        :param repository_name:
+        :param branch_name:
+        :param path: path
+        :param page_size: number of commits requested per page
+        :param first_page_size: number of commits requested in the first page, it doubles per page up to page_size
+        :return:
+        """
+        has_results = True
+        next_page = None
+        amount = min(first_page_size or page_size, page_size)
+        while has_results:
+            with metrics.timer("api.log_commits"):
+                commits = self._client.refs_api.log_commits(repository=repository_name, ref=branch_name,
+                                                            prefixes=path, amount=amount, after=next_page)
+            yield from commits.results
+            has_results = commits.pagination.has_more
+            next_page = commits.pagination.next_offset
+            amount = min(amount * 2, page_size)
+
+    def get_commit_id(self, repository_name: str, ref: str) -> str:
+        """
+        Resolves a branch, tag or commit id to the id of the commit it points to
+        """
+        with metrics.timer("api.get_commit"):
+            return self._client.commits_api.get_commit(repository=repository_name, commit_id=ref).id
 
     def commit_files(self, commit: Commit):
         """
@@ -76,34 +213,164 @@ class LakeFsWrapper:
         :return:
         """
         commit_creation = CommitCreation(message=commit.message, metadata=commit.metadata.dict(exclude={"args"}))
-        response = self._client.commits_api.commit(
-            branch=commit.branch,
-            repository=commit.repo,
-            commit_creation=commit_creation
-        )
+        with metrics.timer("api.commit"):
+            response = self._client.commits_api.commit(
+                branch=commit.branch,
+                repository=commit.repo,
+                commit_creation=commit_creation
+            )
         return response
 
-    def upload_files(self, branch: str, repository: str, files: List[str], dest_paths: List[str]):
+    def import_files(self, commit: Commit, source_uri: str, remote_path: str) -> str:
+        """
+        Imports all objects under source_uri into remote_path of the commit branch and commits them.
+        Objects are registered by their physical address, no data is copied.
+        Objects under remote_path that do not exist under source_uri are removed.
+        :param source_uri: prefix in object storage, e.g. s3://bucket/outputs/ or local:///data/outputs/
+        :return: id of the import commit
+        """
+        import_creation = ImportCreation(
+            paths=[ImportLocation(type="common_prefix", path=os.path.join(source_uri, ""),
+                                  destination=os.path.join(remote_path, ""))],
+            commit=CommitCreation(message=commit.message, metadata=commit.metadata.dict(exclude={"args"})))
+        with metrics.timer("api.import_start"):
+            import_id = self._client.import_api.import_start(repository=commit.repo, branch=commit.branch,
+                                                             import_creation=import_creation).id
+        while True:
+            status = self._client.import_api.import_status(repository=commit.repo, branch=commit.branch,
+                                                           id=import_id)
+            if status.error is not None:
+                raise Exception(f"Import of {source_uri} failed: {status.error.message}")
+            if status.completed:
+                logging.info(f"Imported {status.ingested_objects} objects from {source_uri}")
+                return status.commit.id
+            time.sleep(IMPORT_POLL_INTERVAL)
+
+    def upload_files(self, branch: str, repository: str, files: List[str], dest_paths: List[str],
+                     concurrency: int = 1) -> List[UploadResult]:
+        """
+        This function uploads files, up to concurrency files at once over a shared connection pool
+        :return: upload result of every file
+        """
+        return self._upload_pairs(branch, repository, zip(files, dest_paths), concurrency)
+
+    def upload_local_files(self, branch: str, repository: str, local_files: Iterable[LocalFile],
+                           concurrency: int = 1) -> List[UploadResult]:
         """
-        This function uploads files
+        Uploads files as they are yielded, e.g. by scan_files, so uploads start while the tree is scanned
+        :return: upload result of every file
         """
-        login_cookie = self._get_login_cookie()
-        for i in range(len(files)):
-            with open(files[i], 'rb') as f:
-                url = f'{self._config.host}/repositories/{urllib.parse.quote_plus(repository)}/branches/{urllib.parse.quote_plus(branch)}/objects?path={urllib.parse.quote_plus(dest_paths[i])}'
-                res = requests.post(url, data=f, cookies=login_cookie)
+        return self._upload_pairs(branch, repository, ((f.local_path, f.dest_path) for f in local_files),
+                                  concurrency)
+
+    def _upload_pairs(self, branch: str, repository: str, pairs: Iterable[Tuple[str, str]],
+                      concurrency: int) -> List[UploadResult]:
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=max(1, concurrency))
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        session.cookies.update(self._get_login_cookie())
+
+        def upload(item):
+            _, (file, dest_path) = item
+            result = UploadResult(local_path=file, dest_path=dest_path)
+            try:
+                res = self._upload_file_content(session, branch, repository, file, dest_path, result)
+                result.status_code = res.status_code
                 if res.status_code != 201:
-                    raise Exception(f"Failed to upload file to lakefs: {res.text}")
-                logging.info(f'Upload file result: {res.text}')
+                    result.error = f"Failed to upload file to lakefs: {res.text}"
+                else:
+                    logging.info(f'Upload file result: {res.text}')
+                    metrics.count("files.uploaded")
+            except Exception as ex:
+                result.error = str(ex)
+            return result
+
+        with session:
+            results = {item[0]: result for item, result, _ in run_concurrently(upload, enumerate(pairs),
+                                                                                 concurrency)}
+        return [results[i] for i in range(len(results))]
+
+    @retry(retry_on_exception=_retry_upload_if_transient,
+           wait_exponential_multiplier=UPLOAD_RETRY_DELAY,
+           stop_max_attempt_number=UPLOAD_RETRY_MAX)
+    def _upload_file_content(self, session: requests.Session, branch: str, repository: str, file: str,
+                             dest_path: str, result: UploadResult) -> requests.Response:
+        result.attempts += 1
+        with open(file, 'rb') as f:
+            url = f'{self._config.host}/repositories/{urllib.parse.quote_plus(repository)}/branches/{urllib.parse.quote_plus(branch)}/objects?path={urllib.parse.quote_plus(dest_path)}'
+            with metrics.timer("api.upload_object"):
+                res = session.post(url, data=f)
+            if res.status_code == 201:
+                metrics.count("bytes.uploaded", f.tell())
+        if res.status_code == 401:
+            # login expired, log in again before the retry
+            self._invalidate_login_cookie()
+            session.cookies.update(self._get_login_cookie())
+            raise _Unauthorized(f"Failed to upload file to lakefs: {res.status_code} {res.text}")
+        if res.status_code >= 500:
+            raise _ServerError(f"Failed to upload file to lakefs: {res.status_code} {res.text}")
+        return res
+
+    def upload_stream(self, branch: str, repository: str, stream: Union[BinaryIO, Iterable[bytes]], dest_path: str,
+                      block_size: int = UPLOAD_STREAM_BLOCK_SIZE) -> UploadResult:
+        """
+        Uploads a binary stream, e.g. a pipe, or an iterable of bytes to dest_path with chunked transfer encoding,
+        holding at most one block in memory. A stream can not be read twice, so failed uploads are not retried.
+        :param stream: binary file object read in blocks of block_size bytes, or iterable of bytes sent as is
+        :return: upload result, local_path is '-'
+        """
+        result = UploadResult(local_path="-", dest_path=dest_path, attempts=1)
+        url = f'{self._config.host}/repositories/{urllib.parse.quote_plus(repository)}/branches/{urllib.parse.quote_plus(branch)}/objects?path={urllib.parse.quote_plus(dest_path)}'
+        sent = 0
+
+        def chunks():
+            nonlocal sent
+            blocks = iter(lambda: stream.read(block_size), b"") if hasattr(stream, "read") else stream
+            for block in blocks:
+                if block:
+                    sent += len(block)
+                    yield block
+
+        try:
+            with requests.Session() as session:
+                session.cookies.update(self._get_login_cookie())
+                with metrics.timer("api.upload_object"):
+                    res = session.post(url, data=chunks(), headers={"Content-Type": "application/octet-stream"})
+            result.status_code = res.status_code
+            if res.status_code == 401:
+                self._invalidate_login_cookie()
+            if res.status_code != 201:
+                result.error = f"Failed to upload stream to lakefs: {res.status_code} {res.text}"
+            else:
+                logging.info(f'Upload stream result: {res.text}')
+                metrics.count("files.uploaded")
+                metrics.count("bytes.uploaded", sent)
+        except Exception as ex:
+            result.error = str(ex)
+        return result
 
     def _get_login_cookie(self):
-        login_url = f"{self._config.host}/auth/login"
-        auth_resp = requests.post(login_url, json={"access_key_id": self._config.username,
-                                                   "secret_access_key": self._config.password})
-        if auth_resp.status_code != 200:
-            raise Exception(f"Authentication to lakefs failed: {auth_resp.status_code}")
+        """
+        Returns the login cookie, logging in only if there is none yet or it is about to expire
+        """
+        with self._login_lock:
+            if self._login_cookie is not None and time.time() < self._login_expires - LOGIN_RENEW_MARGIN:
+                return self._login_cookie
+            login_url = f"{self._config.host}/auth/login"
+            with metrics.timer("api.login"):
+                auth_resp = requests.post(login_url, json={"access_key_id": self._config.username,
+                                                           "secret_access_key": self._config.password})
+            if auth_resp.status_code != 200:
+                raise Exception(f"Authentication to lakefs failed: {auth_resp.status_code}")
 
-        return auth_resp.cookies
+            self._login_cookie = auth_resp.cookies
+            self._login_expires = auth_resp.json().get("token_expiration") or time.time() + LOGIN_TTL
+            return self._login_cookie
+
+    def _invalidate_login_cookie(self) -> None:
+        with self._login_lock:
+            self._login_cookie = None
 
 
     def upload_file(self, branch: str, repository: str, content: str, dest_path: str):
@@ -115,38 +382,80 @@ class LakeFsWrapper:
                                                path=dest_path,
                                                content=bytes(content, 'utf-8'))
 
-    def get_filelist(self, branch: str, repository: str, remote_path: str) -> List[str]:
+    def get_filelist(self, branch: str, repository: str, remote_path: str, page_size: int = 1000) -> List[str]:
         """
         Returns lists of files
         :param branch: branch name
         :param repository: repository name
         :param remote_path: path as in Lakefs
+        :param page_size: number of objects requested per page
         :return:
         """
-        results = []
+        return list(self.iter_filelist(branch, repository, remote_path, page_size=page_size))
+
+    def iter_filelist(self, branch: str, repository: str, remote_path: str, page_size: int = 1000) -> Iterator[str]:
+        """
+        Yields paths of files starting with remote_path ('*' for all files), fetching pages as they are consumed
+        :param branch: branch name
+        :param repository: repository name
+        :param remote_path: path as in Lakefs
+        :param page_size: number of objects requested per page
+        :return:
+        """
+        prefix = None if remote_path == '*' else remote_path
+        for obj in self._iter_objects(branch, repository, prefix, page_size):
+            yield obj.path
+
+    def iter_remote_objects(self, branch: str, repository: str, remote_path: str,
+                            page_size: int = 1000) -> Iterator[RemoteObject]:
+        """
+        Like iter_filelist, but yields path, size and checksum of every file as listed,
+        download_files takes them without a stat request per file
+        """
+        prefix = None if remote_path == '*' else remote_path
+        for obj in self._iter_objects(branch, repository, prefix, page_size):
+            yield remote_object_from_stats(obj)
+
+    def get_object_stats(self, branch: str, repository: str, remote_path: str) -> Dict[str, ObjectStats]:
+        """
+        Returns stats (checksum, size, mtime) of every object under remote_path
+        :param branch: branch name
+        :param repository: repository name
+        :param remote_path: path as in Lakefs, listed as a directory
+        :return: dict of remote path to ObjectStats
+        """
+        return {obj.path: obj for obj in self._iter_objects(branch, repository, os.path.join(remote_path, ""))}
+
+    def _iter_objects(self, branch: str, repository: str, prefix: str, page_size: int = 1000) -> Iterator[ObjectStats]:
         has_results = True
-        current = 0
         next_page = None
         while has_results:
-            if not next_page:
+            with metrics.timer("api.list_objects"):
                 objects = self._client.objects_api.list_objects(repository=repository,
                                                                 ref=branch,
-                                                                amount=1000)
-            else:
-                objects = self._client.objects_api.list_objects(repository=repository,
-                                                                ref=branch,
-                                                                amount=1000,
+                                                                prefix=prefix,
+                                                                amount=page_size,
                                                                 after=next_page)
-            results += objects.results
+            yield from objects.results
             has_results = objects.pagination.has_more
             next_page = objects.pagination.next_offset
-        paths = []
-        for obj in results:
-            paths.append(obj.path)
-        matching_files = list(filter(lambda f: f.startswith(remote_path) or remote_path == '*', paths))
-        return matching_files
 
-    def get_changes(self, branch: str, repository: str, remote_path: str, from_commit_id: str, to_commit_id: str = None) -> List[str]:
+    def delete_files(self, branch: str, repository: str, remote_paths: List[str]) -> None:
+        """
+        Deletes objects from a branch, 1000 paths per request
+        :param branch: branch name
+        :param repository: repository name
+        :param remote_paths: paths as in Lakefs
+        """
+        for i in range(0, len(remote_paths), 1000):
+            with metrics.timer("api.delete_objects"):
+                errors = self._client.objects_api.delete_objects(
+                    repository=repository, branch=branch, path_list=PathList(paths=remote_paths[i:i + 1000])).errors
+            if errors:
+                raise Exception(f"Failed to delete files from lakefs: {errors}")
+
+    def get_changes(self, branch: str, repository: str, remote_path: str, from_commit_id: str, to_commit_id: str = None,
+                    page_size: int = 1000) -> List[str]:
         """
         Returns list of remote paths that were changed since specified commit
         :param branch: branch name
@@ -154,98 +463,240 @@ class LakeFsWrapper:
         :param remote_path: path as in Lakefs
         :param from_commit_id: id of a commit
         :param to_commit_id: id of a commit (optional)
+        :param page_size: number of diff entries requested per page
         :return: list ot remote paths in LakeFs
         """
-        files_changed = []
-        files_removed = []
-        files_added = []
-
-        commits = self.list_commits(repository_name=repository, branch_name=branch, path=remote_path.split("/")).results
-        commits_to_proc = []
+        diffs = self.iter_changes(branch, repository, remote_path, from_commit_id, to_commit_id, page_size=page_size)
+        return [d.path for d in diffs if d.type in ('added', 'changed')]
 
+    def iter_changes(self, branch: str, repository: str, remote_path: str, from_commit_id: str,
+                     to_commit_id: str = None, page_size: int = 1000) -> Iterator[Diff]:
+        """
+        Returns an iterator over all diff entries (added, changed and removed paths) under remote_path
+        since specified commit. Diff pages are fetched as the iterator is consumed.
+        Raises NotFoundException right away if branch has no commits under remote_path after from_commit_id.
+        :param branch: branch name
+        :param repository: repository name
+        :param remote_path: path as in Lakefs
+        :param from_commit_id: id of a commit
+        :param to_commit_id: id of a commit (optional), defaults to the latest commit under remote_path
+        :param page_size: number of diff entries requested per page
+        :return: iterator of Diff with type and path
+        """
         if to_commit_id is None:
-
-            for commit in commits:
-                if commit.id != from_commit_id:
-                    commits_to_proc.append(commit)
-                else:
-                    break
-
-            if len(commits_to_proc) == 0:
+            commits = self.iter_commits(repository_name=repository, branch_name=branch, path=remote_path.split("/"),
+                                        page_size=1)
+            latest = next(commits, None)
+            if latest is None or latest.id == from_commit_id:
                 raise NotFoundException()
+            to_commit_id = latest.id
 
-            files = self._client.refs_api.diff_refs(repository=repository, right_ref=commits_to_proc[0].id, left_ref=from_commit_id).results
-        else:
-            files = self._client.refs_api.diff_refs(repository=repository, right_ref=to_commit_id, left_ref=from_commit_id).results
+        return self._iter_diff(repository, from_commit_id, to_commit_id, remote_path, page_size)
 
-        for file in files:
-            if file.type == 'added':
-                files_added.append(file.path)
-            elif file.type == 'removed':
-                files_removed.append(file.path)
-            elif file.type == 'changed':
-                files_changed.append(file.path)
-
-        paths = []
-        paths.extend(files_changed)
-        paths.extend(files_added)
-
-        matching_files = list(filter(lambda f: f.startswith(remote_path), paths))
-        return matching_files
-
-    def download_files(self, remote_files: List[str], local_path: str, repository: str, branch_or_commit_id: str) -> None:
+    def _iter_diff(self, repository: str, left_ref: str, right_ref: str, prefix: str,
+                   page_size: int = 1000) -> Iterator[Diff]:
+        has_results = True
+        next_page = None
+        while has_results:
+            with metrics.timer("api.diff_refs"):
+                diff = self._client.refs_api.diff_refs(repository=repository, left_ref=left_ref, right_ref=right_ref,
+                                                       prefix=prefix, amount=page_size, after=next_page)
+            yield from diff.results
+            has_results = diff.pagination.has_more
+            next_page = diff.pagination.next_offset
+
+    def download_files(self, remote_files: Iterable[Union[str, RemoteObject]], local_path: str, repository: str,
+                       branch_or_commit_id: str,
+                       concurrency: int = 1, chunk_size: int = DOWNLOAD_CHUNK_SIZE,
+                       range_parallelism: int = 1, hash_cache: HashCache = None,
+                       journal: DownloadJournal = None, object_cache: ObjectCache = None) -> None:
         """
         Downloads files from LakeFs
-        :param remote_files:  list ot remote paths in LakeFs
+        :param remote_files:  list ot remote paths or listed RemoteObjects in LakeFs, may be a lazy iterable
         :param local_path: local path, destination for files
         :param repository: repository name
         :param branch_or_commit_id: branch name or commit_id
+        :param concurrency: number of files downloaded in parallel
+        :param chunk_size: size in bytes of a single ranged request
+        :param range_parallelism: number of ranges of one file downloaded in parallel
+        :param hash_cache: if set, files already downloaded with the same checksum are skipped
+        :param journal: if set, finished files are skipped and partial files are resumed
+        :param object_cache: if set, cached objects are materialized instead of downloaded
         :return: None
         """
-        dirs = set(map(lambda x: os.path.join(local_path, os.path.dirname(x)), remote_files))
-        create_dirs(dirs)
-        for location in remote_files:
+        def download(remote_file):
+            location = location_of(remote_file)
             file_name = os.path.basename(location)
             dir_name = os.path.dirname(location)
             dest_path = os.path.join(local_path, dir_name, file_name)
-
-            self.download_file(dest_path, branch_or_commit_id, location, repository)
-
-    def download_file(self, dest_path, branch_or_commit_id, location, repository):
+            os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+            self.download_file(dest_path, branch_or_commit_id, location, repository,
+                               chunk_size=chunk_size, parallelism=range_parallelism, hash_cache=hash_cache,
+                               journal=journal, object_cache=object_cache,
+                               remote_object=remote_file if isinstance(remote_file, RemoteObject) else None)
+
+        failed = []
+        total = 0
+        for remote_file, _, ex in run_concurrently(download, remote_files, concurrency):
+            total += 1
+            if ex is not None:
+                logging.error("Failed to download file: {0}, {1}".format(location_of(remote_file), ex))
+                failed.append(location_of(remote_file))
+        if failed:
+            raise Exception(f"Failed to download {len(failed)} of {total} files from lakefs: {failed}")
+
+    def download_file(self, dest_path, branch_or_commit_id, location, repository,
+                      chunk_size: int = DOWNLOAD_CHUNK_SIZE, parallelism: int = 1, hash_cache: HashCache = None,
+                      journal: DownloadJournal = None, object_cache: ObjectCache = None,
+                      remote_object: RemoteObject = None):
+        """
+        Downloads a single file in ranges of chunk_size bytes, up to parallelism ranges at once.
+        Bytes are written to a preallocated temporary file next to dest_path
+        which is renamed to dest_path only when the download completed.
+        With a journal, completed ranges are recorded and the temporary file is kept on failure,
+        so the next call resumes the download. The file is verified against size and md5 checksum before rename.
+        :param remote_object: size and checksum as listed, the object is stat'ed if not given
+        """
         logging.info("Downloading file: {0}, {1}, {2}".format(branch_or_commit_id, location, repository))
-        file_info = self._client.objects_api.stat_object(repository=repository, ref=branch_or_commit_id, path=location)
-        file_size = file_info.size_bytes
+        if remote_object is None:
+            with metrics.timer("api.stat_object"):
+                remote_object = remote_object_from_stats(self._client.objects_api.stat_object(
+                    repository=repository, ref=branch_or_commit_id, path=location))
+        file_size = remote_object.size
+        checksum = remote_object.checksum
         logging.info("File size: {0}".format(file_size))
-        chunk = 32 * 1024 * 1024
-        current_pos = 0
+        if hash_cache is not None and hash_cache.is_downloaded(dest_path, repository, location, checksum):
+            logging.info("File is already downloaded: {0}".format(dest_path))
+            metrics.count("files.skipped")
+            return
+        if journal is not None and os.path.isfile(dest_path) and os.path.getsize(dest_path) == file_size \
+                and journal.is_complete(repository, branch_or_commit_id, location, checksum):
+            logging.info("File is already downloaded: {0}".format(dest_path))
+            metrics.count("files.skipped")
+            return
+        if object_cache is not None and object_cache.get(checksum, file_size, dest_path):
+            logging.info("File is materialized from object cache: {0}".format(dest_path))
+            metrics.count("files.object_cache_hits")
+            if hash_cache is not None:
+                hash_cache.record_download(dest_path, repository, branch_or_commit_id, location, checksum)
+            return
+        ranges = [(start, min(start + chunk_size, file_size) - 1) for start in range(0, file_size, chunk_size)]
+
+        temp_path = partial_path(dest_path)
+        resume = journal is not None and os.path.isfile(temp_path) and os.path.getsize(temp_path) == file_size
+        if journal is not None:
+            done = journal.start_file(repository, branch_or_commit_id, location, checksum, file_size,
+                                      resume)
+            ranges = [r for r in ranges if r not in done]
+            if done:
+                logging.info("Resuming download, {0} ranges left: {1}".format(len(ranges), dest_path))
+        try:
+            with open(temp_path, 'r+b' if resume else 'wb') as f:
+                f.truncate(file_size)
+                fd = f.fileno()
+
+                def fetch(byte_range):
+                    data = self.get_range(repository, branch_or_commit_id, location, *byte_range)
+                    with metrics.timer("disk.write"):
+                        os.pwrite(fd, data, byte_range[0])
+                    if journal is not None:
+                        journal.complete_range(repository, branch_or_commit_id, location, *byte_range)
+
+                for _, _, ex in run_concurrently(fetch, ranges, parallelism):
+                    if ex is not None:
+                        raise ex
+            if journal is not None:
+                _verify_download(temp_path, file_size, checksum)
+            os.replace(temp_path, dest_path)
+            if journal is not None:
+                journal.complete_file(repository, branch_or_commit_id, location)
+            if object_cache is not None:
+                try:
+                    object_cache.put(checksum, file_size, dest_path)
+                except Exception as ex:
+                    # the file is downloaded, only later gets miss the cache
+                    logging.warning("Failed to add file to object cache: {0}, {1}".format(dest_path, ex))
+            if hash_cache is not None:
+                hash_cache.record_download(dest_path, repository, branch_or_commit_id, location, checksum)
+        except _VerificationError:
+            journal.discard_file(repository, branch_or_commit_id, location)
+            os.remove(temp_path)
+            raise
+        except BaseException:
+            if journal is None and os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+        metrics.count("files.downloaded")
+        logging.info("Downloading completed: {0}".format(file_size))
+
+    def open_file(self, repository: str, ref: str, path: str, remote_object: RemoteObject = None,
+                  block_size: int = REMOTE_FILE_BLOCK_SIZE, read_ahead: int = REMOTE_FILE_READ_AHEAD,
+                  cache_blocks: int = REMOTE_FILE_CACHE_BLOCKS) -> RemoteFile:
+        """
+        Opens an object as a read only, seekable file that fetches only the ranges that are read
+        :param ref: branch name or commit id, pin a commit id if the branch may change while the file is read
+        :param remote_object: size as listed, the object is stat'ed if not given
+        :param block_size: size in bytes of a ranged request
+        :param read_ahead: number of blocks fetched after the requested one when reading sequentially
+        :param cache_blocks: number of blocks kept in memory
+        """
+        if remote_object is None:
+            with metrics.timer("api.stat_object"):
+                remote_object = remote_object_from_stats(self._client.objects_api.stat_object(
+                    repository=repository, ref=ref, path=path))
+        return RemoteFile(self, repository, ref, path, remote_object.size, block_size=block_size,
+                          read_ahead=read_ahead, cache_blocks=cache_blocks)
+
+    @retry(retry_on_exception=_retry_if_transient,
+           wait_exponential_multiplier=RANGE_RETRY_DELAY,
+           stop_max_attempt_number=RANGE_RETRY_MAX)
+    def get_range(self, repository: str, ref: str, location: str, from_bytes: int, to_bytes: int) -> bytes:
+        """
+        Downloads bytes from_bytes - to_bytes (inclusive) of an object, retrying transient failures
+        """
+        logging.debug("Downloading bytes: {0} - {1}".format(from_bytes, to_bytes))
+        with metrics.timer("api.get_object"):
+            obj_bytes = self._client.objects_api.get_object(repository=repository,
+                                                            ref=ref,
+                                                            path=location,
+                                                            range="bytes={0}-{1}".format(from_bytes, to_bytes))
+        if len(obj_bytes) != to_bytes - from_bytes + 1:
+            raise IncompleteRangeError(f"Expected {to_bytes - from_bytes + 1} bytes, got {len(obj_bytes)}")
+        metrics.count("bytes.downloaded", len(obj_bytes))
+        return obj_bytes
 
-        with open(dest_path, 'wb') as f:
-            while current_pos < file_size:
-                from_bytes = current_pos
-                to_bytes = min(current_pos + chunk, file_size - 1)
-                logging.info("Downloading bytes: {0} - {1}".format(from_bytes, to_bytes))
-                obj_bytes = self._client.objects_api.get_object(repository=repository,
-                                                                ref=branch_or_commit_id,
-                                                                path=location,
-                                                                range="bytes={0}-{1}".format(from_bytes, to_bytes))
-                f.write(obj_bytes)
-                current_pos = to_bytes + 1
 
-        logging.info("Downloading completed: {0}".format(current_pos - 1))
+    def create_branch(self, branch_name: str, repository_name: str, source_branch: str = "main"):
+        """
+        Creates new branch if it does not exist
+        """
+        if self.branch_exists(repository_name, branch_name):
+            return {"id": branch_name}
+        branch_creation = BranchCreation(name=branch_name, source=source_branch)
+        commit_id = self._client.branches_api.create_branch(repository=repository_name,
+                                                            branch_creation=branch_creation)
+        self._existing.add((repository_name, branch_name))
+        return {"commit_id": commit_id, "id": branch_name}
 
 
-    def create_branch(self, branch_name: str, repository_name: str, source_branch: str = "main"):
+    def delete_branch(self, branch_name: str, repository_name: str) -> None:
         """
-        Creates new branch
+        Deletes a branch
         """
-        try:
-            return self._client.branches_api.get_branch(repository=repository_name, branch=branch_name)
-        except exceptions.NotFoundException as Ex:
-            branch_creation = BranchCreation(name=branch_name, source=source_branch)
-            commit_id = self._client.branches_api.create_branch(repository=repository_name,
-                                                                branch_creation=branch_creation)
-            return {"commit_id": commit_id, "id": branch_name}
+        self._client.branches_api.delete_branch(repository=repository_name, branch=branch_name)
+        self._existing.discard((repository_name, branch_name))
 
+    def merge_branch(self, source_ref: str, destination_branch: str, repository_name: str, message: str = None,
+                     metadata: Dict[str, str] = None) -> str:
+        """
+        Merges source_ref into destination_branch
+        :return: id of the merge commit
+        """
+        merge = Merge(message=message, metadata=metadata)
+        result = self._client.refs_api.merge_into_branch(repository=repository_name, source_ref=source_ref,
+                                                         destination_branch=destination_branch, merge=merge)
+        return result.reference
 
     def create_tag(self,  repository_name: str, commit_id: str, tag_name: str):
         """
@@ -0,0 +1,232 @@
+import json
+import logging
+import os
+import tarfile
+import uuid
+from typing import Callable, Dict, Iterable, List
+
+from avalon.models.pipeline import LocalFile
+from avalon.operations import metrics
+from avalon.operations.transfer import run_concurrently
+
+# directory under the remote path that holds the bundles and their index
+BUNDLE_DIR = ".avalon-bundles"
+BUNDLE_INDEX = "index.json"
+# files up to this size are bundled
+BUNDLE_THRESHOLD = int(os.environ.get("LAKEFS_BUNDLE_THRESHOLD", 1024 * 1024))
+# max size of one bundle
+BUNDLE_SIZE = int(os.environ.get("LAKEFS_BUNDLE_SIZE", 256 * 1024 * 1024))
+# max bytes of adjacent bundled files read with one ranged request
+BUNDLE_RANGE_SIZE = int(os.environ.get("LAKEFS_BUNDLE_RANGE_SIZE", 32 * 1024 * 1024))
+
+
+class BundleIndex:
+    """
+    Index of the bundles of one remote path: the bundle, data offset and size of every bundled file.
+    Bundles are plain tar files, so they can also be unpacked with tar.
+    """
+    def __init__(self, bundles: List[str] = None, members: Dict[str, dict] = None):
+        self.bundles = bundles or []
+        self.members = members or {}
+
+    def add(self, path: str, bundle: str, offset: int, size: int, mtime: float) -> None:
+        self.members[path] = {"bundle": bundle, "offset": offset, "size": size, "mtime": mtime}
+
+    def by_bundle(self, paths: Iterable[str]) -> Dict[str, List[str]]:
+        """
+        Groups paths of members by bundle, in the order of their data in the bundle
+        """
+        groups = {}
+        for path in sorted(paths, key=lambda p: self.members[p]["offset"]):
+            groups.setdefault(self.members[path]["bundle"], []).append(path)
+        return groups
+
+    def to_json(self) -> str:
+        return json.dumps({"version": 1, "bundles": self.bundles, "members": self.members})
+
+    @classmethod
+    def from_json(cls, content: str) -> "BundleIndex":
+        index = json.loads(content)
+        if index.get("version") != 1:
+            raise Exception(f"Error: bundle index version {index.get('version')} is not supported")
+        return cls(index["bundles"], index["members"])
+
+
+def is_bundle_path(path: str) -> bool:
+    return BUNDLE_DIR in path.split("/")
+
+
+def is_index_path(path: str) -> bool:
+    return path.endswith(f"{BUNDLE_DIR}/{BUNDLE_INDEX}")
+
+
+def write_bundles(local_files: Iterable[LocalFile], remote_path: str, work_dir: str,
+                  bundle_size: int = BUNDLE_SIZE) -> List[LocalFile]:
+    """
+    Packs local files into tar bundles of up to bundle_size bytes in work_dir and writes their index
+    :return: bundles and index to upload, with their destination paths under remote_path
+    """
+    bundle_dir = os.path.join(remote_path, BUNDLE_DIR)
+    index = BundleIndex()
+    uploads = []
+    tar = None
+
+    def close_bundle():
+        tar.close()
+        uploads.append(LocalFile(local_path=tar.name, dest_path=index.bundles[-1],
+                                 size=os.path.getsize(tar.name), mtime=os.path.getmtime(tar.name)))
+
+    try:
+        for local_file in local_files:
+            if tar is not None and tar.offset + local_file.size > bundle_size:
+                close_bundle()
+                tar = None
+            if tar is None:
+                index.bundles.append(os.path.join(bundle_dir, f"bundle-{len(index.bundles):05d}.tar"))
+                tar = tarfile.open(os.path.join(work_dir, os.path.basename(index.bundles[-1])), "w",
+                                   format=tarfile.PAX_FORMAT)
+            with open(local_file.local_path, "rb") as f:
+                # stat the opened file, a symlink is bundled with the content of the file it points to
+                info = tar.gettarinfo(arcname=local_file.dest_path, fileobj=f)
+                tar.addfile(info, f)
+            # the data of a member is padded to whole 512 byte blocks and ends at the current offset
+            offset = tar.offset - (info.size + tarfile.BLOCKSIZE - 1) // tarfile.BLOCKSIZE * tarfile.BLOCKSIZE
+            index.add(local_file.dest_path, index.bundles[-1], offset, info.size, info.mtime)
+        if tar is not None:
+            close_bundle()
+            tar = None
+    finally:
+        if tar is not None:
+            tar.close()
+
+    index_path = os.path.join(work_dir, BUNDLE_INDEX)
+    with open(index_path, "w") as f:
+        f.write(index.to_json())
+    uploads.append(LocalFile(local_path=index_path, dest_path=os.path.join(bundle_dir, BUNDLE_INDEX),
+                             size=os.path.getsize(index_path), mtime=os.path.getmtime(index_path)))
+    logging.info(f"Bundled {len(index.members)} files into {len(index.bundles)} bundles")
+    metrics.count("files.bundled", len(index.members))
+    return uploads
+
+
+def read_index(client, repository: str, ref: str, index_path: str) -> BundleIndex:
+    with client.open_file(repository, ref, index_path) as f:
+        return BundleIndex.from_json(f.read().decode("utf-8"))
+
+
+def read_member(client, repository: str, ref: str, index: BundleIndex, path: str) -> bytes:
+    """
+    Reads one bundled file with a ranged request
+    """
+    member = index.members[path]
+    if member["size"] == 0:
+        return b""
+    return client.get_range(repository, ref, member["bundle"], member["offset"],
+                            member["offset"] + member["size"] - 1)
+
+
+def read_run(client, repository: str, ref: str, index: BundleIndex, paths: List[str]) -> bytes:
+    """
+    Reads the data of members of one bundle, in data order, with one ranged request
+    :return: bundle bytes from the offset of the first member to the end of the last one
+    """
+    start = index.members[paths[0]]["offset"]
+    end = max(index.members[p]["offset"] + index.members[p]["size"] for p in paths) - 1
+    if end < start:
+        return b""
+    return client.get_range(repository, ref, index.members[paths[0]]["bundle"], start, end)
+
+
+def merge_runs(index: BundleIndex, paths: List[str], bundle_paths: List[str],
+               range_size: int = BUNDLE_RANGE_SIZE) -> List[List[str]]:
+    """
+    Groups selected members of one bundle into runs read with one ranged request each.
+    Members are in the same run when no other member of the bundle lies between them
+    and the run spans at most range_size bytes.
+    :param paths: selected members of the bundle, in data order
+    :param bundle_paths: all members of the bundle, in data order
+    """
+    positions = {p: i for i, p in enumerate(bundle_paths)}
+    runs = []
+    for path in paths:
+        member = index.members[path]
+        if runs and positions[path] == positions[runs[-1][-1]] + 1 and \
+                member["offset"] + member["size"] - index.members[runs[-1][0]]["offset"] <= range_size:
+            runs[-1].append(path)
+        else:
+            runs.append([path])
+    return runs
+
+
+def extract_members(read: Callable[[int, int], bytes], index: BundleIndex, paths: List[str], local_path: str) -> None:
+    """
+    Writes bundled files to local_path
+    :param read: returns size bytes of the bundle at offset
+    """
+    for path in paths:
+        member = index.members[path]
+        _write_file(os.path.join(local_path, path), read(member["offset"], member["size"]), member["mtime"])
+
+
+def unbundle(client, repository: str, ref: str, index_paths: Iterable[str], local_path: str,
+             select: Callable[[str], bool] = None, download_bundle: Callable[[str], str] = None,
+             concurrency: int = 1, range_size: int = BUNDLE_RANGE_SIZE) -> int:
+    """
+    Writes the bundled files listed in the indexes to local_path.
+    Bundles whose members are all selected are downloaded whole, other members are read with ranged requests,
+    adjacent members with one request. Bundles and ranges are processed concurrently.
+    :param select: returns False for paths of bundled files that are not wanted
+    :param download_bundle: downloads a bundle and returns its local path, it is removed after extraction
+    :param concurrency: number of bundles and ranges processed at the same time
+    :param range_size: max bytes of adjacent members read with one ranged request
+    :return: number of files written
+    """
+    def tasks():
+        for index_path in index_paths:
+            index = read_index(client, repository, ref, index_path)
+            selected = [p for p in index.members if select is None or select(p)]
+            all_members = index.by_bundle(index.members)
+            for bundle, paths in index.by_bundle(selected).items():
+                if download_bundle is not None and len(paths) == len(all_members[bundle]):
+                    yield index, bundle, paths, True
+                else:
+                    for run in merge_runs(index, paths, all_members[bundle], range_size):
+                        yield index, bundle, run, False
+
+    def extract(task):
+        index, bundle, paths, whole = task
+        if whole:
+            bundle_path = download_bundle(bundle)
+            try:
+                with open(bundle_path, "rb") as f:
+                    extract_members(lambda offset, size: os.pread(f.fileno(), size, offset), index, paths,
+                                    local_path)
+            finally:
+                os.remove(bundle_path)
+        else:
+            start = index.members[paths[0]]["offset"]
+            data = read_run(client, repository, ref, index, paths)
+            extract_members(lambda offset, size: data[offset - start:offset - start + size], index, paths,
+                            local_path)
+
+    written = 0
+    failed = []
+    for task, _, ex in run_concurrently(extract, tasks(), concurrency):
+        if ex is not None:
+            logging.error("Failed to unbundle files: {0}, {1}".format(task[1], ex))
+            failed.append(task[1])
+        else:
+            written += len(task[2])
+    metrics.count("files.unbundled", written)
+    if failed:
+        raise Exception(f"Error: failed to unbundle files of {len(failed)} bundles: {sorted(set(failed))}")
+    return written
+
+
+def _write_file(path: str, data: bytes, mtime: float) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = os.path.join(os.path.dirname(path), f".{os.path.basename(path)}.{uuid.uuid4().hex}.tmp")
+    with open(temp_path, "wb") as f:
+        f.write(data)
+    os.utime(temp_path, (mtime, mtime))
+    os.replace(temp_path, path)
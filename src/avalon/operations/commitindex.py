@@ -0,0 +1,102 @@
+import sqlite3
+import threading
+from typing import List
+
+from avalon.models.pipeline import CommitMetaData
+
+# commit metadata stored by LakeFsWrapper.commit_files, every field is indexed
+INDEXED_FIELDS = [f for f in CommitMetaData.__fields__ if f != "args"]
+
+
+class CommitIndex:
+    """
+    SQLite backed index of commit id -> CommitMetaData fields per repository, branch and path.
+    refresh() only reads commits newer than the last indexed one,
+    lookups by any metadata field use an index instead of scanning the commit log.
+    """
+    def __init__(self, db_path: str):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, timeout=60, check_same_thread=False)
+        columns = ", ".join(f"{f} TEXT" for f in INDEXED_FIELDS)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(f"""
+                CREATE TABLE IF NOT EXISTS commits (
+                    repository TEXT NOT NULL,
+                    branch TEXT NOT NULL,
+                    path TEXT NOT NULL,
+                    commit_id TEXT NOT NULL,
+                    seq INTEGER NOT NULL,
+                    creation_date INTEGER,
+                    {columns},
+                    PRIMARY KEY (repository, branch, path, commit_id))""")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS heads (
+                    repository TEXT NOT NULL,
+                    branch TEXT NOT NULL,
+                    path TEXT NOT NULL,
+                    commit_id TEXT NOT NULL,
+                    PRIMARY KEY (repository, branch, path))""")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS commits_seq ON commits (repository, branch, path, seq)")
+            for f in INDEXED_FIELDS:
+                self._conn.execute(f"CREATE INDEX IF NOT EXISTS commits_{f} ON commits (repository, branch, path, {f})")
+
+    def refresh(self, lake_fs_client, repository: str, branch: str, remote_path: str, page_size: int = 1000) -> int:
+        """
+        Adds commits made to branch under remote_path since the last refresh.
+        If the last indexed commit is no longer in the history (branch was reset) the index is rebuilt.
+        When the branch was indexed before, the commit log is read from a page of one commit that grows per page,
+        so an unchanged branch costs one small request.
+        :return: number of commits added
+        """
+        key = (repository, branch, remote_path)
+        with self._lock:
+            row = self._conn.execute("SELECT commit_id FROM heads WHERE repository = ? AND branch = ? AND path = ?",
+                                     key).fetchone()
+        last_indexed = row[0] if row else None
+
+        new_commits = []
+        found_last = False
+        for c in lake_fs_client.iter_commits(repository_name=repository, branch_name=branch,
+                                             path=remote_path.split("/"), page_size=page_size,
+                                             first_page_size=1 if last_indexed is not None else page_size):
+            if c.id == last_indexed:
+                found_last = True
+                break
+            new_commits.append(c)
+        if not new_commits:
+            return 0
+
+        with self._lock, self._conn:
+            if last_indexed is not None and not found_last:
+                self._conn.execute("DELETE FROM commits WHERE repository = ? AND branch = ? AND path = ?", key)
+            max_seq = self._conn.execute("SELECT COALESCE(MAX(seq), 0) FROM commits WHERE repository = ? "
+                                         "AND branch = ? AND path = ?", key).fetchone()[0]
+            rows = []
+            for i, c in enumerate(reversed(new_commits)):
+                metadata = c.metadata or {}
+                rows.append(key + (c.id, max_seq + i + 1, c.creation_date) +
+                            tuple(metadata.get(f) for f in INDEXED_FIELDS))
+            placeholders = ", ".join("?" * (6 + len(INDEXED_FIELDS)))
+            self._conn.executemany(f"INSERT OR REPLACE INTO commits VALUES ({placeholders})", rows)
+            self._conn.execute("INSERT OR REPLACE INTO heads VALUES (?, ?, ?, ?)", key + (new_commits[0].id,))
+        return len(new_commits)
+
+    def find(self, repository: str, branch: str, remote_path: str, **fields) -> List[str]:
+        """
+        Returns ids of indexed commits whose metadata matches all given fields, newest first.
+        Example: find(repo, "main", "result", input_commit_id=commit_id)
+        """
+        unknown = set(fields) - set(INDEXED_FIELDS)
+        if unknown:
+            raise Exception(f"Error: commit metadata fields are not indexed: {unknown}")
+        where = "".join(f" AND {f} = ?" for f in fields)
+        with self._lock:
+            rows = self._conn.execute(f"SELECT commit_id FROM commits WHERE repository = ? AND branch = ? "
+                                      f"AND path = ?{where} ORDER BY seq DESC",
+                                      (repository, branch, remote_path) + tuple(fields.values())).fetchall()
+        return [r[0] for r in rows]
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
@@ -1,19 +1,94 @@
+import fnmatch
+import hashlib
+import itertools
+import logging
 import os
-from typing import List, Set
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Iterator, List, Optional, Set, Tuple
+
+from avalon.models.pipeline import LocalFile
+
+CHECKSUM_BLOCK_SIZE = 1024 * 1024
+# threads listing directories in parallel, helps on network file systems
+SCAN_THREADS = int(os.environ.get("LAKEFS_SCAN_THREADS", 8))
 
 
 def get_filepaths(directory: str) -> List[str]:
     """
     This function walks through the directories and return list of paths for files found
     """
-    file_paths = []
+    return [path for path, _, _ in _walk(directory, with_stats=False)]
+
+
+def scan_files(rootpath: str, root_destpath: str, threads: int = SCAN_THREADS,
+               ignore: List[str] = None) -> Iterator[LocalFile]:
+    """
+    Yields local path, destination path, size and mtime of every file under rootpath while it is scanned,
+    in the order of get_filepaths. Directories are listed by up to threads threads ahead of the consumer.
 
-    for root, directories, files in os.walk(directory):
-        for filename in files:
-            filepath = os.path.join(root, filename)
-            file_paths.append(filepath)
+    Note: @rootpath should include ending /. For example: /data/test1/
+    :param ignore: fnmatch patterns of files and directories to skip,
+                   matched against the path relative to rootpath and against the name
+    """
+    if rootpath[-1] != '/':
+        raise Exception("rootpath is not valid")
 
-    return file_paths
+    for path, relative_path, stats in _walk(rootpath, threads=threads, ignore=ignore):
+        yield LocalFile(local_path=path, dest_path=os.path.join(root_destpath, relative_path),
+                        size=stats.st_size, mtime=stats.st_mtime)
+
+
+def _walk(directory: str, threads: int = 1, ignore: List[str] = None, with_stats: bool = True):
+    """
+    Yields (path, path relative to directory, stats) of files, files of a directory before its subdirectories
+    like os.walk. Symlinks to directories are not followed.
+    Directories that can not be listed are skipped like os.walk does, a missing directory yields nothing.
+    """
+    ignore = list(ignore or [])
+    if threads <= 1:
+        pending = deque([(directory, "")])
+        while pending:
+            files, subdirs = _scan_dir(*pending.popleft(), ignore, with_stats)
+            yield from files
+            pending.extendleft(reversed(subdirs))
+        return
+
+    # directories in walk order, the first ones are listed ahead in the pool
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        pending = deque([[(directory, ""), None]])
+        while pending:
+            for item in itertools.islice(pending, 2 * threads):
+                if item[1] is None:
+                    item[1] = executor.submit(_scan_dir, *item[0], ignore, with_stats)
+            files, subdirs = pending.popleft()[1].result()
+            yield from files
+            pending.extendleft([subdir, None] for subdir in reversed(subdirs))
+
+
+def _scan_dir(path: str, relative_path: str, ignore: List[str], with_stats: bool):
+    files, subdirs = [], []
+    try:
+        entries = os.scandir(path)
+    except OSError as ex:
+        logging.warning(f"Skipping directory that can not be listed: {ex}")
+        return files, subdirs
+    with entries:
+        for entry in entries:
+            relative_entry = os.path.join(relative_path, entry.name)
+            if any(fnmatch.fnmatchcase(relative_entry, p) or fnmatch.fnmatchcase(entry.name, p) for p in ignore):
+                continue
+            if entry.is_dir():
+                if not entry.is_symlink():
+                    subdirs.append((entry.path, relative_entry))
+                continue
+            try:
+                stats = entry.stat() if with_stats else None
+            except FileNotFoundError:
+                logging.warning(f"Skipping broken link or removed file: {entry.path}")
+                continue
+            files.append((entry.path, relative_entry, stats))
+    return files, subdirs
 
 
 def get_dest_filepaths(files: List[str], rootpath: str, root_destpath: str) -> List[str]:
@@ -46,3 +121,74 @@ def create_dirs(dirs: Set[str]) -> None:
     for d in dirs:
         if not os.path.exists(d):
             os.makedirs(d)
+
+
+def compute_checksum(path: str) -> str:
+    """
+    Returns md5 hex digest of a file, the checksum LakeFS reports for objects uploaded in a single part
+    """
+    md5 = hashlib.md5()
+    with open(path, "rb") as f:
+        while block := f.read(CHECKSUM_BLOCK_SIZE):
+            md5.update(block)
+    return md5.hexdigest()
+
+
+class PathFilter:
+    """
+    Selects remote paths by include and exclude glob patterns and by an exact list of paths.
+    Patterns are fnmatch patterns matched against the full path in the repository, * also matches /.
+    A path is selected if it matches any include pattern (or there are none), no exclude pattern,
+    is in paths (if given) and belongs to shard (if given).
+    """
+    def __init__(self, include: List[str] = None, exclude: List[str] = None, paths: Iterable[str] = None,
+                 shard: Tuple[int, int] = None):
+        self.include = list(include or [])
+        self.exclude = list(exclude or [])
+        self.paths: Optional[Set[str]] = set(paths) if paths is not None else None
+        self.shard = shard
+
+    def matches(self, path: str) -> bool:
+        if self.paths is not None and path not in self.paths:
+            return False
+        if self.shard is not None and not in_shard(path, self.shard):
+            return False
+        if self.include and not any(fnmatch.fnmatchcase(path, p) for p in self.include):
+            return False
+        return not any(fnmatch.fnmatchcase(path, p) for p in self.exclude)
+
+    def filter(self, paths: Iterable[str]) -> Iterator[str]:
+        return (p for p in paths if self.matches(p))
+
+
+def read_path_list(path: str) -> List[str]:
+    """
+    Reads a manifest of remote paths, one path per line. Empty lines and lines starting with # are ignored
+    """
+    with open(path) as f:
+        lines = (line.strip() for line in f)
+        return [line.lstrip('/') for line in lines if line and not line.startswith('#')]
+
+
+def parse_shard(value: str) -> Tuple[int, int]:
+    """
+    Parses a shard given as i/n, the i-th of n shards counting from 0
+    """
+    try:
+        index, count = (int(v) for v in value.split("/"))
+    except ValueError:
+        raise Exception(f"Error: shard {value} is not valid, expected i/n")
+    if count < 1 or not 0 <= index < count:
+        raise Exception(f"Error: shard {value} is not valid, expected 0 <= i < n")
+    return index, count
+
+
+def in_shard(path: str, shard: Tuple[int, int]) -> bool:
+    """
+    Returns True if the remote path belongs to shard (i, n).
+    Paths are partitioned by a hash of the path, so every worker computes the same partition
+    whatever the order or the machine it lists the files on.
+    """
+    index, count = shard
+    digest = hashlib.md5(path.encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") % count == index
@@ -0,0 +1,107 @@
+import os
+import sqlite3
+import threading
+from typing import Optional
+
+from avalon.operations.files import compute_checksum
+from avalon.operations.transfer import is_md5
+
+
+class HashCache:
+    """
+    SQLite backed cache of local file checksums.
+    A cached checksum is reused as long as size, mtime and inode of the file are unchanged.
+    It also records which remote object every downloaded file came from,
+    so files that are already present and identical are not downloaded again.
+    """
+    def __init__(self, db_path: str):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, timeout=60, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS file_checksums (
+                    path TEXT PRIMARY KEY,
+                    size INTEGER NOT NULL,
+                    mtime_ns INTEGER NOT NULL,
+                    inode INTEGER NOT NULL,
+                    checksum TEXT NOT NULL)""")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS downloads (
+                    path TEXT PRIMARY KEY,
+                    size INTEGER NOT NULL,
+                    mtime_ns INTEGER NOT NULL,
+                    inode INTEGER NOT NULL,
+                    repository TEXT NOT NULL,
+                    ref TEXT NOT NULL,
+                    remote_path TEXT NOT NULL,
+                    checksum TEXT NOT NULL)""")
+
+    def checksum(self, path: str) -> str:
+        """
+        Returns md5 checksum of a local file, computing it only if the file changed since it was cached
+        """
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        with self._lock:
+            row = self._conn.execute("SELECT checksum FROM file_checksums WHERE path = ? AND size = ? "
+                                     "AND mtime_ns = ? AND inode = ?",
+                                     (path, st.st_size, st.st_mtime_ns, st.st_ino)).fetchone()
+        if row:
+            return row[0]
+        checksum = compute_checksum(path)
+        self._store_checksum(path, st, checksum)
+        return checksum
+
+    def record_download(self, path: str, repository: str, ref: str, remote_path: str, checksum: str) -> None:
+        """
+        Records that local file path holds the content of remote_path with the given remote checksum
+        """
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO downloads VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                               (path, st.st_size, st.st_mtime_ns, st.st_ino, repository, ref, remote_path,
+                                checksum))
+        if is_md5(checksum):
+            self._store_checksum(path, st, checksum)
+
+    def is_downloaded(self, path: str, repository: str, remote_path: str, checksum: str) -> bool:
+        """
+        Returns True if local file path is unchanged since it was downloaded from a remote object
+        with the same path and checksum
+        """
+        path = os.path.abspath(path)
+        st = self._stat(path)
+        if st is None:
+            return False
+        with self._lock:
+            row = self._conn.execute("SELECT 1 FROM downloads WHERE path = ? AND size = ? AND mtime_ns = ? "
+                                     "AND inode = ? AND repository = ? AND remote_path = ? AND checksum = ?",
+                                     (path, st.st_size, st.st_mtime_ns, st.st_ino, repository, remote_path,
+                                      checksum)).fetchone()
+        return row is not None
+
+    def downloaded_from(self, path: str) -> Optional[tuple]:
+        """
+        Returns (repository, ref, remote_path, checksum) the local file was downloaded from, if known
+        """
+        with self._lock:
+            return self._conn.execute("SELECT repository, ref, remote_path, checksum FROM downloads WHERE path = ?",
+                                      (os.path.abspath(path),)).fetchone()
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def _store_checksum(self, path: str, st: os.stat_result, checksum: str) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO file_checksums VALUES (?, ?, ?, ?, ?)",
+                               (path, st.st_size, st.st_mtime_ns, st.st_ino, checksum))
+
+    @staticmethod
+    def _stat(path: str) -> Optional[os.stat_result]:
+        try:
+            return os.stat(path)
+        except FileNotFoundError:
+            return None
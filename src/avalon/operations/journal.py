@@ -0,0 +1,80 @@
+import sqlite3
+import threading
+from typing import Set, Tuple
+
+
+class DownloadJournal:
+    """
+    SQLite backed journal of completed downloads and completed byte ranges of partial downloads,
+    keyed by repository, commit id and path, so a restarted get skips finished files and resumes partial ones.
+    A journal entry is only valid for the remote checksum it was recorded with.
+    """
+    def __init__(self, db_path: str):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, timeout=60, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS files (
+                    repository TEXT NOT NULL,
+                    ref TEXT NOT NULL,
+                    path TEXT NOT NULL,
+                    checksum TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    completed INTEGER NOT NULL,
+                    PRIMARY KEY (repository, ref, path))""")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS ranges (
+                    repository TEXT NOT NULL,
+                    ref TEXT NOT NULL,
+                    path TEXT NOT NULL,
+                    start_byte INTEGER NOT NULL,
+                    end_byte INTEGER NOT NULL,
+                    PRIMARY KEY (repository, ref, path, start_byte, end_byte))""")
+
+    def is_complete(self, repository: str, ref: str, path: str, checksum: str) -> bool:
+        with self._lock:
+            row = self._conn.execute("SELECT 1 FROM files WHERE repository = ? AND ref = ? AND path = ? "
+                                     "AND checksum = ? AND completed = 1",
+                                     (repository, ref, path, checksum)).fetchone()
+        return row is not None
+
+    def start_file(self, repository: str, ref: str, path: str, checksum: str, size: int,
+                   resume: bool) -> Set[Tuple[int, int]]:
+        """
+        Registers a download that is starting or resuming
+        :param resume: False if the partial file is gone and every range has to be downloaded again
+        :return: (start, end) of byte ranges that are already downloaded
+        """
+        key = (repository, ref, path)
+        with self._lock, self._conn:
+            row = self._conn.execute("SELECT checksum, size FROM files WHERE repository = ? AND ref = ? AND path = ?",
+                                     key).fetchone()
+            if not resume or row != (checksum, size):
+                self._conn.execute("DELETE FROM ranges WHERE repository = ? AND ref = ? AND path = ?", key)
+                self._conn.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, 0)", key + (checksum, size))
+                return set()
+            rows = self._conn.execute("SELECT start_byte, end_byte FROM ranges WHERE repository = ? AND ref = ? AND path = ?",
+                                      key).fetchall()
+        return {(r[0], r[1]) for r in rows}
+
+    def complete_range(self, repository: str, ref: str, path: str, start: int, end: int) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR IGNORE INTO ranges VALUES (?, ?, ?, ?, ?)",
+                               (repository, ref, path, start, end))
+
+    def complete_file(self, repository: str, ref: str, path: str) -> None:
+        key = (repository, ref, path)
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM ranges WHERE repository = ? AND ref = ? AND path = ?", key)
+            self._conn.execute("UPDATE files SET completed = 1 WHERE repository = ? AND ref = ? AND path = ?", key)
+
+    def discard_file(self, repository: str, ref: str, path: str) -> None:
+        key = (repository, ref, path)
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM ranges WHERE repository = ? AND ref = ? AND path = ?", key)
+            self._conn.execute("DELETE FROM files WHERE repository = ? AND ref = ? AND path = ?", key)
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
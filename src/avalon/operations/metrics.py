@@ -0,0 +1,135 @@
+import json
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Dict, Optional
+
+_registry = None
+_disabled_timer = nullcontext()
+
+
+class Metrics:
+    """
+    Thread safe counters and timers of one avalon command.
+    Counters hold totals (requests, bytes, retries, cache hits),
+    timers hold count, total and max seconds of a phase or an API call.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[str, float] = {}
+        self._timers: Dict[str, list] = {}
+        self._start = time.perf_counter()
+
+    def count(self, name: str, value: float = 1) -> None:
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    @contextmanager
+    def timer(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def observe(self, name: str, seconds: float) -> None:
+        with self._lock:
+            t = self._timers.setdefault(name, [0, 0.0, 0.0])
+            t[0] += 1
+            t[1] += seconds
+            t[2] = max(t[2], seconds)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "wall_seconds": time.perf_counter() - self._start,
+                "counters": dict(self._counters),
+                "timers": {name: {"count": t[0], "seconds": t[1], "max_seconds": t[2]}
+                           for name, t in self._timers.items()},
+            }
+
+    def summary(self) -> str:
+        """
+        Returns a human readable table of all counters and timers
+        """
+        snapshot = self.snapshot()
+        lines = [f"avalon metrics, wall time {snapshot['wall_seconds']:.3f}s"]
+        for name, t in sorted(snapshot["timers"].items()):
+            lines.append(f"  {name:<32} {t['count']:>8} calls {t['seconds']:>10.3f}s total "
+                         f"{t['max_seconds']:>8.3f}s max")
+        for name, value in sorted(snapshot["counters"].items()):
+            lines.append(f"  {name:<32} {value:>8g}")
+        return "\n".join(lines)
+
+    def write_json(self, path: str) -> None:
+        _write_atomic(path, json.dumps(self.snapshot(), indent=2))
+
+    def write_prometheus(self, path: str, labels: Dict[str, str] = None) -> None:
+        """
+        Writes all metrics in Prometheus text format, e.g. for the node exporter textfile collector
+        """
+        snapshot = self.snapshot()
+        label_str = ",".join(f'{k}="{v}"' for k, v in sorted((labels or {}).items()))
+        label_str = f"{{{label_str}}}" if label_str else ""
+        lines = ["# TYPE avalon_wall_seconds gauge", f"avalon_wall_seconds{label_str} {snapshot['wall_seconds']}"]
+        for name, value in sorted(snapshot["counters"].items()):
+            metric = f"avalon_{_metric_name(name)}_total"
+            lines += [f"# TYPE {metric} counter", f"{metric}{label_str} {value}"]
+        for name, t in sorted(snapshot["timers"].items()):
+            metric = f"avalon_{_metric_name(name)}_seconds"
+            lines += [f"# TYPE {metric} summary",
+                      f"{metric}_sum{label_str} {t['seconds']}",
+                      f"{metric}_count{label_str} {t['count']}",
+                      f"# TYPE {metric}_max gauge",
+                      f"{metric}_max{label_str} {t['max_seconds']}"]
+        _write_atomic(path, "\n".join(lines) + "\n")
+
+
+def enable() -> Metrics:
+    """
+    Starts collecting metrics in a new registry
+    """
+    global _registry
+    _registry = Metrics()
+    return _registry
+
+
+def disable() -> None:
+    global _registry
+    _registry = None
+
+
+def current() -> Optional[Metrics]:
+    return _registry
+
+
+def count(name: str, value: float = 1) -> None:
+    """
+    Adds value to counter name, does nothing if metrics are disabled
+    """
+    registry = _registry
+    if registry is not None:
+        registry.count(name, value)
+
+
+def timer(name: str):
+    """
+    Context manager timing its block as name, does nothing if metrics are disabled
+    """
+    registry = _registry
+    if registry is None:
+        return _disabled_timer
+    return registry.timer(name)
+
+
+def _metric_name(name: str) -> str:
+    return re.sub(r"[^a-zA-Z0-9_]", "_", name)
+
+
+def _write_atomic(path: str, content: str) -> None:
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w") as f:
+        f.write(content)
+    os.replace(temp_path, path)
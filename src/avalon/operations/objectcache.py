@@ -0,0 +1,163 @@
+import errno
+import fcntl
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Optional
+
+OBJECT_CACHE_MAX_BYTES = int(os.environ.get("LAKEFS_OBJECT_CACHE_MAX_BYTES", 10 * 1024 ** 3))
+
+# ioctl to share the extents of a file on copy on write file systems (btrfs, xfs)
+_FICLONE = 0x40049409
+
+
+class ObjectCache:
+    """
+    Node local cache of downloaded objects in cache_dir, keyed by remote checksum and size.
+    Objects used least recently are evicted when the cache grows over max_bytes.
+    Several processes may share one cache dir: objects are added by atomic rename
+    and the SQLite index serializes inserts and evictions.
+    With link=True files are materialized as read only hardlinks to the cached object,
+    otherwise they are cloned where the file system supports it, or copied.
+    """
+    def __init__(self, cache_dir: str, max_bytes: int = OBJECT_CACHE_MAX_BYTES, link: bool = False):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.link = link
+        os.makedirs(os.path.join(cache_dir, "objects"), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(cache_dir, "index.sqlite"), timeout=60,
+                                     check_same_thread=False, isolation_level=None)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS objects (
+                    key TEXT PRIMARY KEY,
+                    size INTEGER NOT NULL,
+                    last_used REAL NOT NULL)""")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS objects_last_used ON objects (last_used)")
+
+    def get(self, checksum: str, size: int, dest_path: str) -> bool:
+        """
+        Materializes the cached object at dest_path
+        :return: False if the object is not cached
+        """
+        key = _key(checksum, size)
+        if key is None:
+            return False
+        path = self._object_path(key)
+        temp_path = self._temp_path(dest_path)
+        try:
+            if self.link:
+                _link_or_copy(path, temp_path)
+            else:
+                _clone_or_copy(path, temp_path)
+            if os.path.getsize(temp_path) != size:
+                raise FileNotFoundError(path)
+            os.replace(temp_path, dest_path)
+        except OSError as ex:
+            # not cached or evicted meanwhile, other errors fall back to a download too
+            if not isinstance(ex, FileNotFoundError):
+                logging.warning(f"Failed to materialize {dest_path} from object cache: {ex}")
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            return False
+        with self._lock:
+            self._conn.execute("UPDATE objects SET last_used = ? WHERE key = ?", (time.time(), key))
+        return True
+
+    def put(self, checksum: str, size: int, path: str) -> None:
+        """
+        Adds a downloaded file to the cache and evicts least recently used objects over max_bytes
+        """
+        key = _key(checksum, size)
+        if key is None or size > self.max_bytes:
+            return
+        object_path = self._object_path(key)
+        os.makedirs(os.path.dirname(object_path), exist_ok=True)
+        temp_path = self._temp_path(object_path)
+        try:
+            if self.link:
+                _link_or_copy(path, temp_path)
+            else:
+                _clone_or_copy(path, temp_path)
+            # a hardlink shares the mode with the materialized file, which becomes read only too
+            os.chmod(temp_path, 0o444)
+            os.replace(temp_path, object_path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute("INSERT OR REPLACE INTO objects VALUES (?, ?, ?)", (key, size, time.time()))
+                self._evict()
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def size(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM objects").fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def _evict(self) -> None:
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM objects").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in self._conn.execute("SELECT key, size FROM objects ORDER BY last_used").fetchall():
+            if total <= self.max_bytes:
+                break
+            self._conn.execute("DELETE FROM objects WHERE key = ?", (key,))
+            try:
+                # materialized hardlinks keep their content
+                os.remove(self._object_path(key))
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def _object_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, "objects", key[:2], key)
+
+    @staticmethod
+    def _temp_path(path: str) -> str:
+        directory, name = os.path.split(path)
+        return os.path.join(directory, f".{name}.{uuid.uuid4().hex}.tmp")
+
+
+def _key(checksum: str, size: int) -> Optional[str]:
+    checksum = checksum.strip('"')
+    if not checksum or not all(c.isalnum() or c == "-" for c in checksum):
+        return None
+    return f"{checksum}-{size}"
+
+
+def _link_or_copy(src: str, dst: str) -> None:
+    """
+    Hardlinks src to dst, or clones or copies it if they are on different file systems
+    """
+    try:
+        os.link(src, dst)
+    except OSError as ex:
+        if ex.errno != errno.EXDEV:
+            raise
+        logging.debug(f"Cannot hardlink across file systems, copying {src}")
+        _clone_or_copy(src, dst)
+
+
+def _clone_or_copy(src: str, dst: str) -> None:
+    with open(src, 'rb') as s, open(dst, 'wb') as d:
+        try:
+            fcntl.ioctl(d.fileno(), _FICLONE, s.fileno())
+            return
+        except OSError:
+            pass
+        shutil.copyfileobj(s, d, 1024 * 1024)
@@ -0,0 +1,110 @@
+import io
+import os
+import threading
+from collections import OrderedDict
+
+REMOTE_FILE_BLOCK_SIZE = int(os.environ.get("LAKEFS_REMOTE_FILE_BLOCK_SIZE", 4 * 1024 * 1024))
+# blocks fetched after the requested one when reading sequentially
+REMOTE_FILE_READ_AHEAD = int(os.environ.get("LAKEFS_REMOTE_FILE_READ_AHEAD", 2))
+REMOTE_FILE_CACHE_BLOCKS = int(os.environ.get("LAKEFS_REMOTE_FILE_CACHE_BLOCKS", 16))
+
+
+class RemoteFile(io.RawIOBase):
+    """
+    Read only, seekable file object of a LakeFS object, e.g. for pyarrow to read a footer and a few row groups.
+    The object is read in blocks of block_size bytes with ranged requests, only when read.
+    Reading sequentially fetches read_ahead more blocks in the same request.
+    The cache_blocks blocks used last are kept in memory.
+    """
+    def __init__(self, client, repository: str, ref: str, path: str, size: int,
+                 block_size: int = REMOTE_FILE_BLOCK_SIZE, read_ahead: int = REMOTE_FILE_READ_AHEAD,
+                 cache_blocks: int = REMOTE_FILE_CACHE_BLOCKS):
+        """
+        :param client: LakeFsWrapper the ranges are requested with
+        :param size: size of the object in bytes
+        """
+        super().__init__()
+        if block_size < 1:
+            raise Exception("Error: block size must be positive")
+        self.repository = repository
+        self.ref = ref
+        self.path = path
+        self.name = path
+        self.size = size
+        self.block_size = block_size
+        self.read_ahead = max(0, read_ahead)
+        self.cache_blocks = max(1, cache_blocks, self.read_ahead + 1)
+        self._client = client
+        self._position = 0
+        self._last_block = None
+        self._blocks = OrderedDict()
+        self._lock = threading.Lock()
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self._position + offset
+        elif whence == io.SEEK_END:
+            position = self.size + offset
+        else:
+            raise ValueError(f"invalid whence: {whence}")
+        if position < 0:
+            raise ValueError(f"negative seek position: {position}")
+        self._position = position
+        return position
+
+    def readinto(self, buffer) -> int:
+        if self.closed:
+            raise ValueError("I/O operation on closed file")
+        view = memoryview(buffer).cast("B")
+        length = max(0, min(len(view), self.size - self._position))
+        copied = 0
+        while copied < length:
+            index, offset = divmod(self._position, self.block_size)
+            block = self._get_block(index)
+            n = min(length - copied, len(block) - offset)
+            view[copied:copied + n] = block[offset:offset + n]
+            copied += n
+            self._position += n
+        return copied
+
+    def readall(self) -> bytes:
+        return self.read(max(0, self.size - self._position))
+
+    def _get_block(self, index: int) -> bytes:
+        with self._lock:
+            sequential = self._last_block is not None and index == self._last_block + 1
+            self._last_block = index
+            block = self._blocks.get(index)
+            if block is not None:
+                self._blocks.move_to_end(index)
+                return block
+            last = self._block_count() - 1
+            end = min(index + (self.read_ahead if sequential else 0), last)
+            # stop the read ahead at the first block that is cached
+            for i in range(index + 1, end + 1):
+                if i in self._blocks:
+                    end = i - 1
+                    break
+            data = self._client.get_range(self.repository, self.ref, self.path, index * self.block_size,
+                                          min((end + 1) * self.block_size, self.size) - 1)
+            for i in range(index, end + 1):
+                start = (i - index) * self.block_size
+                self._blocks[i] = data[start:start + self.block_size]
+                self._blocks.move_to_end(i)
+            while len(self._blocks) > self.cache_blocks:
+                self._blocks.popitem(last=False)
+            return self._blocks[index]
+
+    def _block_count(self) -> int:
+        return (self.size + self.block_size - 1) // self.block_size
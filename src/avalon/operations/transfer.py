@@ -0,0 +1,88 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Callable, Iterable, Iterator, Tuple, Union
+
+from lakefs_sdk import ObjectStats
+
+from avalon.models.pipeline import RemoteObject
+
+
+class IncompleteRangeError(Exception):
+    """
+    A ranged request returned fewer bytes than requested, the request is tried again
+    """
+    pass
+
+
+class TtlCache:
+    """
+    Thread safe set of keys that expire ttl seconds after they were added
+    """
+    def __init__(self, ttl: float):
+        self._ttl = ttl
+        self._expires = {}
+        self._lock = threading.Lock()
+
+    def __contains__(self, key) -> bool:
+        with self._lock:
+            expires = self._expires.get(key)
+            if expires is not None and expires <= time.monotonic():
+                del self._expires[key]
+                expires = None
+        return expires is not None
+
+    def add(self, key) -> None:
+        with self._lock:
+            self._expires[key] = time.monotonic() + self._ttl
+
+    def discard(self, key) -> None:
+        with self._lock:
+            self._expires.pop(key, None)
+
+
+def run_concurrently(func: Callable, items: Iterable, concurrency: int) -> Iterator[Tuple[object, object, Exception]]:
+    """
+    Runs func over items on a bounded thread pool.
+    At most 2 * concurrency items are in flight, so items may be a lazy iterable.
+    :return: yields (item, result, exception) as they complete, exception is None on success
+    """
+    def outcome(future):
+        item = pending.pop(future)
+        ex = future.exception()
+        return item, None if ex else future.result(), ex
+
+    concurrency = max(1, concurrency)
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        pending = {}
+        for item in items:
+            pending[executor.submit(func, item)] = item
+            if len(pending) >= 2 * concurrency:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield outcome(future)
+        for future in list(pending):
+            yield outcome(future)
+
+
+def is_md5(checksum: str) -> bool:
+    return len(checksum) == 32 and all(c in "0123456789abcdef" for c in checksum)
+
+
+def partial_path(dest_path: str) -> str:
+    """
+    Returns path of the temporary file a download is written to before it is renamed to dest_path
+    """
+    return os.path.join(os.path.dirname(dest_path), f".{os.path.basename(dest_path)}.part")
+
+
+def remote_object_from_stats(stats: ObjectStats) -> RemoteObject:
+    return RemoteObject(path=stats.path, size=stats.size_bytes, checksum=stats.checksum, mtime=stats.mtime)
+
+
+def location_of(remote_file: Union[str, RemoteObject]) -> str:
+    """
+    Returns the remote path of a listed object or of a plain path
+    """
+    return remote_file.path if isinstance(remote_file, RemoteObject) else remote_file
@@ -0,0 +1,260 @@
+"""
+Benchmarks put_files, get_filelist, get_files and get_changes on synthetic datasets
+and prints the results as JSON.
+
+Against the in-process stand-in server (default):
+    python -m tst.benchmarks.benchmark
+Against a LakeFS server, e.g. the quickstart container of docker-compose.test.yaml:
+    python -m tst.benchmarks.benchmark --config lakectl.yaml --dataset 1000:4096:3 -j 16 -o results.json
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import tempfile
+import time
+import uuid
+from contextlib import contextmanager
+
+from lakefs_sdk import Configuration
+
+from avalon.config import Config
+from avalon.mainoperations import put_files, get_files, put_files_async, get_files_async
+from avalon.operations.AsyncLakeFsWrapper import AsyncLakeFsWrapper
+from avalon.operations.LakeFsWrapper import LakeFsWrapper
+from tst.benchmarks.lakefs_standin import LakeFsStandIn
+
+# file count : file size in bytes : directory depth
+DEFAULT_DATASETS = ["2000:4096:3", "8:33554432:1", "500:16384:10"]
+# share of files changed before get_changes
+CHANGED_SHARE = 0.1
+REMOTE_PATH = "bench"
+BRANCH = "main"
+
+
+def make_dataset(root: str, count: int, size: int, depth: int) -> None:
+    """
+    Writes count files of size random bytes, spread over directories depth levels deep
+    """
+    for i in range(count):
+        dirs = [f"d{level}-{(i // (level + 1)) % 4}" for level in range(depth - 1)]
+        directory = os.path.join(root, *dirs)
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, f"file{i}.bin"), "wb") as f:
+            f.write(os.urandom(size))
+
+
+def change_dataset(root: str, share: float) -> int:
+    """
+    Overwrites share of the files with new random bytes of the same size
+    :return: number of changed files
+    """
+    paths = sorted(os.path.join(d, f) for d, _, files in os.walk(root) for f in files)
+    changed = paths[::max(1, round(1 / share))]
+    for path in changed:
+        size = os.path.getsize(path)
+        with open(path, "wb") as f:
+            f.write(os.urandom(size))
+    return len(changed)
+
+
+def percentile(values, p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, max(0, round(p / 100 * len(values)) - 1))]
+
+
+def peak_rss_mb() -> float:
+    """
+    Peak RSS of this process. On Linux ru_maxrss also counts the process this one was started from,
+    VmHWM counts only this one
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    # ru_maxrss is in KiB on Linux
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+@contextmanager
+def timed_calls(obj, name: str, latencies: list):
+    """
+    Records the duration of every call to method name of obj while in the context
+    """
+    original = getattr(obj, name)
+
+    def timed(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return original(*args, **kwargs)
+        finally:
+            latencies.append(time.perf_counter() - start)
+
+    async def timed_async(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await original(*args, **kwargs)
+        finally:
+            latencies.append(time.perf_counter() - start)
+
+    setattr(obj, name, timed_async if asyncio.iscoroutinefunction(original) else timed)
+    try:
+        yield
+    finally:
+        delattr(obj, name)
+
+
+def measure(dataset: str, operation: str, latency_of: str, files: int, size_bytes: int, run) -> dict:
+    """
+    Runs run(latencies) and returns throughput, latency of the calls to latency_of and peak RSS of the process
+    of the dataset up to the end of run
+    """
+    latencies = []
+    start = time.perf_counter()
+    run(latencies)
+    seconds = time.perf_counter() - start
+    return {
+        "dataset": dataset,
+        "operation": operation,
+        "files": files,
+        "bytes": size_bytes,
+        "seconds": round(seconds, 4),
+        "files_per_s": round(files / seconds, 2),
+        "mb_per_s": round(size_bytes / seconds / 1024 ** 2, 2),
+        "latency_of": latency_of,
+        "latency_calls": len(latencies),
+        "latency_p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "latency_p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        # every dataset runs in its own process, this is the peak of the dataset's operations so far
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def run_dataset(configuration, dataset: str, concurrency: int, use_async: bool) -> list:
+    count, size, depth = (int(v) for v in dataset.split(":"))
+    repo = f"bench-{uuid.uuid4().hex[:8]}"
+    work_dir = tempfile.mkdtemp(prefix="avalon-bench-")
+    local_path = os.path.join(work_dir, "data")
+    client = LakeFsWrapper(configuration=configuration)
+    put_args = dict(remote_path=REMOTE_PATH, repo=repo, branch=BRANCH, task_name="benchmark", pipeline_id="benchmark",
+                    task_docker_image="benchmark", task_args=[], s3storage=False, commit_id="",
+                    source_branch_name=None, concurrency=concurrency)
+    get_args = dict(remote_path=REMOTE_PATH, repo=repo, branch=BRANCH, changes_only=False, concurrency=concurrency)
+
+    # the async client uploads in a closure, every request is timed instead
+    put_latency_of = "_request" if use_async else "_upload_file_content"
+
+    def put(latencies, **kwargs):
+        if use_async:
+            asyncio.run(_run_async(put_files_async, configuration, put_latency_of, latencies,
+                                   local_path=local_path + "/", **put_args, **kwargs))
+            return
+        with timed_calls(client, put_latency_of, latencies):
+            put_files(local_path=local_path + "/", lake_fs_client=client, **put_args, **kwargs)
+
+    def get(latencies):
+        get_path = tempfile.mkdtemp(dir=work_dir)
+        if use_async:
+            asyncio.run(_run_async(get_files_async, configuration, "download_file", latencies,
+                                   local_path=get_path, **get_args))
+            return
+        with timed_calls(client, "download_file", latencies):
+            get_files(local_path=get_path, lake_fs_client=client, **get_args)
+
+    def list_files(latencies):
+        with timed_calls(client._client.objects_api, "list_objects", latencies):
+            listed = client.get_filelist(BRANCH, repo, REMOTE_PATH)
+        assert len(listed) == count, f"listed {len(listed)} of {count} files"
+
+    try:
+        make_dataset(local_path, count, size, depth)
+        results = [measure(dataset, "put_files", put_latency_of, count, count * size, put),
+                   measure(dataset, "get_filelist", "list_objects", count, 0, list_files),
+                   measure(dataset, "get_files", "download_file", count, count * size, get)]
+
+        first_commit = client.get_commit_id(repo, BRANCH)
+        changed = change_dataset(local_path, CHANGED_SHARE)
+        put([], skip_unchanged=True)
+
+        def changes(latencies):
+            with timed_calls(client._client.refs_api, "diff_refs", latencies):
+                diff = client.get_changes(BRANCH, repo, REMOTE_PATH, from_commit_id=first_commit)
+            assert len(diff) == changed, f"{len(diff)} of {changed} changes"
+
+        results.append(measure(dataset, "get_changes", "diff_refs", changed, 0, changes))
+        return results
+    finally:
+        shutil.rmtree(work_dir)
+
+
+def make_configuration(config_path: str, host: str, concurrency: int) -> Configuration:
+    """
+    Configuration of the server of a lakectl config, or of the stand-in server at host
+    """
+    if config_path:
+        configuration = Config(lakefs_conf_path=config_path).get_config()
+    else:
+        configuration = Configuration(host=host, username="benchmark", password="benchmark")
+    # each transfer worker holds its own connection
+    configuration.connection_pool_maxsize = max(configuration.connection_pool_maxsize, concurrency)
+    return configuration
+
+
+def _run_dataset_process(config_path: str, host: str, dataset: str, concurrency: int, use_async: bool) -> list:
+    return run_dataset(make_configuration(config_path, host, concurrency), dataset, concurrency, use_async)
+
+
+async def _run_async(operation, configuration, latency_of: str, latencies: list, **kwargs):
+    async with AsyncLakeFsWrapper(configuration) as client:
+        with timed_calls(client, latency_of, latencies):
+            await operation(lake_fs_client=client, **kwargs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks avalon against LakeFS or a local stand-in server")
+    parser.add_argument("--config", help="lakectl config of the server to benchmark, "
+                                         "default is an in-process stand-in server", default=None)
+    parser.add_argument("--dataset", help="COUNT:SIZE:DEPTH of a synthetic dataset, may be repeated",
+                        action="append", default=None)
+    parser.add_argument("-j", "--concurrency", help="Number of files transferred in parallel", type=int, default=8)
+    parser.add_argument("--async", help="Use the asyncio client for put and get", action="store_true",
+                        dest="use_async")
+    parser.add_argument("-o", "--output", help="Write JSON results to this file instead of stdout", default=None)
+    args = parser.parse_args()
+
+    report = {
+        "server": "lakefs" if args.config else "standin",
+        "engine": "async" if args.use_async else "sync",
+        "concurrency": args.concurrency,
+        "python": platform.python_version(),
+        "results": [],
+    }
+    server = None if args.config else LakeFsStandIn().start()
+    try:
+        # a new process per dataset, so peak RSS is not carried over from earlier datasets
+        for dataset in args.dataset or DEFAULT_DATASETS:
+            with multiprocessing.get_context("spawn").Pool(1) as pool:
+                report["results"] += pool.apply(_run_dataset_process, (args.config, server and server.host, dataset,
+                                                                       args.concurrency, args.use_async))
+    finally:
+        if server is not None:
+            server.stop()
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,523 @@
+"""
+Minimal in-memory stand-in for the parts of the LakeFS REST API used by avalon.
+
+It is meant for benchmarks and local experiments only: there is no auth, no
+persistence and only the endpoints avalon calls are implemented.
+Requests are served by a thread each but handled one at a time.
+
+Run standalone with: python -m tst.benchmarks.lakefs_standin --port 8001
+"""
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import urllib.parse
+from email.parser import BytesParser
+from email.policy import default as default_policy
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+API_PREFIX = "/api/v1"
+
+
+class _Store:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.repos = {}
+        self.commits = {}
+        self.imports = {}
+
+    def new_commit(self, repo, parents, tree, message, metadata):
+        seed = f"{repo}{parents}{time.time_ns()}{len(self.commits)}".encode()
+        commit_id = hashlib.sha256(seed).hexdigest()
+        self.commits[(repo, commit_id)] = {
+            "id": commit_id,
+            "parents": parents,
+            "committer": "standin",
+            "message": message,
+            "creation_date": int(time.time()),
+            "meta_range_id": "",
+            "metadata": metadata or {},
+            "tree": dict(tree),
+            "seq": len(self.commits),
+        }
+        return commit_id
+
+    def resolve(self, repo, ref):
+        r = self.repos[repo]
+        if ref in r["branches"]:
+            return r["branches"][ref]["head"], r["branches"][ref]
+        if ref in r["tags"]:
+            return r["tags"][ref], None
+        if (repo, ref) in self.commits:
+            return ref, None
+        raise KeyError(ref)
+
+    def tree(self, repo, ref):
+        commit_id, branch = self.resolve(repo, ref)
+        tree = dict(self.commits[(repo, commit_id)]["tree"])
+        if branch is not None:
+            for path, obj in branch["staging"].items():
+                if obj is None:
+                    tree.pop(path, None)
+                else:
+                    tree[path] = obj
+        return tree
+
+
+def _paginate(items, after, amount, key):
+    amount = int(amount) if amount not in (None, "") else 100
+    if amount < 0:
+        amount = 1000
+    if after:
+        items = [i for i in items if key(i) > after]
+    page = items[:amount]
+    has_more = len(items) > amount
+    return {
+        "pagination": {
+            "has_more": has_more,
+            "next_offset": key(page[-1]) if page and has_more else "",
+            "results": len(page),
+            "max_per_page": 1000,
+        },
+        "results": page,
+    }
+
+
+def _object_stats(path, obj):
+    return {
+        "path": path,
+        "path_type": "object",
+        "physical_address": f"local://standin/{obj['checksum']}",
+        "checksum": obj["checksum"],
+        "size_bytes": len(obj["data"]),
+        "mtime": obj["mtime"],
+        "content_type": "application/octet-stream",
+    }
+
+
+def _make_object(data: bytes):
+    return {"data": data, "checksum": hashlib.md5(data).hexdigest(), "mtime": int(time.time())}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # headers and body are written separately, without TCP_NODELAY every response waits for a delayed ACK
+    disable_nagle_algorithm = True
+    store: _Store = None
+    routes = []
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body=None, content_type="application/json", headers=None):
+        if body is None:
+            payload = b""
+        elif isinstance(body, (bytes, bytearray)):
+            payload = bytes(body)
+        else:
+            payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(payload)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _error(self, status, message):
+        self._send(status, {"message": message})
+
+    def _read_body(self) -> bytes:
+        if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+            chunks = []
+            while True:
+                size = int(self.rfile.readline().strip().split(b";")[0], 16)
+                if size == 0:
+                    self.rfile.readline()
+                    break
+                chunks.append(self.rfile.read(size))
+                self.rfile.readline()
+            return b"".join(chunks)
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def _dispatch(self, method):
+        parsed = urllib.parse.urlparse(self.path)
+        path = parsed.path
+        if path.startswith(API_PREFIX):
+            path = path[len(API_PREFIX):]
+        query = urllib.parse.parse_qs(parsed.query)
+        q = {k: v[-1] for k, v in query.items()}
+        body = self._read_body()
+        for route_method, pattern, fn in self.routes:
+            if route_method != method:
+                continue
+            m = pattern.fullmatch(path)
+            if m:
+                params = {k: urllib.parse.unquote(v) for k, v in m.groupdict().items()}
+                try:
+                    with self.store.lock:
+                        fn(self, q=q, query=query, body=body, **params)
+                except KeyError as ex:
+                    self._error(404, f"not found: {ex}")
+                return
+        self._error(404, f"no route {method} {path}")
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def do_PUT(self):
+        self._dispatch("PUT")
+
+    def do_DELETE(self):
+        self._dispatch("DELETE")
+
+    def do_HEAD(self):
+        self._dispatch("HEAD")
+
+
+def route(method, pattern):
+    regex = re.compile(re.sub(r"{(\w+)}", r"(?P<\1>[^/]+)", pattern))
+
+    def decorator(fn):
+        _Handler.routes.append((method, regex, fn))
+        return fn
+    return decorator
+
+
+def _repo_json(repo_id, r):
+    return {"id": repo_id, "creation_date": r["creation_date"], "default_branch": "main",
+            "storage_namespace": r["storage_namespace"]}
+
+
+@route("POST", "/auth/login")
+def _login(h, **_):
+    h._send(200, {"token": "standin", "token_expiration": int(time.time()) + 3600},
+            headers={"Set-Cookie": "internal_auth_session=standin; Path=/"})
+
+
+@route("GET", "/repositories")
+def _list_repos(h, q, **_):
+    items = [_repo_json(k, v) for k, v in sorted(h.store.repos.items())]
+    h._send(200, _paginate(items, q.get("after"), q.get("amount"), lambda i: i["id"]))
+
+
+@route("POST", "/repositories")
+def _create_repo(h, body, **_):
+    req = json.loads(body)
+    if req["name"] in h.store.repos:
+        return h._error(409, "repository already exists")
+    r = {"storage_namespace": req["storage_namespace"], "creation_date": int(time.time()),
+         "branches": {}, "tags": {}}
+    h.store.repos[req["name"]] = r
+    head = h.store.new_commit(req["name"], [], {}, "Repository created", {})
+    r["branches"]["main"] = {"head": head, "staging": {}}
+    h._send(201, _repo_json(req["name"], r))
+
+
+@route("GET", "/repositories/{repository}")
+def _get_repo(h, repository, **_):
+    h._send(200, _repo_json(repository, h.store.repos[repository]))
+
+
+@route("DELETE", "/repositories/{repository}")
+def _delete_repo(h, repository, **_):
+    del h.store.repos[repository]
+    h._send(204)
+
+
+@route("GET", "/repositories/{repository}/branches")
+def _list_branches(h, repository, q, **_):
+    items = [{"id": k, "commit_id": v["head"]} for k, v in sorted(h.store.repos[repository]["branches"].items())]
+    h._send(200, _paginate(items, q.get("after"), q.get("amount"), lambda i: i["id"]))
+
+
+@route("POST", "/repositories/{repository}/branches")
+def _create_branch(h, repository, body, **_):
+    req = json.loads(body)
+    r = h.store.repos[repository]
+    if req["name"] in r["branches"]:
+        return h._error(409, "branch already exists")
+    commit_id, _ = h.store.resolve(repository, req["source"])
+    r["branches"][req["name"]] = {"head": commit_id, "staging": {}}
+    h._send(201, commit_id.encode(), content_type="text/html")
+
+
+@route("GET", "/repositories/{repository}/branches/{branch}")
+def _get_branch(h, repository, branch, **_):
+    b = h.store.repos[repository]["branches"][branch]
+    h._send(200, {"id": branch, "commit_id": b["head"]})
+
+
+@route("DELETE", "/repositories/{repository}/branches/{branch}")
+def _delete_branch(h, repository, branch, **_):
+    del h.store.repos[repository]["branches"][branch]
+    h._send(204)
+
+
+@route("POST", "/repositories/{repository}/branches/{branch}/objects")
+def _upload(h, repository, branch, q, body, **_):
+    b = h.store.repos[repository]["branches"][branch]
+    content_type = h.headers.get("Content-Type", "")
+    if content_type.startswith("multipart/form-data"):
+        msg = BytesParser(policy=default_policy).parsebytes(
+            b"Content-Type: " + content_type.encode() + b"\r\n\r\n" + body)
+        for part in msg.iter_parts():
+            body = part.get_payload(decode=True)
+    obj = _make_object(body)
+    b["staging"][q["path"]] = obj
+    h._send(201, _object_stats(q["path"], obj))
+
+
+@route("DELETE", "/repositories/{repository}/branches/{branch}/objects")
+def _delete_object(h, repository, branch, q, **_):
+    h.store.repos[repository]["branches"][branch]["staging"][q["path"]] = None
+    h._send(204)
+
+
+@route("POST", "/repositories/{repository}/branches/{branch}/objects/delete")
+def _delete_objects(h, repository, branch, body, **_):
+    staging = h.store.repos[repository]["branches"][branch]["staging"]
+    for p in json.loads(body)["paths"]:
+        staging[p] = None
+    h._send(200, {"errors": []})
+
+
+@route("POST", "/repositories/{repository}/branches/{branch}/commits")
+def _commit(h, repository, branch, body, **_):
+    req = json.loads(body)
+    b = h.store.repos[repository]["branches"][branch]
+    tree = h.store.tree(repository, branch)
+    if tree == h.store.commits[(repository, b["head"])]["tree"] and not req.get("allow_empty"):
+        return h._error(400, "commit: no changes")
+    commit_id = h.store.new_commit(repository, [b["head"]], tree, req["message"], req.get("metadata"))
+    b["head"] = commit_id
+    b["staging"] = {}
+    h._send(201, _commit_json(h.store.commits[(repository, commit_id)]))
+
+
+def _commit_json(c):
+    return {k: v for k, v in c.items() if k not in ("tree", "seq")}
+
+
+@route("GET", "/repositories/{repository}/commits/{commit_id}")
+def _get_commit(h, repository, commit_id, **_):
+    resolved, _ = h.store.resolve(repository, commit_id)
+    h._send(200, _commit_json(h.store.commits[(repository, resolved)]))
+
+
+def _touches(store, repository, commit, prefixes):
+    if not prefixes:
+        return True
+    parent_tree = store.commits[(repository, commit["parents"][0])]["tree"] if commit["parents"] else {}
+    tree = commit["tree"]
+    for path in set(tree) | set(parent_tree):
+        if tree.get(path) != parent_tree.get(path) and any(path.startswith(p) for p in prefixes):
+            return True
+    return False
+
+
+def _ancestors(store, repository, commit_id):
+    """all commits reachable from commit_id, newest first, like lakeFS log"""
+    seen, todo = {}, [commit_id]
+    while todo:
+        cid = todo.pop()
+        if cid and cid not in seen:
+            seen[cid] = store.commits[(repository, cid)]
+            todo.extend(seen[cid]["parents"])
+    return sorted(seen.values(), key=lambda c: -c["seq"])
+
+
+@route("GET", "/repositories/{repository}/refs/{ref}/commits")
+def _log(h, repository, ref, q, query, **_):
+    commit_id, _ = h.store.resolve(repository, ref)
+    prefixes = query.get("prefixes", [])
+    chain = [c for c in _ancestors(h.store, repository, commit_id) if _touches(h.store, repository, c, prefixes)]
+    after = q.get("after")
+    if after:
+        ids = [c["id"] for c in chain]
+        chain = chain[ids.index(after) + 1:] if after in ids else []
+    amount = int(q.get("amount") or 100)
+    page = chain[:amount]
+    has_more = len(chain) > amount
+    h._send(200, {
+        "pagination": {"has_more": has_more, "next_offset": page[-1]["id"] if page and has_more else "",
+                       "results": len(page), "max_per_page": 1000},
+        "results": [_commit_json(c) for c in page],
+    })
+
+
+@route("GET", "/repositories/{repository}/refs/{ref}/objects/ls")
+def _list_objects(h, repository, ref, q, **_):
+    tree = h.store.tree(repository, ref)
+    prefix = q.get("prefix", "")
+    items = [_object_stats(p, o) for p, o in sorted(tree.items()) if p.startswith(prefix)]
+    h._send(200, _paginate(items, q.get("after"), q.get("amount"), lambda i: i["path"]))
+
+
+@route("GET", "/repositories/{repository}/refs/{ref}/objects/stat")
+def _stat_object(h, repository, ref, q, **_):
+    tree = h.store.tree(repository, ref)
+    if q["path"] not in tree:
+        return h._error(404, "object not found")
+    h._send(200, _object_stats(q["path"], tree[q["path"]]))
+
+
+@route("GET", "/repositories/{repository}/refs/{ref}/objects")
+def _get_object(h, repository, ref, q, **_):
+    tree = h.store.tree(repository, ref)
+    if q["path"] not in tree:
+        return h._error(404, "object not found")
+    data = tree[q["path"]]["data"]
+    rng = h.headers.get("Range")
+    if rng:
+        start, end = rng.split("=")[1].split("-")
+        start = int(start)
+        end = min(int(end) if end else len(data) - 1, len(data) - 1)
+        return h._send(206, data[start:end + 1], content_type="application/octet-stream",
+                       headers={"Content-Range": f"bytes {start}-{end}/{len(data)}"})
+    h._send(200, data, content_type="application/octet-stream")
+
+
+@route("GET", "/repositories/{repository}/refs/{left_ref}/diff/{right_ref}")
+def _diff(h, repository, left_ref, right_ref, q, **_):
+    left = h.store.tree(repository, left_ref)
+    right = h.store.tree(repository, right_ref)
+    prefix = q.get("prefix", "")
+    items = []
+    for path in sorted(set(left) | set(right)):
+        if not path.startswith(prefix):
+            continue
+        if path not in left:
+            t = "added"
+        elif path not in right:
+            t = "removed"
+        elif left[path]["checksum"] != right[path]["checksum"]:
+            t = "changed"
+        else:
+            continue
+        size = len((right.get(path) or left.get(path))["data"])
+        items.append({"type": t, "path": path, "path_type": "object", "size_bytes": size})
+    h._send(200, _paginate(items, q.get("after"), q.get("amount"), lambda i: i["path"]))
+
+
+@route("POST", "/repositories/{repository}/refs/{source_ref}/merge/{destination_branch}")
+def _merge(h, repository, source_ref, destination_branch, body, **_):
+    req = json.loads(body) if body else {}
+    b = h.store.repos[repository]["branches"][destination_branch]
+    tree = h.store.tree(repository, destination_branch)
+    source_commit, _ = h.store.resolve(repository, source_ref)
+    # three way merge: apply source changes since the merge base
+    dest_ids = {c["id"] for c in _ancestors(h.store, repository, b["head"])}
+    base = next(c for c in _ancestors(h.store, repository, source_commit) if c["id"] in dest_ids)
+    for path, obj in h.store.tree(repository, source_ref).items():
+        if base["tree"].get(path) != obj:
+            tree[path] = obj
+    for path in base["tree"]:
+        if path not in h.store.tree(repository, source_ref):
+            tree.pop(path, None)
+    commit_id = h.store.new_commit(repository, [b["head"], source_commit], tree,
+                                   req.get("message") or f"Merge '{source_ref}' into '{destination_branch}'",
+                                   req.get("metadata"))
+    b["head"] = commit_id
+    h._send(200, {"reference": commit_id})
+
+
+@route("POST", "/repositories/{repository}/branches/{branch}/import")
+def _import_start(h, repository, branch, body, **_):
+    # imports run synchronously, only local:// sources on this machine are supported
+    req = json.loads(body)
+    b = h.store.repos[repository]["branches"][branch]
+    tree = h.store.tree(repository, branch)
+    ingested = 0
+    for location in req["paths"]:
+        source = location["path"]
+        if not source.startswith("local://"):
+            return h._error(400, f"unsupported import source: {source}")
+        root = source[len("local://"):]
+        for path in list(tree):
+            if path.startswith(location["destination"]):
+                del tree[path]
+        for directory, _, files in os.walk(root):
+            for name in files:
+                full = os.path.join(directory, name)
+                with open(full, "rb") as f:
+                    tree[location["destination"] + os.path.relpath(full, root)] = _make_object(f.read())
+                ingested += 1
+    commit_id = h.store.new_commit(repository, [b["head"]], tree, req["commit"]["message"],
+                                   req["commit"].get("metadata"))
+    b["head"] = commit_id
+    b["staging"] = {}
+    import_id = f"import-{len(h.store.imports)}"
+    h.store.imports[import_id] = {
+        "completed": True, "update_time": "2024-01-01T00:00:00Z", "ingested_objects": ingested,
+        "commit": _commit_json(h.store.commits[(repository, commit_id)])}
+    h._send(202, {"id": import_id})
+
+
+@route("GET", "/repositories/{repository}/branches/{branch}/import")
+def _import_status(h, q, **_):
+    h._send(200, h.store.imports[q["id"]])
+
+
+@route("GET", "/repositories/{repository}/tags")
+def _list_tags(h, repository, q, **_):
+    items = [{"id": k, "commit_id": v} for k, v in sorted(h.store.repos[repository]["tags"].items())]
+    h._send(200, _paginate(items, q.get("after"), q.get("amount"), lambda i: i["id"]))
+
+
+@route("POST", "/repositories/{repository}/tags")
+def _create_tag(h, repository, body, **_):
+    req = json.loads(body)
+    commit_id, _ = h.store.resolve(repository, req["ref"])
+    h.store.repos[repository]["tags"][req["id"]] = commit_id
+    h._send(201, {"id": req["id"], "commit_id": commit_id})
+
+
+class LakeFsStandIn:
+    """
+    Runs the stand-in server on a background thread.
+    Usage:
+        with LakeFsStandIn() as server:
+            config = lakefs_sdk.Configuration(host=server.host, ...)
+    """
+    def __init__(self, port: int = 0):
+        handler = type("Handler", (_Handler,), {"store": _Store()})
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def host(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_address[1]}{API_PREFIX}"
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8001)
+    server = LakeFsStandIn(port=parser.parse_args().port).start()
+    print(f"LakeFS stand-in listening on {server.host}")
+    try:
+        server._thread.join()
+    except KeyboardInterrupt:
+        server.stop()
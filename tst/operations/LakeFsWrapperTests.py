@@ -1,8 +1,10 @@
 import hashlib
+import io
 import logging
 import sys
 import unittest
 from datetime import datetime
+from unittest import mock
 
 import lakefs_sdk
 from lakefs_sdk import Configuration
@@ -46,12 +48,21 @@ class LakeFsWrapperTests(unittest.TestCase):
         lfs = LakeFsWrapper(configuration=self.get_config())
         cookies = lfs._get_login_cookie()
         self.assertIsNotNone(cookies)
+        self.assertIs(cookies, lfs._get_login_cookie())
 
     def test_ListRepositories(self):
         lfs = LakeFsWrapper(configuration=self.get_config())
         repos = lfs.list_repo()
         self.assertTrue(len(repos) > 0)
 
+    def test_RepositoryExists(self):
+        lfs = LakeFsWrapper(configuration=self.get_config())
+        repos = lfs.list_repo()
+        self.assertTrue(lfs.repository_exists(repos[0].Id))
+        self.assertTrue(lfs.branch_exists(repos[0].Id, "main"))
+        self.assertFalse(lfs.repository_exists("nonexistent-repository"))
+        self.assertFalse(lfs.branch_exists(repos[0].Id, "nonexistent-branch"))
+
     def test_CreateRepository(self):
         lfs = LakeFsWrapper(configuration=self.get_config())
         lfs.create_repository(Repository(BIGPIPELINEOPERATION, BIGPIPELINEOPERATION_NS))
@@ -80,11 +91,26 @@ class LakeFsWrapperTests(unittest.TestCase):
         lfs.upload_files(cmt.branch, cmt.repo, files, dest_paths)
         lfs.commit_files(cmt)
 
+    def test_Upload_Concurrent(self):
+        lfs = LakeFsWrapper(configuration=self.get_config())
+        rootpath = "./data/test3/"
+        files = get_filepaths(rootpath)
+        dest_paths = get_dest_filepaths(files, rootpath, "20001213/")
+
+        results = lfs.upload_files("main", BIGPIPELINEOPERATION, files, dest_paths, concurrency=4)
+        self.assertListEqual([r.dest_path for r in results], dest_paths)
+        self.assertTrue(all(r.success for r in results))
+
     def test_GetFiles(self):
         lfs = LakeFsWrapper(configuration=self.get_config())
         files = lfs.get_filelist("main", BIGPIPELINEOPERATION, "20001212")
         lfs.download_files(files, LOCALTEMPPATH, BIGPIPELINEOPERATION, "main")
 
+    def test_GetFiles_Concurrent(self):
+        lfs = LakeFsWrapper(configuration=self.get_config())
+        files = lfs.get_filelist("main", BIGPIPELINEOPERATION, "20001212")
+        lfs.download_files(files, LOCALTEMPPATH, BIGPIPELINEOPERATION, "main", concurrency=4)
+
     def test_FileIntegrityTest_Upload(self):
         lfs = LakeFsWrapper(configuration=self.get_config())
         rootpath = "./data/test4/"
@@ -118,6 +144,36 @@ class LakeFsWrapperTests(unittest.TestCase):
         self.assertEqual('7fac80f5d8c2d0baf6fca348bfca7ac2696b580b012481d40e171e2cfcc2d26b86f11b6046903e710e51aba474cf3e0347542d2fa50e4e2fa5194ed520148b81', file1_hash)
         self.assertEqual('b7c3db9e3ff6e3fe7b6d0f01a95d491fcf1d5f947878ab053c36dfd2549146ee40a3ed1ddd122b12410c11361cd3c94e1a959a11ce70888b2e31decee6388f33', biggerfile_hash)
 
+    def test_FileIntegrityTest_Download_ParallelRanges(self):
+        lfs = LakeFsWrapper(configuration=self.get_config())
+        files = lfs.get_filelist("main", BIGPIPELINEOPERATION, "integrity")
+        lfs.download_files(files, LOCALTEMPPATH, BIGPIPELINEOPERATION, "main",
+                           chunk_size=1024 * 1024, range_parallelism=4)
+
+        biggerfile_hash = self.calculateHash(LOCALTEMPPATH + "/integrity/" + "biggerfile1.zip")
+        self.assertEqual('b7c3db9e3ff6e3fe7b6d0f01a95d491fcf1d5f947878ab053c36dfd2549146ee40a3ed1ddd122b12410c11361cd3c94e1a959a11ce70888b2e31decee6388f33', biggerfile_hash)
+
+    def test_FileIntegrityTest_Download_Listed(self):
+        lfs = LakeFsWrapper(configuration=self.get_config())
+        remote_objects = list(lfs.iter_remote_objects("main", BIGPIPELINEOPERATION, "integrity"))
+        self.assertListEqual([o.path for o in remote_objects], lfs.get_filelist("main", BIGPIPELINEOPERATION, "integrity"))
+        lfs.download_files(remote_objects, LOCALTEMPPATH, BIGPIPELINEOPERATION, "main")
+
+        biggerfile_hash = self.calculateHash(LOCALTEMPPATH + "/integrity/" + "biggerfile1.zip")
+        self.assertEqual('b7c3db9e3ff6e3fe7b6d0f01a95d491fcf1d5f947878ab053c36dfd2549146ee40a3ed1ddd122b12410c11361cd3c94e1a959a11ce70888b2e31decee6388f33', biggerfile_hash)
+
+    def test_OpenFile(self):
+        lfs = LakeFsWrapper(configuration=self.get_config())
+        with lfs.open_file(BIGPIPELINEOPERATION, "main", "integrity/biggerfile1.zip", block_size=1024 * 1024) as f:
+            f.seek(-100, io.SEEK_END)
+            tail = f.read()
+            f.seek(0)
+            data = f.read()
+
+        self.assertEqual(f.size, len(data))
+        self.assertEqual(data[-100:], tail)
+        self.assertEqual('b7c3db9e3ff6e3fe7b6d0f01a95d491fcf1d5f947878ab053c36dfd2549146ee40a3ed1ddd122b12410c11361cd3c94e1a959a11ce70888b2e31decee6388f33', hashlib.sha512(data).hexdigest())
+
     #expected to fail
     def test_GetNonExistingFiles(self):
         lfs = LakeFsWrapper(configuration=self.get_config())
@@ -166,11 +222,20 @@ class LakeFsWrapperTests(unittest.TestCase):
 
         lfs.download_files(['test_changes/f2.txt'], LOCALTEMPPATH, repo, commits.results[0].id)
 
+        # commits are read across pages
+        paged_commits = list(lfs.iter_commits(repo, "main", path_in_repo.split("/"), page_size=1))
+        self.assertListEqual([c.id for c in paged_commits], [c.id for c in commits.results])
+
 
     def test_ListFiles(self):
         lfs = LakeFsWrapper(configuration=self.get_config())
         files = lfs.get_filelist("main", BIGPIPELINEOPERATION, "20001212")
 
+    def test_ListFiles_Paged(self):
+        lfs = LakeFsWrapper(configuration=self.get_config())
+        files = lfs.get_filelist("main", BIGPIPELINEOPERATION, "20001212")
+        self.assertListEqual(files, list(lfs.iter_filelist("main", BIGPIPELINEOPERATION, "20001212", page_size=1)))
+
     def calculateHash(self, path: str) -> str:
         with open(path, "rb") as f:
             file_hash = hashlib.sha512()
@@ -180,5 +245,18 @@ class LakeFsWrapperTests(unittest.TestCase):
         return file_hash.hexdigest()
 
 
+class LoginCookieTests(unittest.TestCase):
+
+    def test_login_without_token_expiration(self):
+        lfs = LakeFsWrapper(configuration=lakefs_sdk.Configuration(host="http://lakefs/api/v1", username="a",
+                                                                   password="b"))
+        response = mock.Mock(status_code=200, cookies={"internal_auth_session": "token"})
+        response.json.return_value = {}
+        with mock.patch("avalon.operations.LakeFsWrapper.requests.post", return_value=response) as post:
+            cookies = lfs._get_login_cookie()
+            self.assertIs(cookies, lfs._get_login_cookie())
+        self.assertEqual(1, post.call_count)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,134 @@
+import json
+import os
+import shutil
+import tarfile
+import tempfile
+import threading
+import unittest
+
+from avalon.operations.bundles import BundleIndex, write_bundles, is_bundle_path, is_index_path, unbundle
+from avalon.operations.files import scan_files
+
+
+class _BundleClient:
+    """
+    Serves uploaded bundles from local files and counts the ranged requests
+    """
+    def __init__(self, uploads):
+        self.paths = {u.dest_path: u.local_path for u in uploads}
+        self.ranges = []
+        self._lock = threading.Lock()
+
+    def open_file(self, repository, ref, path):
+        return open(self.paths[path], "rb")
+
+    def get_range(self, repository, ref, location, from_bytes, to_bytes):
+        with self._lock:
+            self.ranges.append((location, from_bytes, to_bytes))
+        with open(self.paths[location], "rb") as f:
+            return os.pread(f.fileno(), to_bytes - from_bytes + 1, from_bytes)
+
+
+class BundlesTests(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.src = os.path.join(self.temp_dir, "src")
+        self.work_dir = os.path.join(self.temp_dir, "work")
+        os.makedirs(self.work_dir)
+        for i in range(20):
+            os.makedirs(os.path.join(self.src, f"dir{i % 3}"), exist_ok=True)
+            with open(os.path.join(self.src, f"dir{i % 3}", f"file{i}.json"), "wb") as f:
+                f.write(os.urandom(i * 100))
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_write_bundles(self):
+        local_files = list(scan_files(self.src + "/", "result/"))
+        uploads = write_bundles(local_files, "result", self.work_dir, bundle_size=5000)
+
+        self.assertTrue(all(is_bundle_path(u.dest_path) for u in uploads))
+        self.assertTrue(is_index_path(uploads[-1].dest_path))
+        with open(uploads[-1].local_path) as f:
+            index = BundleIndex.from_json(f.read())
+        self.assertEqual(len(uploads) - 1, len(index.bundles))
+        self.assertTrue(len(index.bundles) > 1)
+        self.assertEqual({f.dest_path for f in local_files}, set(index.members))
+
+        bundle_paths = {u.dest_path: u.local_path for u in uploads}
+        for local_file in local_files:
+            member = index.members[local_file.dest_path]
+            with open(bundle_paths[member["bundle"]], "rb") as b, open(local_file.local_path, "rb") as f:
+                b.seek(member["offset"])
+                self.assertEqual(f.read(), b.read(member["size"]))
+
+        # bundles are plain tar files
+        with tarfile.open(uploads[0].local_path) as tar:
+            name = tar.getnames()[0]
+            self.assertEqual(index.members[name]["offset"], tar.getmember(name).offset_data)
+
+    def test_unbundle(self):
+        local_files = list(scan_files(self.src + "/", "result/"))
+        uploads = write_bundles(local_files, "result", self.work_dir, bundle_size=5000)
+        client = _BundleClient(uploads)
+        with open(uploads[-1].local_path) as f:
+            index = BundleIndex.from_json(f.read())
+        dest = os.path.join(self.temp_dir, "dest")
+
+        skipped = {p for i, p in enumerate(sorted(index.members, key=lambda p: index.members[p]["offset"]))
+                   if i % 5 == 2}
+        count = unbundle(client, "repo", "main", [uploads[-1].dest_path], dest,
+                         select=lambda p: p not in skipped, concurrency=4)
+
+        self.assertEqual(len(local_files) - len(skipped), count)
+        for local_file in local_files:
+            path = os.path.join(dest, local_file.dest_path)
+            if local_file.dest_path in skipped:
+                self.assertFalse(os.path.exists(path))
+                continue
+            with open(path, "rb") as a, open(local_file.local_path, "rb") as b:
+                self.assertEqual(b.read(), a.read())
+        # adjacent members are read with one request, skipped members split a bundle into runs
+        runs = 0
+        for paths in index.by_bundle(index.members).values():
+            selected = "".join("0" if p in skipped else "1" for p in paths)
+            runs += len([r for r in selected.split("0") if r])
+        self.assertEqual(runs, len(client.ranges))
+        self.assertTrue(runs < len(local_files) - len(skipped))
+
+    def test_unbundle_range_size(self):
+        local_files = list(scan_files(self.src + "/", "result/"))
+        uploads = write_bundles(local_files, "result", self.work_dir)
+        client = _BundleClient(uploads)
+        dest = os.path.join(self.temp_dir, "dest")
+
+        unbundle(client, "repo", "main", [uploads[-1].dest_path], dest, concurrency=2, range_size=4096)
+
+        self.assertTrue(len(client.ranges) > 1)
+        self.assertTrue(all(to_bytes - from_bytes < 4096 for _, from_bytes, to_bytes in client.ranges))
+
+    def test_unbundle_symlink(self):
+        target = os.path.join(self.temp_dir, "target.txt")
+        with open(target, "wb") as f:
+            f.write(b"linked content")
+        os.symlink(target, os.path.join(self.src, "dir0", "link.txt"))
+        local_files = list(scan_files(self.src + "/", "result/"))
+        uploads = write_bundles(local_files, "result", self.work_dir)
+        with open(uploads[-1].local_path) as f:
+            index = BundleIndex.from_json(f.read())
+        self.assertEqual(len(b"linked content"), index.members["result/dir0/link.txt"]["size"])
+
+        dest = os.path.join(self.temp_dir, "dest")
+        unbundle(_BundleClient(uploads), "repo", "main", [uploads[-1].dest_path], dest)
+
+        with open(os.path.join(dest, "result", "dir0", "link.txt"), "rb") as f:
+            self.assertEqual(b"linked content", f.read())
+
+    def test_index_version(self):
+        with self.assertRaises(Exception):
+            BundleIndex.from_json(json.dumps({"version": 2, "bundles": [], "members": {}}))
+
+
+if __name__ == '__main__':
+    unittest.main()
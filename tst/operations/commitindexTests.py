@@ -0,0 +1,86 @@
+import os
+import shutil
+import tempfile
+import unittest
+from types import SimpleNamespace
+
+from avalon.operations.commitindex import CommitIndex
+
+
+class _FakeCommitLog:
+    """
+    Commit log of one branch, newest first, paged like LakeFsWrapper.iter_commits. Counts the requests made.
+    """
+    def __init__(self):
+        self.commits = []
+        self.requests = []
+
+    def add_commit(self, input_commit_id: str) -> str:
+        commit_id = f"c{len(self.commits)}"
+        self.commits.insert(0, SimpleNamespace(id=commit_id, creation_date=len(self.commits),
+                                               metadata={"input_commit_id": input_commit_id}))
+        return commit_id
+
+    def iter_commits(self, repository_name: str, branch_name: str, path: [str], page_size: int = 1000,
+                     first_page_size: int = None):
+        start = 0
+        amount = min(first_page_size or page_size, page_size)
+        while True:
+            self.requests.append(amount)
+            yield from self.commits[start:start + amount]
+            start += amount
+            if start >= len(self.commits):
+                return
+            amount = min(amount * 2, page_size)
+
+
+class CommitIndexTests(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.index = CommitIndex(os.path.join(self.temp_dir, "index.sqlite"))
+        self.log = _FakeCommitLog()
+
+    def tearDown(self):
+        self.index.close()
+        shutil.rmtree(self.temp_dir)
+
+    def refresh(self) -> int:
+        self.log.requests = []
+        return self.index.refresh(self.log, "repo", "main", "result", page_size=100)
+
+    def test_refresh_unchanged_head(self):
+        for i in range(250):
+            self.log.add_commit(str(i))
+        self.assertEqual(250, self.refresh())
+        self.assertEqual([100, 100, 100], self.log.requests)
+
+        self.assertEqual(0, self.refresh())
+        self.assertEqual([1], self.log.requests)
+
+    def test_refresh_new_commits(self):
+        for i in range(250):
+            self.log.add_commit(str(i))
+        self.refresh()
+        for i in range(250, 255):
+            self.log.add_commit(str(i))
+
+        self.assertEqual(5, self.refresh())
+        self.assertEqual([1, 2, 4], self.log.requests)
+        self.assertEqual(["c252"], self.index.find("repo", "main", "result", input_commit_id="252"))
+        self.assertEqual(["c3"], self.index.find("repo", "main", "result", input_commit_id="3"))
+
+    def test_refresh_branch_reset(self):
+        for i in range(5):
+            self.log.add_commit(str(i))
+        self.refresh()
+        self.log.commits = self.log.commits[3:]
+        self.log.add_commit("new")
+
+        self.assertEqual(3, self.refresh())
+        self.assertEqual([], self.index.find("repo", "main", "result", input_commit_id="4"))
+        self.assertEqual(["c2"], self.index.find("repo", "main", "result", input_commit_id="new"))
+
+
+if __name__ == '__main__':
+    unittest.main()
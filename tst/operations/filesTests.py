@@ -0,0 +1,109 @@
+import os
+import shutil
+import tempfile
+import unittest
+from collections import deque
+from unittest import mock
+
+from avalon.operations.files import PathFilter, read_path_list, parse_shard, in_shard, scan_files, get_filepaths
+
+
+class PathFilterTests(unittest.TestCase):
+
+    def test_include_exclude(self):
+        path_filter = PathFilter(include=["data/*.parquet"], exclude=["data/year=2020/*"])
+        paths = ["data/year=2020/a.parquet", "data/year=2021/b.parquet", "data/year=2021/b.csv", "other/c.parquet"]
+        self.assertEqual(["data/year=2021/b.parquet"], list(path_filter.filter(paths)))
+
+    def test_no_patterns(self):
+        self.assertTrue(PathFilter().matches("dir/file1.txt"))
+
+    def test_paths(self):
+        path_filter = PathFilter(exclude=["*.csv"], paths=["dir/file1.txt", "dir/file2.csv"])
+        self.assertEqual(["dir/file1.txt"],
+                         list(path_filter.filter(["dir/file1.txt", "dir/file2.csv", "dir/file3.txt"])))
+
+    def test_shard(self):
+        paths = [f"dir{i % 7}/file{i}.txt" for i in range(1000)]
+        shards = [[p for p in paths if in_shard(p, (i, 4))] for i in range(4)]
+        self.assertEqual(sorted(paths), sorted(p for shard in shards for p in shard))
+        self.assertTrue(all(len(shard) > 150 for shard in shards))
+        self.assertEqual(shards[1], list(PathFilter(shard=(1, 4)).filter(paths)))
+
+    def test_parse_shard(self):
+        self.assertEqual((2, 4), parse_shard("2/4"))
+        for value in ["4/4", "1", "a/b", "0/0"]:
+            with self.assertRaises(Exception):
+                parse_shard(value)
+
+    def test_read_path_list(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(temp_dir, "paths.txt")
+            with open(path, "w") as f:
+                f.write("# selected files\n/dir/file1.txt\n\n  dir/file2.txt\n")
+            self.assertEqual(["dir/file1.txt", "dir/file2.txt"], read_path_list(path))
+        finally:
+            shutil.rmtree(temp_dir)
+
+
+
+class ScanFilesTests(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        for path in ["file1.txt", "dir1/file2.txt", "dir1/dir2/file3.txt", "dir1/file4.tmp", "cache/file5.txt",
+                     "dir3/file6.txt"]:
+            os.makedirs(os.path.dirname(os.path.join(self.temp_dir, path)), exist_ok=True)
+            with open(os.path.join(self.temp_dir, path), "w") as f:
+                f.write(path)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_order(self):
+        root = self.temp_dir + "/"
+        expected = [os.path.join(r, f) for r, _, files in os.walk(self.temp_dir) for f in files]
+        self.assertEqual(expected, get_filepaths(self.temp_dir))
+        for threads in [1, 4]:
+            local_files = list(scan_files(root, "dest/", threads=threads))
+            self.assertEqual([os.path.normpath(p) for p in expected],
+                             [os.path.normpath(f.local_path) for f in local_files])
+            self.assertEqual([os.path.join("dest", os.path.relpath(p, self.temp_dir)) for p in expected],
+                             [f.dest_path for f in local_files])
+            self.assertEqual([os.path.getsize(p) for p in expected], [f.size for f in local_files])
+
+    def test_ignore(self):
+        local_files = scan_files(self.temp_dir + "/", "dest/", ignore=["*.tmp", "cache", "dir1/dir2"])
+        self.assertEqual(["dest/dir1/file2.txt", "dest/dir3/file6.txt", "dest/file1.txt"],
+                         sorted(f.dest_path for f in local_files))
+
+    def test_many_directories(self):
+        # the look ahead of the threaded walk visits at most 2 * threads queued directories per directory,
+        # not the whole queue
+        for i in range(500):
+            os.mkdir(os.path.join(self.temp_dir, "cache", f"dir{i}"))
+        visited = []
+
+        class CountingDeque(deque):
+            def __iter__(self):
+                for item in super().__iter__():
+                    visited.append(item)
+                    yield item
+
+        with mock.patch("avalon.operations.files.deque", CountingDeque):
+            self.assertEqual(6, len(list(scan_files(self.temp_dir + "/", "dest/", threads=4))))
+        directories = 500 + 4
+        self.assertLessEqual(len(visited), 2 * 4 * directories)
+
+    def test_missing_directory(self):
+        self.assertEqual([], get_filepaths(os.path.join(self.temp_dir, "missing")))
+        self.assertEqual([], get_filepaths(os.path.join(self.temp_dir, "file1.txt")))
+
+    def test_rootpath(self):
+        with self.assertRaises(Exception):
+            list(scan_files(self.temp_dir, "dest/"))
+
+
+if __name__ == '__main__':
+    unittest.main()
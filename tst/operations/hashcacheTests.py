@@ -0,0 +1,47 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from avalon.operations.files import compute_checksum
+from avalon.operations.hashcache import HashCache
+
+
+class HashCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.cache = HashCache(os.path.join(self.temp_dir, "cache.sqlite"))
+        self.file = os.path.join(self.temp_dir, "file1.txt")
+        with open(self.file, "w") as f:
+            f.write("ver 1")
+
+    def tearDown(self):
+        self.cache.close()
+        shutil.rmtree(self.temp_dir)
+
+    def test_checksum(self):
+        self.assertEqual(compute_checksum(self.file), self.cache.checksum(self.file))
+        self.assertEqual(compute_checksum(self.file), self.cache.checksum(self.file))
+
+    def test_checksum_file_changed(self):
+        self.cache.checksum(self.file)
+        with open(self.file, "w") as f:
+            f.write("ver 22")
+        self.assertEqual(compute_checksum(self.file), self.cache.checksum(self.file))
+
+    def test_is_downloaded(self):
+        checksum = compute_checksum(self.file)
+        self.assertFalse(self.cache.is_downloaded(self.file, "repo", "dir/file1.txt", checksum))
+
+        self.cache.record_download(self.file, "repo", "main", "dir/file1.txt", checksum)
+        self.assertTrue(self.cache.is_downloaded(self.file, "repo", "dir/file1.txt", checksum))
+        self.assertFalse(self.cache.is_downloaded(self.file, "repo", "dir/file1.txt", "0" * 32))
+        self.assertEqual(("repo", "main", "dir/file1.txt", checksum), self.cache.downloaded_from(self.file))
+
+        os.remove(self.file)
+        self.assertFalse(self.cache.is_downloaded(self.file, "repo", "dir/file1.txt", checksum))
+
+
+if __name__ == '__main__':
+    unittest.main()
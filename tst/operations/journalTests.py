@@ -0,0 +1,50 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from avalon.operations.journal import DownloadJournal
+
+
+class DownloadJournalTests(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.journal = DownloadJournal(os.path.join(self.temp_dir, "journal.sqlite"))
+
+    def tearDown(self):
+        self.journal.close()
+        shutil.rmtree(self.temp_dir)
+
+    def test_resume(self):
+        self.assertEqual(set(), self.journal.start_file("repo", "c1", "dir/file1.txt", "abc", 300, resume=True))
+        self.journal.complete_range("repo", "c1", "dir/file1.txt", 0, 99)
+        self.journal.complete_range("repo", "c1", "dir/file1.txt", 200, 299)
+
+        self.assertEqual({(0, 99), (200, 299)},
+                         self.journal.start_file("repo", "c1", "dir/file1.txt", "abc", 300, resume=True))
+        self.assertFalse(self.journal.is_complete("repo", "c1", "dir/file1.txt", "abc"))
+
+    def test_restart(self):
+        self.journal.start_file("repo", "c1", "dir/file1.txt", "abc", 300, resume=True)
+        self.journal.complete_range("repo", "c1", "dir/file1.txt", 0, 99)
+
+        # partial file is gone
+        self.assertEqual(set(), self.journal.start_file("repo", "c1", "dir/file1.txt", "abc", 300, resume=False))
+        self.journal.complete_range("repo", "c1", "dir/file1.txt", 0, 99)
+        # remote object changed
+        self.assertEqual(set(), self.journal.start_file("repo", "c1", "dir/file1.txt", "def", 300, resume=True))
+
+    def test_complete(self):
+        self.journal.start_file("repo", "c1", "dir/file1.txt", "abc", 300, resume=True)
+        self.journal.complete_file("repo", "c1", "dir/file1.txt")
+        self.assertTrue(self.journal.is_complete("repo", "c1", "dir/file1.txt", "abc"))
+        self.assertFalse(self.journal.is_complete("repo", "c1", "dir/file1.txt", "def"))
+        self.assertFalse(self.journal.is_complete("repo", "c2", "dir/file1.txt", "abc"))
+
+        self.journal.discard_file("repo", "c1", "dir/file1.txt")
+        self.assertFalse(self.journal.is_complete("repo", "c1", "dir/file1.txt", "abc"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,7 +3,10 @@ import shutil
 
 from lakefs_sdk import Configuration
 
-from avalon.mainoperations import put_files, get_files, get_commit_id_by_input_commit_id, get_last_input_commit_id
+from avalon.mainoperations import put_files, get_files, get_commit_id_by_input_commit_id, get_last_input_commit_id, \
+    put_files_batch, put_files_import, put_files_commit, put_stream, put_files_bundled
+from avalon.models.pipeline import PutManifest, PutManifestEntry
+from avalon.operations.commitindex import CommitIndex
 from avalon.operations.LakeFsWrapper import LakeFsWrapper
 from avalon.operations.files import get_filepaths, create_dirs
 
@@ -92,16 +95,131 @@ class MainOperationsTests(unittest.TestCase):
                                       'result2/file1.txt'
                                       ])
 
+    def test_put_files_skip_unchanged(self):
+        lfs = LakeFsWrapper(configuration=self.get_config())
+
+        for local_path in ["./data/test3/", "./data/test3/", "./data/test2/"]:
+            put_files(local_path=local_path,
+                      repo=REPO,
+                      branch="main",
+                      remote_path="skip_unchanged",
+                      commit_id="1" * 63 + "4",
+                      pipeline_id="TestAvalon",
+                      task_docker_image="image2",
+                      task_args=[],
+                      lake_fs_client=lfs,
+                      s3storage=False,
+                      task_name="Task3",
+                      source_branch_name=None,
+                      skip_unchanged=True,
+                      delete_removed=True)
+
+        result = lfs.get_filelist("main", REPO, remote_path="skip_unchanged")
+
+        self.assertListEqual(result, [
+                                      'skip_unchanged/dir1/file2.txt',
+                                      'skip_unchanged/dir1/file3.txt',
+                                      'skip_unchanged/file1.txt'
+                                      ])
+
+    def test_put_files_import(self):
+        lfs = LakeFsWrapper(configuration=self.get_config())
+
+        # ./data is mounted at /data/import in docker-compose.test.yaml
+        put_files_import(import_from="local:///data/import/test3/",
+                         repo=REPO,
+                         branch="main",
+                         remote_path="imported",
+                         commit_id="1" * 63 + "7",
+                         pipeline_id="TestAvalon",
+                         task_docker_image="image2",
+                         task_args=[],
+                         lake_fs_client=lfs,
+                         s3storage=False,
+                         task_name="Task3",
+                         source_branch_name=None)
+
+        result = lfs.get_filelist("main", REPO, remote_path="imported")
+        self.assertListEqual(result, [
+                                      'imported/dir1/file2.txt',
+                                      'imported/dir1/file3.txt',
+                                      'imported/dir1/file4.txt',
+                                      'imported/file1.txt'
+                                      ])
+
+    def test_put_files_batch(self):
+        lfs = LakeFsWrapper(configuration=self.get_config())
+        manifest = PutManifest(repo=REPO, branch="main", entries=[
+            PutManifestEntry(local_path="./data/test1/", remote_path="batch1", task_name="Task1",
+                             pipeline_id="TestAvalon", task_image="image1", input_commit_id="1" * 63 + "5"),
+            PutManifestEntry(local_path="./data/test2/", remote_path="batch2", task_name="Task2",
+                             pipeline_id="TestAvalon", task_image="image2", input_commit_id="1" * 63 + "6")])
+
+        for isolate in [False, True]:
+            commit_ids = put_files_batch(manifest, lake_fs_client=lfs, concurrency=4, isolate=isolate)
+            self.assertTrue(set(commit_ids) <= {"main"})
+
+        self.assertTrue(len(lfs.get_filelist("main", REPO, remote_path="batch1")) > 0)
+        self.assertTrue(len(lfs.get_filelist("main", REPO, remote_path="batch2")) > 0)
+        # every task is committed with its own metadata
+        for remote_path, input_commit_id in [("batch1", "1" * 63 + "5"), ("batch2", "1" * 63 + "6")]:
+            self.assertEqual(64, len(get_commit_id_by_input_commit_id(lake_fs_client=lfs, remote_path=remote_path,
+                                                                      repo=REPO, branch="main",
+                                                                      input_commit_id=input_commit_id)))
+        self.assertNotIn("main-Task1", " ".join(b.id for b in lfs.list_branches(REPO).results))
+
+    def test_put_files_sharded(self):
+        lfs = LakeFsWrapper(configuration=self.get_config())
+        put_args = dict(local_path="./data/test3/", remote_path="sharded", repo=REPO, branch="main",
+                        task_name="TaskSharded", pipeline_id="TestAvalon", task_docker_image="image1", task_args=[],
+                        lake_fs_client=lfs, s3storage=False, commit_id="1" * 63 + "7", source_branch_name=None)
+        for i in range(3):
+            put_files(shard=(i, 3), commit=False, **put_args)
+        self.assertEqual(4, len(lfs.get_filelist("main", REPO, remote_path="sharded")))
+
+        commit = put_files_commit(repo=REPO, branch="main", task_name="TaskSharded", pipeline_id="TestAvalon",
+                                  task_docker_image="image1", task_args=[], lake_fs_client=lfs,
+                                  commit_id="1" * 63 + "7")
+        self.assertEqual(commit, lfs.get_commit_id(REPO, "main"))
+
+    def test_put_stream(self):
+        lfs = LakeFsWrapper(configuration=self.get_config())
+        chunks = [b"a" * 1024 * 1024, b"b" * 1024, b"c"]
+        commit = put_stream(iter(chunks), remote_path="stream/file1.bin", repo=REPO, branch="main",
+                            task_name="TaskStream", pipeline_id="TestAvalon", task_docker_image="image1", task_args=[],
+                            lake_fs_client=lfs, s3storage=False, commit_id="1" * 63 + "8", source_branch_name=None)
+        self.assertEqual(commit, lfs.get_commit_id(REPO, "main"))
+
+        with lfs.open_file(REPO, commit, "stream/file1.bin") as f:
+            self.assertEqual(b"".join(chunks), f.read())
+
+    def test_put_files_bundled(self):
+        lfs = LakeFsWrapper(configuration=self.get_config())
+        put_files_bundled(local_path="./data/test3/", remote_path="bundled", repo=REPO, branch="main",
+                          task_name="TaskBundled", pipeline_id="TestAvalon", task_docker_image="image1", task_args=[],
+                          lake_fs_client=lfs, s3storage=False, commit_id="1" * 63 + "9", source_branch_name=None,
+                          bundle_threshold=1024 * 1024)
+        self.assertListEqual(lfs.get_filelist("main", REPO, remote_path="bundled"),
+                             ["bundled/.avalon-bundles/bundle-00000.tar", "bundled/.avalon-bundles/index.json"])
+
+        get_files(local_path=LOCALTEMPPATH, lake_fs_client=lfs, remote_path="bundled", repo=REPO, branch="main",
+                  changes_only=False, unbundle=True)
+        result = sorted(get_filepaths(LOCALTEMPPATH + "/bundled"))
+        self.assertListEqual(result, ['./temp/bundled/dir1/file2.txt',
+                                      './temp/bundled/dir1/file3.txt',
+                                      './temp/bundled/dir1/file4.txt',
+                                      './temp/bundled/file1.txt'])
 
     def test_get_files(self):
         lfs = LakeFsWrapper(configuration=self.get_config())
 
-        get_files(local_path=LOCALTEMPPATH,
-                  lake_fs_client=lfs,
-                  remote_path="result",
-                  repo=REPO,
-                  branch="main",
-                  changes_only=False)
+        get_result = get_files(local_path=LOCALTEMPPATH,
+                               lake_fs_client=lfs,
+                               remote_path="result",
+                               repo=REPO,
+                               branch="main",
+                               changes_only=False)
+        self.assertEqual(get_result.commit_id, lfs.get_commit_id(REPO, "main"))
 
         result = get_filepaths(LOCALTEMPPATH + "/result")
         self.assertListEqual(result, [
@@ -141,6 +259,23 @@ class MainOperationsTests(unittest.TestCase):
         self.assertEqual("1" * 63 + "3", input_commit_id)
 
 
+    def test_get_commit_id_by_input_commit_id_indexed(self):
+        #need to run after test_put_files_update_files
+        lfs = LakeFsWrapper(configuration=self.get_config())
+        commit_index = CommitIndex(LOCALTEMPPATH + "/commit-index.sqlite")
+        for _ in range(2):
+            commit_id = get_commit_id_by_input_commit_id(lake_fs_client=lfs,
+                                                          remote_path="result2",
+                                                          repo=REPO,
+                                                          branch="main",
+                                                          input_commit_id="1" * 63 + "2",
+                                                          commit_index=commit_index)
+            self.assertEqual(commit_id, get_commit_id_by_input_commit_id(lake_fs_client=lfs,
+                                                                          remote_path="result2",
+                                                                          repo=REPO,
+                                                                          branch="main",
+                                                                          input_commit_id="1" * 63 + "2"))
+        commit_index.close()
 
     def remove_tempresult_folder(self):
         shutil.rmtree(LOCALTEMPPATH)
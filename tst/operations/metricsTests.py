@@ -0,0 +1,50 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from avalon.operations import metrics
+
+
+class MetricsTests(unittest.TestCase):
+
+    def tearDown(self):
+        metrics.disable()
+
+    def test_disabled(self):
+        metrics.count("files.downloaded")
+        with metrics.timer("api.get_object"):
+            pass
+        self.assertIsNone(metrics.current())
+
+    def test_counters_and_timers(self):
+        registry = metrics.enable()
+        metrics.count("bytes.downloaded", 10)
+        metrics.count("bytes.downloaded", 5)
+        for _ in range(3):
+            with metrics.timer("api.get_object"):
+                pass
+
+        snapshot = registry.snapshot()
+        self.assertEqual(15, snapshot["counters"]["bytes.downloaded"])
+        self.assertEqual(3, snapshot["timers"]["api.get_object"]["count"])
+        self.assertIn("api.get_object", registry.summary())
+
+    def test_write_prometheus(self):
+        temp_dir = tempfile.mkdtemp()
+        registry = metrics.enable()
+        metrics.count("files.downloaded", 2)
+        with metrics.timer("phase.download"):
+            pass
+        path = os.path.join(temp_dir, "avalon.prom")
+        registry.write_prometheus(path, labels={"command": "get"})
+
+        with open(path) as f:
+            content = f.read()
+        shutil.rmtree(temp_dir)
+        self.assertIn('avalon_files_downloaded_total{command="get"} 2', content)
+        self.assertIn('avalon_phase_download_seconds_count{command="get"} 1', content)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+import errno
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from avalon.operations.files import compute_checksum
+from avalon.operations.objectcache import ObjectCache
+
+
+class ObjectCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.temp_dir, "cache")
+        self.files = []
+        for i in range(3):
+            path = os.path.join(self.temp_dir, f"file{i}.txt")
+            with open(path, "w") as f:
+                f.write(f"ver {i}")
+            self.files.append((path, compute_checksum(path), os.path.getsize(path)))
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_get(self):
+        cache = ObjectCache(self.cache_dir)
+        path, checksum, size = self.files[0]
+        dest = os.path.join(self.temp_dir, "dest.txt")
+        self.assertFalse(cache.get(checksum, size, dest))
+
+        cache.put(checksum, size, path)
+        self.assertTrue(cache.get(checksum, size, dest))
+        self.assertEqual(checksum, compute_checksum(dest))
+        self.assertFalse(cache.get(checksum, size + 1, dest))
+        cache.close()
+
+    def test_get_link(self):
+        cache = ObjectCache(self.cache_dir, link=True)
+        path, checksum, size = self.files[0]
+        dest = os.path.join(self.temp_dir, "dest.txt")
+        cache.put(checksum, size, path)
+        self.assertTrue(cache.get(checksum, size, dest))
+        self.assertEqual(3, os.stat(dest).st_nlink)
+        cache.close()
+
+    def test_get_link_cross_device(self):
+        cache = ObjectCache(self.cache_dir, link=True)
+        path, checksum, size = self.files[0]
+        dest = os.path.join(self.temp_dir, "dest.txt")
+        # cache and destination on different file systems
+        with mock.patch("os.link", side_effect=OSError(errno.EXDEV, "Invalid cross-device link")):
+            cache.put(checksum, size, path)
+            self.assertTrue(cache.get(checksum, size, dest))
+        self.assertEqual(checksum, compute_checksum(dest))
+        self.assertEqual(1, os.stat(dest).st_nlink)
+        cache.close()
+
+    def test_evict_least_recently_used(self):
+        cache = ObjectCache(self.cache_dir, max_bytes=2 * self.files[0][2])
+        dest = os.path.join(self.temp_dir, "dest.txt")
+        for path, checksum, size in self.files[:2]:
+            cache.put(checksum, size, path)
+        # file0 becomes most recently used, file1 is evicted
+        self.assertTrue(cache.get(self.files[0][1], self.files[0][2], dest))
+        path, checksum, size = self.files[2]
+        cache.put(checksum, size, path)
+
+        self.assertTrue(cache.get(self.files[0][1], self.files[0][2], dest))
+        self.assertFalse(cache.get(self.files[1][1], self.files[1][2], dest))
+        self.assertTrue(cache.get(checksum, size, dest))
+        self.assertEqual(2 * size, cache.size())
+        cache.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
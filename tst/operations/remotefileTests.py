@@ -0,0 +1,60 @@
+import io
+import os
+import unittest
+
+from avalon.operations.remotefile import RemoteFile
+
+
+class _RangeClient:
+    """
+    Serves ranges of an in memory object and records every request
+    """
+    def __init__(self, data: bytes):
+        self.data = data
+        self.requests = []
+
+    def get_range(self, repository, ref, location, from_bytes, to_bytes):
+        self.requests.append((from_bytes, to_bytes))
+        return self.data[from_bytes:to_bytes + 1]
+
+
+class RemoteFileTests(unittest.TestCase):
+
+    def setUp(self):
+        self.data = os.urandom(1000)
+        self.client = _RangeClient(self.data)
+
+    def open(self, **kwargs) -> RemoteFile:
+        return RemoteFile(self.client, "repo", "c1", "dir/file1.bin", len(self.data), **kwargs)
+
+    def test_read_all(self):
+        f = self.open(block_size=64, read_ahead=3)
+        self.assertEqual(self.data, f.read())
+        self.assertEqual(b"", f.read(10))
+        # the first block is fetched alone, sequential reads fetch 1 + 3 blocks per request
+        self.assertEqual(5, len(self.client.requests))
+
+    def test_seek(self):
+        f = self.open(block_size=100)
+        f.seek(-10, io.SEEK_END)
+        self.assertEqual(self.data[-10:], f.read())
+        f.seek(95)
+        self.assertEqual(self.data[95:105], f.read(10))
+        self.assertEqual(105, f.tell())
+        # reading on from block 0 into block 1 is sequential and reads ahead 2 blocks
+        self.assertEqual([(900, 999), (0, 99), (100, 399)], self.client.requests)
+
+    def test_cache(self):
+        f = self.open(block_size=100, read_ahead=0, cache_blocks=2)
+        for offset in [0, 500, 0, 500, 900, 0]:
+            f.seek(offset)
+            self.assertEqual(self.data[offset:offset + 50], f.read(50))
+        self.assertEqual([(0, 99), (500, 599), (900, 999), (0, 99)], self.client.requests)
+
+    def test_buffered(self):
+        with io.BufferedReader(self.open(block_size=128)) as f:
+            self.assertEqual(self.data[:300], f.read(300))
+
+
+if __name__ == '__main__':
+    unittest.main()